@@ -0,0 +1,87 @@
+import warnings
+
+import numpy as np
+
+MAX_VOLUME_RATIO = 2.5  # latest day has to be the max, but not by more than this much
+CHEBY_HOLDOUT = 3  # days left out of the baseline mean/std at the end of the window
+
+
+# Detection over a whole scan at once. Every function takes a (pairs, days)
+# float array, one row per pair, with NaN where a pair has no data.
+
+
+# Total volume snapshots (pairs, blocks) -> daily volume (pairs, blocks - 1).
+# Vectorized CalculateVolFromTotalVol.
+def DailyVolumes(total_vol):
+    return np.diff(np.asarray(total_vol, dtype=np.float64), axis=1)
+
+
+# Stack tv_volume lists (None for missing) into a (pairs, blocks) array
+def TotalVolumeMatrix(tv_volumes, num_blocks):
+    matrix = np.full((len(tv_volumes), num_blocks), np.nan)
+    for i in range(0, len(tv_volumes)):
+        if tv_volumes[i] != None and len(tv_volumes[i]) == num_blocks:
+            matrix[i] = tv_volumes[i]
+
+    return matrix
+
+
+# Rows that have the latest day and at least min_history days before it.
+# min_history=None means the whole window has to be there.
+def HasHistory(vol, min_history=None):
+    days = vol.shape[1]
+    if min_history == None:
+        min_history = days - 1
+
+    return ~np.isnan(vol[:, -1]) & (np.sum(~np.isnan(vol[:, :-1]), axis=1) >= min_history)
+
+
+# "24hr volume is most in 10 day period": the latest day beats every earlier
+# day, but is less than max_ratio times the max of the days before yesterday
+def MaxVolumeHits(vol, max_ratio=MAX_VOLUME_RATIO, min_history=None):
+    days = vol.shape[1]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN rows
+        earlier_max = np.nanmax(vol[:, :days - 1], axis=1)
+        baseline_max = np.nanmax(vol[:, :days - 2], axis=1)
+
+    latest = vol[:, -1]
+    with np.errstate(invalid='ignore'):
+        hits = (latest > earlier_max) & (latest < max_ratio * baseline_max)
+
+    return hits & HasHistory(vol, min_history)
+
+
+# Chebyshev bound on how likely yesterday's and today's volume are given the
+# baseline (everything but the last 'holdout' days):
+#   k = |vol - mean| / std,  p = 1 / k^2
+# Returns a dict of (pairs,) arrays. p is NaN for rows without enough history.
+def ChebyshevScores(vol, holdout=CHEBY_HOLDOUT, min_history=None):
+    days = vol.shape[1]
+    baseline = vol[:, :days - holdout]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN rows
+        vol_mean = np.nanmean(baseline, axis=1)
+        vol_std = np.nanstd(baseline, axis=1)
+
+    yesterdays_vol_dev = vol[:, days - 2] - vol_mean
+    todays_vol_dev = vol[:, days - 1] - vol_mean
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_cheby_yesterday = 1 / (np.abs(yesterdays_vol_dev) / vol_std) ** 2
+        p_cheby_today = 1 / (np.abs(todays_vol_dev) / vol_std) ** 2
+
+    valid = HasHistory(vol, min_history)
+    p_cheby_yesterday[~valid] = np.nan
+    p_cheby_today[~valid] = np.nan
+
+    return {
+        'mean': vol_mean,
+        'std': vol_std,
+        'yesterdays_vol_dev': yesterdays_vol_dev,
+        'todays_vol_dev': todays_vol_dev,
+        'p_cheby_yesterday': p_cheby_yesterday,
+        'p_cheby_today': p_cheby_today,
+    }
@@ -0,0 +1,369 @@
+# Replay the volume detectors over months of daily volume, to see how
+# different thresholds would have done without waiting on live runs.
+#
+#   python backtest.py fetch --out history.npz --pairs 1000 --days 365 [--prices]
+#   python backtest.py synthesize --out history.npz --pairs 10000 --days 365
+#   python backtest.py from-scans --scans scans/ --out history.npz
+#   python backtest.py run --history history.npz --lookbacks 7,10,14 --max-ratios 2,2.5,3,inf
+#                          [--cheby-threshs 0.3,0.4,0.5] [--detectors max_volume,chebyshev]
+#
+# A history file is an .npz with 'ids', 'first_day' (UTC midnight of column
+# 0), 'volumes' (pairs, days) and optionally 'prices' (pairs, days, closing
+# price of token0 in token1). fetch builds one from pairDayDatas, from-scans
+# from the scanner's exported scans (see scan_export.py).
+#
+# Every day of the history is treated as "today" in turn: the window is the
+# lookback days ending that day, like a scan's vol_matrix, so the last column
+# is a whole day here instead of a partial one. Each registered detector
+# (detectors.py) is replayed on its own, over a grid of its threshold:
+#   max_volume          max_ratio      (anomaly.MaxVolumeHits)
+#   chebyshev           cheby_thresh   (detectors.ChebyshevHits)
+#   chebyshev_rising    cheby_thresh   (same, with require_rising)
+# Hits on consecutive days count separately. The whole grid comes out of one
+# pass per lookback and detector: the windows are strided views, and every
+# (pair, day) that could be a hit is reduced to the range of thresholds it's
+# a hit for, so comparing settings is just comparing numbers.
+
+import argparse
+import collections
+import json
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from anomaly import MAX_VOLUME_RATIO, CHEBY_HOLDOUT
+from detectors import DETECTORS
+from day_data import DayDataMatrices, UtcMidnight, SECONDS_PER_DAY
+from pair_table import AddressHex
+from scan_export import OpenScans
+
+LOOKBACKS = (7, 10, 14, 21, 30)  # days
+MAX_RATIOS = (1.5, 2.0, MAX_VOLUME_RATIO, 3.0, 4.0, np.inf)
+CHEBY_THRESHS = (0.2, 0.3, 0.4, 0.5, 0.6)
+HORIZONS = (1, 3, 7)  # days after the hit to measure returns over
+REPLAY_CHUNK = 1000  # pairs at a time for the windowed mean / std
+
+
+# (pairs, days) -> read-only (pairs, days - length + 1, length) view of
+# every 'length' day window, without copying
+def SlidingWindows(a, length):
+    a = np.ascontiguousarray(a)
+    pairs, days = a.shape
+    return as_strided(a, shape=(pairs, days - length + 1, length),
+                      strides=(a.strides[0], a.strides[1], a.strides[1]), writeable=False)
+
+
+# Every (pair, day) the max volume rule could flag with a lookback window,
+# whatever max_ratio is, as flat arrays:
+#   'pair', 'day'     where it is
+#   'low', 'high'     it's a hit for max_ratio in (low, high]
+def MaxVolumeEvents(vol, lookback):
+    windows = SlidingWindows(vol, lookback)
+
+    with np.errstate(invalid='ignore'):
+        baseline_max = windows[:, :, :lookback - 2].max(axis=2)  # NaN if any day is missing
+        earlier_max = np.maximum(baseline_max, windows[:, :, lookback - 2])
+        latest = vol[:, lookback - 1:]
+        pair, start = np.nonzero(latest > earlier_max)
+
+    day = start + lookback - 1
+    latest = vol[pair, day]
+    baseline_max = baseline_max[pair, start]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        min_ratio = np.where(baseline_max > 0, latest / baseline_max, np.inf)
+
+    return {
+        'pair': pair,
+        'day': day,
+        'low': min_ratio,
+        'high': np.full(len(pair), np.inf),
+    }
+
+
+# Same for a Chebyshev detector and cheby_thresh. Scores are
+# anomaly.ChebyshevScores' (the baseline leaves out the last 'holdout' days
+# and the whole window has to be there), rules are detectors.ChebyshevHits'.
+def ChebyshevEvents(vol, lookback, require_rising, holdout=CHEBY_HOLDOUT):
+    pairs, days = vol.shape
+    starts = days - lookback + 1
+
+    missing = np.zeros((pairs, days + 1), dtype=np.int64)
+    np.cumsum(np.isnan(vol), axis=1, out=missing[:, 1:])
+    complete = missing[:, lookback:] == missing[:, :starts]
+
+    vol_mean = np.empty((pairs, starts))
+    vol_std = np.empty((pairs, starts))
+    for i in range(0, pairs, REPLAY_CHUNK):
+        baseline = SlidingWindows(vol[i:i + REPLAY_CHUNK], lookback)[:, :, :lookback - holdout]
+        vol_mean[i:i + REPLAY_CHUNK] = baseline.mean(axis=2)
+        vol_std[i:i + REPLAY_CHUNK] = baseline.std(axis=2)
+
+    todays_vol_dev = vol[:, lookback - 1:] - vol_mean
+    yesterdays_vol_dev = vol[:, lookback - 2:days - 1] - vol_mean
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_cheby_today = 1 / (np.abs(todays_vol_dev) / vol_std) ** 2
+        p_cheby_yesterday = 1 / (np.abs(yesterdays_vol_dev) / vol_std) ** 2
+    p_cheby_today[~complete] = np.nan
+    p_cheby_yesterday[~complete] = np.nan
+
+    # ChebyshevHits as a range: high on both days is a hit for any threshold
+    # above today's p, otherwise yesterday's p has to stay at or above it
+    both_days = (todays_vol_dev > 0) & (yesterdays_vol_dev >= 0) & ~np.isnan(p_cheby_yesterday)
+    if require_rising:
+        both_days &= todays_vol_dev > yesterdays_vol_dev
+    cheby_high = np.where(both_days, np.inf, np.where(todays_vol_dev >= 0, p_cheby_yesterday, -np.inf))
+
+    with np.errstate(invalid='ignore'):
+        pair, start = np.nonzero(p_cheby_today < cheby_high)
+
+    return {
+        'pair': pair,
+        'day': start + lookback - 1,
+        'low': p_cheby_today[pair, start],
+        'high': cheby_high[pair, start],
+    }
+
+
+# detectors.py detector -> (the threshold the grid varies, its events for a lookback)
+REPLAYS = collections.OrderedDict([
+    ('max_volume', ('max_ratio', MaxVolumeEvents)),
+    ('chebyshev', ('cheby_thresh', lambda vol, lookback: ChebyshevEvents(vol, lookback, False))),
+    ('chebyshev_rising', ('cheby_thresh', lambda vol, lookback: ChebyshevEvents(vol, lookback, True))),
+])
+
+
+# (horizons, events) return from each event's day to 'horizon' days later,
+# NaN past the end of the history
+def ForwardReturns(prices, pair, day, horizons=HORIZONS):
+    returns = np.full((len(horizons), len(pair)), np.nan)
+    for i, horizon in enumerate(horizons):
+        ahead = day + horizon < prices.shape[1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns[i, ahead] = prices[pair[ahead], day[ahead] + horizon] / prices[pair[ahead], day[ahead]] - 1
+    returns[~np.isfinite(returns)] = np.nan
+    return returns
+
+
+# Hit counts (and forward returns, with prices) for every detector, over
+# lookbacks x its thresholds (max_ratios for max_volume, cheby_threshs for
+# the Chebyshev ones). Returns one dict per setting.
+def ReplayGrid(vol, lookbacks=LOOKBACKS, max_ratios=MAX_RATIOS, cheby_threshs=CHEBY_THRESHS, prices=None,
+               horizons=HORIZONS, detectors=None):
+    vol = np.asarray(vol, dtype=np.float64)
+    thresholds = {
+        'max_ratio': np.asarray(max_ratios, dtype=np.float64),
+        'cheby_thresh': np.asarray(cheby_threshs, dtype=np.float64),
+    }
+
+    results = []
+    for lookback in lookbacks:
+        for name in (detectors or ReplayableDetectors()):
+            setting, replay = REPLAYS[name]
+            values = thresholds[setting]
+            events = replay(vol, lookback)
+
+            # (settings, events)
+            with np.errstate(invalid='ignore'):
+                hits = (values[:, None] > events['low'][None, :]) & (values[:, None] <= events['high'][None, :])
+            counts = hits.sum(axis=1)
+
+            if prices is not None:
+                returns = ForwardReturns(prices, events['pair'], events['day'], horizons)
+                known = ~np.isnan(returns)
+                hit_matrix = hits.astype(np.float32)
+                known_counts = hit_matrix @ known.T.astype(np.float32)
+                return_sums = hit_matrix @ np.where(known, returns, 0).T.astype(np.float32)
+                wins = hit_matrix @ (returns > 0).T.astype(np.float32)
+
+            for i in range(0, len(values)):
+                result = {
+                    'detector': name,
+                    'lookback': int(lookback),
+                    setting: float(values[i]),
+                    'hits': int(counts[i]),
+                }
+                if prices is not None:
+                    for j, horizon in enumerate(horizons):
+                        known = known_counts[i, j]
+                        result['return_%dd' % horizon] = float(return_sums[i, j] / known) if known > 0 else None
+                        result['win_rate_%dd' % horizon] = float(wins[i, j] / known) if known > 0 else None
+                results.append(result)
+
+    return results
+
+
+# Registered detectors the engine knows how to replay
+def ReplayableDetectors():
+    return [name for name in DETECTORS if name in REPLAYS]
+
+
+def LoadHistory(path):
+    with np.load(path) as data:
+        history = dict((key, data[key]) for key in data.files)
+    history['first_day'] = int(history['first_day'])
+    return history
+
+
+def SaveHistory(path, ids, first_day, volumes, prices=None):
+    arrays = {'ids': np.asarray(ids), 'first_day': np.int64(first_day), 'volumes': volumes}
+    if prices is not None:
+        arrays['prices'] = prices
+    np.savez(path, **arrays)
+
+
+# The num_pairs most active pairs' finished UTC days, up to yesterday
+def FetchHistory(num_pairs, days, with_prices=False):
+    from pair_cache import PairCache
+
+    pairs = PairCache().refresh(num_pairs)
+    first_day = UtcMidnight(int(time.time())) - days * SECONDS_PER_DAY
+    volumes, prices = DayDataMatrices(pairs, first_day, days, with_prices=with_prices)
+    return [pair['id'] for pair in pairs], first_day, volumes, prices
+
+
+# Daily history stitched together from exported scans: every finished 24
+# hour column goes to the UTC day its middle falls on, later scans taking
+# over from earlier ones where they have data. Exact for day_data scans,
+# within hours for snapshot scans (their days end at the scan time).
+def HistoryFromScans(export_dir, since=None, until=None):
+    scans = [scan for scan in OpenScans(export_dir, since, until)
+             if scan.manifest['column_seconds'] == SECONDS_PER_DAY and len(scan) > 0]
+    if len(scans) == 0:
+        raise ValueError('no daily scans in %s' % export_dir)
+
+    def finished_days(scan):
+        finished = scan.column_starts + SECONDS_PER_DAY <= scan.scanned_at
+        return finished, (scan.column_starts[finished] + SECONDS_PER_DAY // 2) // SECONDS_PER_DAY
+
+    all_days = np.concatenate([finished_days(scan)[1] for scan in scans])
+    first = int(all_days.min())
+    keys = np.unique(np.concatenate([np.asarray(scan.addresses) for scan in scans]))
+    volumes = np.full((len(keys), int(all_days.max()) - first + 1), np.nan)
+
+    for scan in scans:
+        finished, days = finished_days(scan)
+        rows = np.searchsorted(keys, scan.addresses)[:, None]
+        columns = (days - first)[None, :]
+        new = scan.volumes[:, finished]
+        volumes[rows, columns] = np.where(np.isnan(new), volumes[rows, columns], new)
+
+    return [AddressHex(key) for key in keys], first * SECONDS_PER_DAY, volumes, None
+
+
+# Made up history for trying the engine out: lognormal daily volume with the
+# odd pump, where the price drifts up for a few days after the bigger ones
+def SynthesizeHistory(num_pairs, days, seed=0):
+    rng = np.random.RandomState(seed)
+
+    level = rng.lognormal(9, 2, size=(num_pairs, 1))
+    volumes = level * rng.lognormal(0, 0.5, size=(num_pairs, days))
+    pumps = rng.rand(num_pairs, days) < 0.01
+    strength = rng.uniform(1.5, 6, size=(num_pairs, days))
+    volumes[pumps] *= strength[pumps]
+
+    drift = np.zeros((num_pairs, days))
+    for lag in range(1, 4):
+        drift[:, lag:] += np.where(pumps[:, :-lag], 0.01 * (strength[:, :-lag] - 2), 0)
+    prices = np.exp(np.cumsum(rng.normal(0, 0.05, size=(num_pairs, days)) + drift, axis=1))
+
+    # some pairs only start partway through
+    created = np.where(rng.rand(num_pairs) < 0.2, rng.randint(0, days, size=num_pairs), 0)
+    missing = np.arange(0, days)[None, :] < created[:, None]
+    volumes[missing] = np.nan
+    prices[missing] = np.nan
+
+    ids = ['0x%040x' % i for i in range(0, num_pairs)]
+    first_day = UtcMidnight(int(time.time())) - days * SECONDS_PER_DAY
+    return ids, first_day, volumes, prices
+
+
+def FormatResults(results, horizons):
+    columns = ['detector', 'lookback', 'max_ratio', 'cheby_thresh', 'hits']
+    for horizon in horizons:
+        columns += ['return_%dd' % horizon, 'win_rate_%dd' % horizon]
+    columns = [column for column in columns if any(column in result for result in results)]
+
+    def cell(value):
+        if value == None:
+            return '-'
+        if isinstance(value, float):
+            return '%.4g' % value
+        return str(value)
+
+    rows = [columns] + [[cell(result.get(column)) for column in columns] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(0, len(columns))]
+    return '\n'.join('  '.join(row[i].rjust(widths[i]) for i in range(0, len(columns))) for row in rows)
+
+
+def ParseFloats(text):
+    return [float(value) for value in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the volume detectors over historical daily volume')
+    commands = parser.add_subparsers(dest='command')
+
+    fetch = commands.add_parser('fetch', help='download daily volume (and prices) from pairDayDatas')
+    fetch.add_argument('--out', required=True)
+    fetch.add_argument('--pairs', type=int, default=1000)
+    fetch.add_argument('--days', type=int, default=365)
+    fetch.add_argument('--prices', action='store_true', help='also fetch reserves for forward returns')
+
+    synthesize = commands.add_parser('synthesize', help='make up a history')
+    synthesize.add_argument('--out', required=True)
+    synthesize.add_argument('--pairs', type=int, default=10000)
+    synthesize.add_argument('--days', type=int, default=365)
+    synthesize.add_argument('--seed', type=int, default=0)
+
+    from_scans = commands.add_parser('from-scans', help='stitch a history together from exported scans')
+    from_scans.add_argument('--scans', required=True, help='export directory')
+    from_scans.add_argument('--out', required=True)
+    from_scans.add_argument('--since', type=float, default=None, help='unix time')
+    from_scans.add_argument('--until', type=float, default=None, help='unix time')
+
+    run = commands.add_parser('run', help='replay a grid of thresholds')
+    run.add_argument('--history', required=True)
+    run.add_argument('--lookbacks', default=','.join(str(lookback) for lookback in LOOKBACKS))
+    run.add_argument('--max-ratios', default=','.join(str(ratio) for ratio in MAX_RATIOS))
+    run.add_argument('--cheby-threshs', default=','.join(str(thresh) for thresh in CHEBY_THRESHS))
+    run.add_argument('--horizons', default=','.join(str(horizon) for horizon in HORIZONS))
+    run.add_argument('--detectors', default=','.join(ReplayableDetectors()))
+    run.add_argument('--json', default=None, help='also write the results here')
+
+    args = parser.parse_args()
+    if args.command == 'fetch':
+        SaveHistory(args.out, *FetchHistory(args.pairs, args.days, args.prices))
+    elif args.command == 'synthesize':
+        SaveHistory(args.out, *SynthesizeHistory(args.pairs, args.days, args.seed))
+    elif args.command == 'from-scans':
+        SaveHistory(args.out, *HistoryFromScans(args.scans, args.since, args.until))
+    elif args.command == 'run':
+        detectors = args.detectors.split(',')
+        unknown = [name for name in detectors if name not in REPLAYS]
+        if unknown:
+            parser.error('can\'t replay %s (replayable: %s)' % (', '.join(unknown), ', '.join(ReplayableDetectors())))
+
+        history = LoadHistory(args.history)
+        horizons = [int(horizon) for horizon in args.horizons.split(',')]
+
+        started = time.time()
+        results = ReplayGrid(history['volumes'], [int(lookback) for lookback in args.lookbacks.split(',')],
+                             ParseFloats(args.max_ratios), ParseFloats(args.cheby_threshs), history.get('prices'),
+                             horizons, detectors)
+        elapsed = time.time() - started
+
+        print(FormatResults(results, horizons))
+        print('%d settings over %d pairs x %d days in %.2fs' % (len(results), history['volumes'].shape[0],
+                                                                history['volumes'].shape[1], elapsed))
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+# Offline benchmark for the scanner.
+#
+# Starts fake_subgraph.py on recorded (or synthesized) fixtures, points the
+# scanner at it, and times each piece of a scan:
+#   GetFirstThousandPairs, ConvertTimeStampsToBlocks, GetVolumeStatistics
+#   and full volume_tracker scans (cold caches, then warm)
+# reporting subgraph requests, wall time, p50/p99 request latency and peak RSS
+# for each.
+#
+#   python benchmark.py synthesize --out fixtures.json --pairs 1000
+#   python benchmark.py record --out fixtures.json --pairs 1000   (hits thegraph.com)
+#   python benchmark.py run --fixtures fixtures.json --latency 0.05 --rate-limit 20
+#
+# The fake server runs in its own process so the RSS numbers are the
+# scanner's alone. Caches, history and charts go to a temp directory.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FIXTURE_DAYS = 14  # enough for LOOKBACK_PERIOD plus the timestamp grid
+FIXTURE_STEP = 60 * 60  # seconds between recorded snapshots
+
+
+# Fixtures with made up pairs and volumes. Most pairs trade at a steady
+# lognormal rate, a few pump on the last day, and some were created partway
+# through the window.
+def SynthesizeFixtures(num_pairs=1000, days=FIXTURE_DAYS, step=FIXTURE_STEP, seed=0):
+    rng = np.random.RandomState(seed)
+    now = int(time.time())
+    start = now - days * 86400
+
+    # blocks every 'step' seconds, ~13s apart with some wobble
+    blocks = [[11000000, start]]
+    for timestamp in range(start + step, now + step, step):
+        blocks.append([blocks[-1][0] + int(step / 13.0 * rng.uniform(0.9, 1.1)), timestamp])
+
+    pairs = []
+    snapshots = {}
+    for i in range(0, num_pairs):
+        pair_id = '0x%040x' % rng.randint(0, 2 ** 62)
+        created_at = start - 365 * 86400 if rng.rand() > 0.1 else int(rng.uniform(start, now - 2 * 86400))
+        pairs.append({
+            'id': pair_id,
+            'createdAtTimestamp': str(created_at),
+            'txCount': str(int(rng.lognormal(8, 1.5))),
+            'token0': {'id': '0x%040x' % (2 * i), 'symbol': 'TKA%d' % i, 'name': 'Token A %d' % i},
+            'token1': {'id': '0x%040x' % (2 * i + 1), 'symbol': 'WETH', 'name': 'Wrapped Ether'},
+        })
+
+        daily = rng.lognormal(11, 1.5)
+        pump = rng.choice([1.0, 2.0, 5.0], p=[0.9, 0.07, 0.03])
+        volume = daily * 365 if created_at < start else 0.0
+        points = []
+        for number, timestamp in blocks:
+            if timestamp < created_at:
+                continue
+            rate = daily * (pump if timestamp > now - 86400 else 1.0)
+            volume += rate * step / 86400.0 * rng.lognormal(0, 0.5)
+            points.append([number, round(volume, 6)])
+        snapshots[pair_id] = points
+
+    return {'recorded_at': now, 'pairs': pairs, 'blocks': blocks, 'snapshots': snapshots}
+
+
+# Fixtures recorded from the live subgraphs: the top pairs, the blocks every
+# 'step' seconds over 'days', and every pair's volumeUSD at each of them
+def RecordFixtures(num_pairs=1000, days=FIXTURE_DAYS, step=FIXTURE_STEP):
+    import graphqlstuff
+    from block_cache import BlockCache
+    from scan_engine import map_bounded
+
+    now = int(time.time()) - 300
+    timestamps = list(range(now - days * 86400, now + 1, step))
+
+    cache = BlockCache(':memory:')
+    numbers = []
+    for i in range(0, len(timestamps), 100):
+        numbers.extend(graphqlstuff.ConvertTimeStampsToBlocks(timestamps[i:i + 100], cache))
+
+    ids = graphqlstuff.GetTopPairIds(num_pairs)
+    pairs = graphqlstuff.GetPairsById(ids)
+    rank = dict((ids[i], len(ids) - i) for i in range(0, len(ids)))
+    for pair in pairs:
+        pair['txCount'] = str(rank[pair['id']])  # keeps the same ranking on replay
+
+    recorded = map_bounded(lambda pair: graphqlstuff.GetVolumeSnapshots(pair['id'], numbers), pairs)
+    snapshots = {}
+    for pair, volumes in zip(pairs, recorded):
+        snapshots[pair['id']] = [[number, volume] for number, volume in sorted(volumes.items()) if volume != None]
+
+    return {
+        'recorded_at': now,
+        'pairs': pairs,
+        'blocks': [[numbers[i], timestamps[i]] for i in range(0, len(numbers))],
+        'snapshots': snapshots,
+    }
+
+
+def Percentile(values, q):
+    if len(values) == 0:
+        return None
+    return float(np.percentile(values, q))
+
+
+def PeakRSSMegabytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # kB on linux
+
+
+# Records how long every subgraph request takes, as seen by the scanner
+# (including retries and rate controller waits)
+class RequestTimer(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+
+    def wrap(self, transport):
+        execute = transport.execute
+
+        def timed_execute(*args, **kwargs):
+            started = time.time()
+            try:
+                return execute(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.latencies.append(time.time() - started)
+
+        transport.execute = timed_execute
+
+    def reset(self):
+        with self.lock:
+            self.latencies = []
+
+
+class Benchmark(object):
+
+    def __init__(self, server_url, quiet=True):
+        self.server_url = server_url
+        self.quiet = quiet
+        self.timer = RequestTimer()
+        self.results = []
+
+    def server_stats(self):
+        return requests.get(self.server_url + '/stats').json()
+
+    # func may return a dict with 'failed_lookups', the lookups it gave up on
+    def stage(self, name, func):
+        requests.post(self.server_url + '/reset')
+        self.timer.reset()
+
+        started = time.time()
+        if self.quiet:
+            with contextlib.redirect_stdout(io.StringIO()):
+                counts = func()
+        else:
+            counts = func()
+        wall = time.time() - started
+
+        server = self.server_stats()
+        statuses = {}
+        for path, counts in server['requests'].items():
+            if path == '/webhook':
+                continue
+            for status, count in counts.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+        result = {
+            'stage': name,
+            'requests': sum(statuses.values()),
+            'throttled': statuses.get('429', 0),
+            'errors': statuses.get('500', 0),
+            'failed_lookups': (counts or {}).get('failed_lookups', 0),
+            'fields': server['fields'],
+            'wall_seconds': wall,
+            'latency_p50': Percentile(self.timer.latencies, 50),
+            'latency_p99': Percentile(self.timer.latencies, 99),
+            'peak_rss_mb': PeakRSSMegabytes(),
+        }
+        self.results.append(result)
+        PrintResult(result)
+        return result
+
+
+def PrintResult(result):
+    def ms(value):
+        return '-' if value == None else '%.0fms' % (value * 1000)
+
+    print('%-34s %6d req %4d 429 %4d 500 %4d failed %7.2fs  p50 %7s  p99 %7s  rss %6.1fMB' % (
+        result['stage'], result['requests'], result['throttled'], result['errors'], result['failed_lookups'],
+        result['wall_seconds'], ms(result['latency_p50']), ms(result['latency_p99']), result['peak_rss_mb']))
+
+
+def StartServer(args, port):
+    command = [sys.executable, os.path.join(REPO_DIR, 'fake_subgraph.py'), '--fixtures', os.path.abspath(args.fixtures),
+               '--port', str(port), '--latency', str(args.latency), '--jitter', str(args.jitter),
+               '--error-rate', str(args.error_rate)]
+    if args.rate_limit:
+        command += ['--rate-limit', str(args.rate_limit)]
+    if args.max_aliases:
+        command += ['--max-aliases', str(args.max_aliases)]
+
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:%d' % port
+    for i in range(0, 100):
+        try:
+            requests.get(url + '/stats', timeout=1)
+            return server, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    server.kill()
+    raise RuntimeError('fake subgraph did not start')
+
+
+def Run(args):
+    server, server_url = StartServer(args, args.port)
+    work_dir = tempfile.mkdtemp(prefix='trawler-bench-')
+
+    try:
+        # everything below reads these at import time
+        os.environ['UNISWAP_SUBGRAPH_URL'] = server_url + '/uniswap-v2'
+        os.environ['BLOCKS_SUBGRAPH_URL'] = server_url + '/ethereum-blocks'
+        os.environ['DISCORD_WEBHOOK_URL'] = server_url + '/webhook'
+        os.environ['TRAWLER_CACHE_DB'] = os.path.join(work_dir, 'cache.db')
+        os.environ['TRAWLER_HISTORY_DB'] = os.path.join(work_dir, 'history.db')
+        sys.path.insert(0, REPO_DIR)
+        os.chdir(work_dir)
+        os.mkdir('images')
+
+        import graphqlstuff
+        import volume_tracker
+        from scan_engine import map_bounded
+
+        benchmark = Benchmark(server_url, quiet=not args.verbose)
+        benchmark.timer.wrap(graphqlstuff.uni_transport)
+        benchmark.timer.wrap(graphqlstuff.eth_block_transport)
+
+        timestamps = volume_tracker.Return24hrTimestamps(int(time.time()) - 300, volume_tracker.LOOKBACK_PERIOD,
+                                                         volume_tracker.TIMESTAMP_GRID)
+        blocks = []
+        pairs = []
+
+        def list_pairs():
+            pairs[:] = graphqlstuff.GetFirstThousandPairs()[0:args.pairs]
+
+        def convert_blocks():
+            blocks[:] = graphqlstuff.ConvertTimeStampsToBlocks(timestamps)
+
+        # A pair whose requests fail past their retries counts as a failed
+        # lookup, like a chunk in the scanner, instead of ending the run
+        def volume_statistics():
+            failed = []
+
+            def fetch(pair):
+                try:
+                    return graphqlstuff.GetVolumeStatistics(pair['id'], blocks)
+                except Exception as e:
+                    print('GetVolumeStatistics failed for %s: %s' % (pair['id'], e))
+                    failed.append(pair['id'])
+                    return None
+
+            map_bounded(fetch, pairs, volume_tracker.MAX_IN_FLIGHT)
+            return {'failed_lookups': len(failed)}
+
+        benchmark.stage('GetFirstThousandPairs', list_pairs)
+        benchmark.stage('ConvertTimeStampsToBlocks (cold)', convert_blocks)
+        benchmark.stage('ConvertTimeStampsToBlocks (warm)', convert_blocks)
+        benchmark.stage('GetVolumeStatistics (cold)', volume_statistics)
+        benchmark.stage('GetVolumeStatistics (warm)', volume_statistics)
+
+        # full scans start from empty caches of their own
+        os.environ['TRAWLER_CACHE_DB'] = os.path.join(work_dir, 'scan-cache.db')
+        for module in ('block_cache', 'snapshot_store', 'graphqlstuff', 'pair_cache', 'query_planner',
+                       'block_estimator', 'volume_tracker'):
+            sys.modules.pop(module, None)
+        import graphqlstuff
+        import volume_tracker
+
+        benchmark.timer.wrap(graphqlstuff.uni_transport)
+        benchmark.timer.wrap(graphqlstuff.eth_block_transport)
+        volume_tracker.HOW_MANY_TO_SEARCH = args.pairs
+
+        scanner = volume_tracker.Scanner(image_dir=os.path.join(work_dir, 'images'))
+        for i in range(0, args.scans):
+            benchmark.stage('scan %d (%s)' % (i + 1, 'cold' if i == 0 else 'warm'), scanner.scan_once)
+        scanner.close()
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(benchmark.results, f, indent=4)
+    finally:
+        server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scanner against a local stand-in subgraph')
+    commands = parser.add_subparsers(dest='command')
+
+    synthesize = commands.add_parser('synthesize', help='make up fixtures')
+    synthesize.add_argument('--out', required=True)
+    synthesize.add_argument('--pairs', type=int, default=1000)
+    synthesize.add_argument('--days', type=int, default=FIXTURE_DAYS)
+    synthesize.add_argument('--step', type=int, default=FIXTURE_STEP)
+    synthesize.add_argument('--seed', type=int, default=0)
+
+    record = commands.add_parser('record', help='record fixtures from the live subgraphs')
+    record.add_argument('--out', required=True)
+    record.add_argument('--pairs', type=int, default=1000)
+    record.add_argument('--days', type=int, default=FIXTURE_DAYS)
+    record.add_argument('--step', type=int, default=FIXTURE_STEP)
+
+    run = commands.add_parser('run', help='run the benchmark')
+    run.add_argument('--fixtures', required=True)
+    run.add_argument('--pairs', type=int, default=1000)
+    run.add_argument('--scans', type=int, default=3)
+    run.add_argument('--port', type=int, default=8765)
+    run.add_argument('--latency', type=float, default=0.0)
+    run.add_argument('--jitter', type=float, default=0.0)
+    run.add_argument('--error-rate', type=float, default=0.0)
+    run.add_argument('--rate-limit', type=float, default=None)
+    run.add_argument('--max-aliases', type=int, default=None)
+    run.add_argument('--json', default=None, help='also write the results here')
+    run.add_argument('--verbose', action='store_true', help="don't hide the scanner's output")
+
+    args = parser.parse_args()
+
+    if args.command == 'synthesize':
+        fixtures = SynthesizeFixtures(args.pairs, args.days, args.step, args.seed)
+    elif args.command == 'record':
+        fixtures = RecordFixtures(args.pairs, args.days, args.step)
+    elif args.command == 'run':
+        Run(args)
+        return
+    else:
+        parser.print_help()
+        return
+
+    with open(args.out, 'w') as f:
+        json.dump(fixtures, f)
+    print('Wrote %d pairs, %d blocks to %s' % (len(fixtures['pairs']), len(fixtures['blocks']), args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DB_PATH = os.environ.get('TRAWLER_CACHE_DB', './cache.db')
+
+# Blocks younger than this can still be reorged out, so their timestamp->block
+# mapping isn't cached yet.
+FINALITY_SECONDS = 15 * 60
+
+
+# On-disk cache of timestamp -> first block after that timestamp.
+# Once the block is final the mapping never changes, so entries never expire.
+class BlockCache(object):
+
+    def __init__(self, path=CACHE_DB_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS block_by_timestamp (
+                timestamp INTEGER PRIMARY KEY,
+                number INTEGER NOT NULL,
+                block_timestamp INTEGER NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS block_anchors (
+                number INTEGER PRIMARY KEY,
+                timestamp INTEGER NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    # Returns {timestamp: block number} for the timestamps we already know
+    def get_many(self, timestamps):
+        timestamps = list(set(timestamps))
+        found = {}
+
+        with self.lock:
+            for i in range(0, len(timestamps), 500):  # stay under sqlite's variable limit
+                chunk = timestamps[i:i + 500]
+                rows = self.conn.execute(
+                    'SELECT timestamp, number FROM block_by_timestamp WHERE timestamp IN (%s)' % ','.join('?' * len(chunk)),
+                    chunk,
+                )
+                for timestamp, number in rows:
+                    found[timestamp] = number
+
+            self.hits += len(found)
+            self.misses += len(timestamps) - len(found)
+
+        return found
+
+    # rows = [(timestamp, block number, block timestamp), ...]
+    # Only blocks older than FINALITY_SECONDS are stored as lookups, but every
+    # block is kept as an anchor for BlockEstimator.
+    def put_many(self, rows, now=None):
+        cutoff = (now or time.time()) - FINALITY_SECONDS
+        final_rows = [row for row in rows if row[2] <= cutoff]
+
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO block_by_timestamp VALUES (?, ?, ?)', final_rows)
+            self.conn.executemany('INSERT OR REPLACE INTO block_anchors VALUES (?, ?)', [(row[1], row[2]) for row in rows])
+            self.conn.commit()
+
+    # Every block we've seen, as [(block timestamp, block number), ...] in block order
+    def anchors(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT timestamp, number FROM block_anchors ORDER BY number')
+            return [(timestamp, number) for timestamp, number in rows]
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
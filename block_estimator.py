@@ -0,0 +1,126 @@
+import bisect
+import math
+import time
+
+import graphqlstuff
+from block_cache import FINALITY_SECONDS
+
+AVERAGE_BLOCK_TIME = 13.0  # seconds, only used until we have two anchors
+BLOCK_TIME_CV = 1.0  # std / mean of a single block time (~1 for proof of work)
+BLOCK_TIME_DRIFT = 0.02  # how far the average block time can wander when extrapolating
+BLOCK_TIME_WINDOW = 7 * 24 * 60 * 60  # average block time over the last week of anchors
+
+
+# Estimates timestamp -> first block after that timestamp by interpolating
+# between anchor blocks we already know (the block cache's anchors).
+# The estimate is always kept inside the anchors that bracket it, and an
+# error bound in blocks comes back with it: block times add up like a random
+# walk, so the bound is ~2 standard deviations of that walk at the estimate's
+# distance from its anchors. Only timestamps whose bound is bigger than
+# max_error_blocks go to the blocks subgraph.
+class BlockEstimator(object):
+
+    def __init__(self, max_error_blocks=50, cv=BLOCK_TIME_CV, drift=BLOCK_TIME_DRIFT, cache=None):
+        self.max_error_blocks = max_error_blocks
+        self.cv = cv
+        self.drift = drift
+        self.cache = cache or graphqlstuff.block_cache
+
+        # estimates for final timestamps, so they don't move between scans
+        self.estimates = {}
+
+        self.estimated = 0
+        self.fetched = 0
+
+        self.reload()
+
+    def reload(self):
+        anchors = self.cache.anchors()
+        self.anchor_times = [anchor[0] for anchor in anchors]
+        self.anchor_blocks = [anchor[1] for anchor in anchors]
+
+    def average_block_time(self):
+        if len(self.anchor_blocks) < 2:
+            return AVERAGE_BLOCK_TIME
+
+        i = bisect.bisect_left(self.anchor_times, self.anchor_times[-1] - BLOCK_TIME_WINDOW)
+        i = min(i, len(self.anchor_blocks) - 2)
+        return (self.anchor_times[-1] - self.anchor_times[i]) / float(self.anchor_blocks[-1] - self.anchor_blocks[i])
+
+    # error bound for an estimate 'distance' blocks away from an anchor
+    def error_bound(self, distance, extrapolating):
+        error = 2 * self.cv * math.sqrt(max(distance, 0)) + 1
+        if extrapolating:
+            error += self.drift * distance
+        return error
+
+    # Returns (estimated block, error bound in blocks)
+    def estimate(self, timestamp):
+        if len(self.anchor_blocks) == 0:
+            return None, float('inf')
+
+        block_time = self.average_block_time()
+
+        # anchor_times[i - 1] <= timestamp < anchor_times[i], so the answer is in (block i - 1, block i]
+        i = bisect.bisect_right(self.anchor_times, timestamp)
+
+        if i == len(self.anchor_blocks):  # after the newest anchor
+            t0, n0 = self.anchor_times[-1], self.anchor_blocks[-1]
+            block = n0 + int((timestamp - t0) / block_time) + 1
+            return block, self.error_bound(block - n0, True)
+
+        if i == 0:  # before the oldest anchor
+            t1, n1 = self.anchor_times[0], self.anchor_blocks[0]
+            block = min(n1, n1 - int((t1 - timestamp) / block_time))
+            return block, self.error_bound(n1 - block, True)
+
+        t0, n0 = self.anchor_times[i - 1], self.anchor_blocks[i - 1]
+        t1, n1 = self.anchor_times[i], self.anchor_blocks[i]
+
+        block = n0 + int((timestamp - t0) * (n1 - n0) / float(t1 - t0)) + 1
+        block = max(n0 + 1, min(n1, block))
+
+        # the walk is pinned at both anchors, which shrinks the spread in between
+        d0, d1 = block - n0, n1 - block
+        walk_error = self.error_bound(d0 * d1 / float(d0 + d1) if d1 > 0 else 0, False)
+        bracket_error = max(d0 - 1, d1)
+        return block, min(walk_error, bracket_error)
+
+    # Drop-in replacement for ConvertTimeStampsToBlocks
+    def convert(self, timestamps, now=None):
+        now = now or time.time()
+        known = self.cache.get_many(timestamps)
+
+        to_fetch = []
+        for timestamp in timestamps:
+            if timestamp in known:
+                continue
+            if timestamp in self.estimates:
+                known[timestamp] = self.estimates[timestamp]
+                continue
+
+            block, error = self.estimate(timestamp)
+            if error > self.max_error_blocks:
+                to_fetch.append(timestamp)
+                continue
+
+            known[timestamp] = block
+            self.estimated += 1
+            if timestamp <= now - FINALITY_SECONDS:
+                self.estimates[timestamp] = block
+
+        if len(to_fetch) > 0:
+            blocks = graphqlstuff.ConvertTimeStampsToBlocks(to_fetch, self.cache)
+            known.update(zip(to_fetch, blocks))
+            self.fetched += len(to_fetch)
+            self.reload()
+
+        return [known[timestamp] for timestamp in timestamps]
+
+    def stats(self):
+        return {
+            'estimated': self.estimated,
+            'fetched': self.fetched,
+            'anchors': len(self.anchor_blocks),
+            'average_block_time': self.average_block_time(),
+        }
@@ -0,0 +1,91 @@
+import hashlib
+import multiprocessing
+import os
+
+import numpy as np
+
+IMAGE_DIR = './images/'
+
+
+def InitRenderWorker():
+    import matplotlib
+    matplotlib.use('Agg')  # headless, and no pyplot state shared with the scanner
+
+
+# Runs in a worker process
+def RenderChart(path, title, vol, figsize):
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=figsize)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.bar(np.arange(0, len(vol)), vol)
+    ax.set_title(title)
+    fig.savefig(path)
+    plt.close(fig)
+
+    return path
+
+
+# Renders volume bar charts in a pool of worker processes, so plotting never
+# holds up the scan. submit() only queues the chart, and a chart whose volume
+# vector hasn't changed since its last render is skipped.
+class ChartRenderer(object):
+
+    def __init__(self, processes=2, image_dir=IMAGE_DIR, figsize=None):
+        self.image_dir = image_dir
+        self.figsize = figsize
+
+        # spawn, not fork: the scanner has request threads running
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(processes, initializer=InitRenderWorker)
+
+        self.digests = {}  # path -> digest of the volume vector last rendered there
+        self.pending = []
+
+        self.rendered = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def submit(self, name, vol):
+        path = os.path.join(self.image_dir, name)
+        vol = np.asarray(vol, dtype=np.float64)
+        digest = hashlib.sha1(vol.tobytes()).hexdigest()
+
+        if self.digests.get(path) == digest and os.path.exists(path + '.png'):
+            self.skipped += 1
+            return
+
+        self.digests[path] = digest
+        self.pending.append((path, self.pool.apply_async(RenderChart, (path, name, vol, self.figsize))))
+        self.collect()
+
+    # Check on finished renders without waiting for the rest
+    def collect(self, wait=False):
+        still_pending = []
+        for path, result in self.pending:
+            if not wait and not result.ready():
+                still_pending.append((path, result))
+                continue
+
+            try:
+                result.get()
+                self.rendered += 1
+            except Exception as e:
+                print('Could not render chart %s: %s' % (path, e))
+                self.digests.pop(path, None)
+                self.failed += 1
+
+        self.pending = still_pending
+
+    def close(self):
+        self.collect(wait=True)
+        self.pool.close()
+        self.pool.join()
+
+    def stats(self):
+        return {
+            'rendered': self.rendered,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'pending': len(self.pending),
+        }
@@ -0,0 +1,83 @@
+import time
+
+import numpy as np
+
+import graphqlstuff
+from block_cache import FINALITY_SECONDS
+from scan_engine import map_bounded, MAX_IN_FLIGHT
+
+SECONDS_PER_DAY = 24 * 60 * 60
+DAY_DATA_GROUP = 100  # pairs per pairAddress_in filter
+
+
+def UtcMidnight(timestamp):
+    return timestamp - timestamp % SECONDS_PER_DAY
+
+
+# (pairs, num_days) daily volume from pairDayDatas for the num_days UTC days
+# starting at first_day, DAY_DATA_GROUP pairs per request. Days a pair didn't
+# trade are 0, days before it was created are NaN. with_prices also returns
+# each day's closing price of token0 in token1 (reserve1 / reserve0), carried
+# over days without trades, otherwise None.
+def DayDataMatrices(pairs, first_day, num_days, with_prices=False, uni_client=None, max_in_flight=MAX_IN_FLIGHT):
+    ids = [pair['id'] for pair in pairs]
+    row = dict((ids[i], i) for i in range(0, len(ids)))
+
+    vol = np.zeros((len(ids), num_days))
+    prices = np.full((len(ids), num_days), np.nan) if with_prices else None
+
+    groups = [ids[i:i + DAY_DATA_GROUP] for i in range(0, len(ids), DAY_DATA_GROUP)]
+    day_datas = map_bounded(lambda group: list(graphqlstuff.IterPairDayDatas(group, first_day, uni_client=uni_client,
+                                                                             with_reserves=with_prices)),
+                            groups, max_in_flight)
+    for days in day_datas:
+        for day in days:
+            column = (int(day['date']) - first_day) // SECONDS_PER_DAY
+            if day['pairAddress'] in row and 0 <= column < num_days:
+                vol[row[day['pairAddress']], column] = float(day['dailyVolumeUSD'])
+                if with_prices and float(day['reserve0']) > 0:
+                    prices[row[day['pairAddress']], column] = float(day['reserve1']) / float(day['reserve0'])
+
+    for i in range(0, len(ids)):
+        created_column = (UtcMidnight(int(pairs[i].get('createdAtTimestamp') or 0)) - first_day) // SECONDS_PER_DAY
+        if created_column > 0:
+            vol[i, :min(created_column, num_days)] = np.nan
+
+    if with_prices:
+        # carry the last close forward over days without an entry
+        seen = np.where(np.isnan(prices), 0, np.arange(0, num_days))
+        prices = prices[np.arange(0, len(ids))[:, None], np.maximum.accumulate(seen, axis=1)]
+
+    return vol, prices
+
+
+# Daily volume from the subgraph's pairDayDatas instead of block snapshots.
+# Returns a (pairs, num_days) array for the num_days UTC days ending today:
+# finished days come straight from pairDayDatas (see DayDataMatrices), and
+# today's partial volume is the live volumeUSD minus volumeUSD at today's
+# first block. That first-block snapshot goes through the planner, and is
+# stored once midnight is FINALITY_SECONDS old, so it is only fetched about
+# once a day per pair.
+# Days a pair didn't trade are 0, days before it was created are NaN.
+def DayDataVolumes(pairs, midnight, midnight_block, num_days, planner, uni_client=None, max_in_flight=MAX_IN_FLIGHT):
+    ids = [pair['id'] for pair in pairs]
+    first_day = midnight - (num_days - 1) * SECONDS_PER_DAY
+    vol, _ = DayDataMatrices(pairs, first_day, num_days, uni_client=uni_client, max_in_flight=max_in_flight)
+
+    # head of today from one live snapshot, where we can
+    current = graphqlstuff.GetCurrentVolumes(ids, uni_client)
+    final_block = midnight_block if time.time() - midnight >= FINALITY_SECONDS else midnight_block - 1
+    at_midnight = dict(planner.iter_volume_statistics(ids, [midnight_block], final_block=final_block))
+
+    for i in range(0, len(ids)):
+        created_at = int(pairs[i].get('createdAtTimestamp') or 0)
+        live = current.get(ids[i])
+        start = at_midnight.get(ids[i])
+
+        if live != None and start != None:
+            vol[i, -1] = live - start[0]
+        elif live != None and created_at >= midnight:
+            vol[i, -1] = live  # created today
+        # otherwise keep pairDayDatas' figure for today
+
+    return vol
@@ -0,0 +1,64 @@
+import collections
+
+import numpy as np
+
+from anomaly import MaxVolumeHits, ChebyshevScores
+
+# name -> {'func': detector, 'description': ...}, in registration order
+DETECTORS = collections.OrderedDict()
+
+
+# Register a detector. A detector takes the (pairs, days) daily volume array
+# every detector shares and returns a boolean (pairs,) array of hits, so
+# adding one costs CPU only, no more requests.
+def RegisterDetector(name, description):
+    def register(func):
+        DETECTORS[name] = {'func': func, 'description': description}
+        return func
+
+    return register
+
+
+# Run every registered detector (or just 'names') over the same volumes.
+# Returns {name: hits}
+def RunDetectors(vol, names=None):
+    results = collections.OrderedDict()
+    for name in (names or DETECTORS.keys()):
+        results[name] = DETECTORS[name]['func'](vol)
+
+    return results
+
+
+@RegisterDetector('max_volume', '24hr volume is most in 10 day period')
+def MaxVolumeDetector(vol):
+    return MaxVolumeHits(vol)
+
+
+# Anomalously high volume yesterday that kept up today, or anomalously high
+# volume today only
+@RegisterDetector('chebyshev', 'Yesterday and today (or just today) volume is anomalously high')
+def ChebyshevDetector(vol, cheby_thresh=0.4):
+    return ChebyshevHits(ChebyshevScores(vol), cheby_thresh, False)
+
+
+# Same, but only when today's volume is higher than yesterday's, since
+# otherwise it was probably already pumped
+@RegisterDetector('chebyshev_rising', 'Anomalously high volume that is still rising today')
+def ChebyshevRisingDetector(vol, cheby_thresh=0.5):
+    return ChebyshevHits(ChebyshevScores(vol), cheby_thresh, True)
+
+
+def ChebyshevHits(scores, cheby_thresh, require_rising):
+    p_cheby_yesterday = scores['p_cheby_yesterday']
+    p_cheby_today = scores['p_cheby_today']
+    yesterdays_vol_dev = scores['yesterdays_vol_dev']
+    todays_vol_dev = scores['todays_vol_dev']
+
+    both_days = ((p_cheby_yesterday < cheby_thresh) & (yesterdays_vol_dev >= 0)
+                 & (p_cheby_today < cheby_thresh) & (todays_vol_dev > 0))
+    if require_rising:
+        both_days &= todays_vol_dev > yesterdays_vol_dev
+
+    today_only = (p_cheby_today < cheby_thresh) & (p_cheby_yesterday >= cheby_thresh) & (todays_vol_dev >= 0)
+
+    return np.asarray(both_days | today_only)
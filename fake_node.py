@@ -0,0 +1,139 @@
+# Local stand-in for an Ethereum node's websocket, for trying out streaming
+# mode (streaming.py) without a real node. Publishes a newHeads notification
+# every --block-time seconds and answers eth_getLogs with made up Uniswap V2
+# Swap logs: each pair in the filter swaps in a block with probability
+# --swap-rate. Block numbers and timestamps follow the fixtures, shifted to
+# now like fake_subgraph.py, so the two agree.
+#
+#   python fake_node.py --fixtures fixtures.json --port 8546
+#   TRAWLER_ETH_WS_URL=ws://127.0.0.1:8546 python volume_tracker.py
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import websockets
+
+from fake_subgraph import Interpolate
+from streaming import SWAP_TOPIC
+
+DEFAULT_PORT = 8546
+
+
+class FakeNode(object):
+
+    def __init__(self, fixtures, block_time=13.0, swap_rate=0.05):
+        self.block_time = block_time
+        self.swap_rate = swap_rate
+
+        offset = int(time.time()) - fixtures['recorded_at']
+        blocks = sorted(fixtures['blocks'])
+        self.block_numbers = [block[0] for block in blocks]
+        self.block_timestamps = [block[1] + offset for block in blocks]
+
+        self.head = int(Interpolate(self.block_timestamps, self.block_numbers, time.time()))
+        self.subscribers = {}  # websocket -> subscription id
+        self.next_subscription = 1
+
+    def block_timestamp(self, number):
+        return int(Interpolate(self.block_numbers, self.block_timestamps, number))
+
+    def header(self, number):
+        return {
+            'number': hex(number),
+            'hash': '0x%064x' % number,
+            'parentHash': '0x%064x' % (number - 1),
+            'timestamp': hex(self.block_timestamp(number)),
+        }
+
+    # Same answer every time for the same block and filter
+    def logs(self, from_block, to_block, addresses):
+        logs = []
+        for number in range(from_block, min(to_block, self.head) + 1):
+            rng = random.Random(number)
+            for address in addresses:
+                if rng.random() < self.swap_rate:
+                    logs.append({
+                        'address': address,
+                        'blockNumber': hex(number),
+                        'blockHash': '0x%064x' % number,
+                        'topics': [SWAP_TOPIC],
+                        'data': '0x',
+                        'logIndex': hex(len(logs)),
+                    })
+        return logs
+
+    def answer(self, websocket, request):
+        method = request.get('method')
+        params = request.get('params') or []
+
+        if method == 'eth_subscribe' and params[:1] == ['newHeads']:
+            subscription = hex(self.next_subscription)
+            self.next_subscription += 1
+            self.subscribers[websocket] = subscription
+            return subscription
+        if method == 'eth_blockNumber':
+            return hex(self.head)
+        if method == 'eth_getLogs':
+            log_filter = params[0]
+            if SWAP_TOPIC not in (log_filter.get('topics') or [None])[0:1]:
+                return []
+            addresses = log_filter.get('address') or []
+            if isinstance(addresses, str):
+                addresses = [addresses]
+            return self.logs(int(log_filter['fromBlock'], 16), int(log_filter['toBlock'], 16),
+                             [address.lower() for address in addresses])
+
+        raise ValueError('the method %s does not exist/is not available' % method)
+
+    async def handle(self, websocket, path=None):
+        try:
+            async for message in websocket:
+                request = json.loads(message)
+                response = {'jsonrpc': '2.0', 'id': request.get('id')}
+                try:
+                    response['result'] = self.answer(websocket, request)
+                except Exception as e:
+                    response['error'] = {'code': -32601, 'message': str(e)}
+                await websocket.send(json.dumps(response))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.subscribers.pop(websocket, None)
+
+    async def publish(self):
+        while True:
+            await asyncio.sleep(self.block_time)
+            self.head += 1
+            header = self.header(self.head)
+
+            for websocket, subscription in list(self.subscribers.items()):
+                notification = {'jsonrpc': '2.0', 'method': 'eth_subscription',
+                                'params': {'subscription': subscription, 'result': header}}
+                try:
+                    await websocket.send(json.dumps(notification))
+                except websockets.ConnectionClosed:
+                    self.subscribers.pop(websocket, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish fake new blocks and swap logs over a websocket')
+    parser.add_argument('--fixtures', required=True)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--block-time', type=float, default=13.0, help='seconds between blocks')
+    parser.add_argument('--swap-rate', type=float, default=0.05, help='chance a pair swaps in a block')
+    args = parser.parse_args()
+
+    with open(args.fixtures, 'r') as f:
+        node = FakeNode(json.load(f), args.block_time, args.swap_rate)
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(websockets.serve(node.handle, '127.0.0.1', args.port))
+    print('Publishing blocks from %d on port %d' % (node.head, args.port))
+    loop.run_until_complete(node.publish())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+# Local stand-in for the uniswap-v2 and ethereum-blocks subgraphs, for
+# benchmarking the scanner without touching thegraph.com.
+#
+# Serves recorded (or synthesized) fixtures:
+#   pairs(first, orderBy, orderDirection, where: {id_gt, id_in, createdAtTimestamp_gte})
+#   pair(id, block: {number})   volumeUSD interpolated between recorded snapshots
+#   pairDayDatas(first, where: {pairAddress_in, date_gte, id_gt})   from the same snapshots
+#   pairHourDatas(first, where: {pair_in, hourStartUnix_gte, id_gt})   likewise
+#   blocks(first, where: {timestamp_gt})   interpolated between recorded blocks
+# with optional latency, random 500s, a rate limit (429 + Retry-After) and a
+# cap on aliases per document.
+#
+#   POST /uniswap-v2        uniswap subgraph
+#   POST /ethereum-blocks   blocks subgraph
+#   POST /webhook           stand-in Discord webhook (204)
+#   GET  /stats             request counts and latencies
+#   POST /reset             zero the stats
+#
+# Fixture timestamps are shifted so the newest one is "now" when the server
+# starts, so a recording replays the same way whenever it is run.
+
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from graphql.language.parser import parse
+
+DEFAULT_PORT = 8765
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+# Turn a graphql AST value into a python value, filling in variables
+def ValueOf(node, variables):
+    kind = type(node).__name__
+    if kind.startswith('Variable'):
+        return variables.get(node.name.value)
+    if kind.startswith('IntValue'):
+        return int(node.value)
+    if kind.startswith('FloatValue'):
+        return float(node.value)
+    if kind.startswith('BooleanValue'):
+        return node.value
+    if kind.startswith('NullValue'):
+        return None
+    if kind.startswith('ListValue'):
+        return [ValueOf(value, variables) for value in node.values]
+    if kind.startswith('ObjectValue'):
+        return dict((field.name.value, ValueOf(field.value, variables)) for field in node.fields)
+    return node.value  # strings and enums
+
+
+def ArgumentsOf(field, variables):
+    return dict((argument.name.value, ValueOf(argument.value, variables)) for argument in (field.arguments or []))
+
+
+# Keep only the fields the query selected, under their aliases
+def Project(value, selection_set):
+    if value == None or selection_set == None:
+        return value
+    if isinstance(value, list):
+        return [Project(item, selection_set) for item in value]
+
+    result = {}
+    for field in selection_set.selections:
+        key = field.alias.value if field.alias else field.name.value
+        result[key] = Project(value.get(field.name.value), field.selection_set)
+    return result
+
+
+# Piecewise linear through (xs, ys), extending the end segments
+def Interpolate(xs, ys, x):
+    if len(xs) == 1:
+        return ys[0]
+
+    i = bisect.bisect_right(xs, x)
+    i = min(max(i, 1), len(xs) - 1)
+    x0, x1 = xs[i - 1], xs[i]
+    y0, y1 = ys[i - 1], ys[i]
+    return y0 + (y1 - y0) * (x - x0) / float(x1 - x0)
+
+
+# Token bucket, 'rate' requests per second
+class RateLimit(object):
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class FakeSubgraph(object):
+
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None, max_aliases=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = RateLimit(rate_limit) if rate_limit else None
+        self.max_aliases = max_aliases
+
+        self.offset = int(time.time()) - fixtures['recorded_at']
+
+        self.pairs = []
+        for pair in fixtures['pairs']:
+            pair = dict(pair)
+            pair['createdAtTimestamp'] = str(int(pair['createdAtTimestamp']) + self.offset)
+            self.pairs.append(pair)
+        self.pairs_by_id = dict((pair['id'], pair) for pair in self.pairs)
+
+        blocks = sorted(fixtures['blocks'])
+        self.block_numbers = [block[0] for block in blocks]
+        self.block_timestamps = [block[1] + self.offset for block in blocks]
+
+        self.snapshots = {}  # pair -> (blocks, volumes), empty before the pair existed
+        for pair_id, points in fixtures['snapshots'].items():
+            points = sorted(points)
+            self.snapshots[pair_id] = ([point[0] for point in points], [point[1] for point in points])
+
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}  # path -> {status: count}
+            self.latencies = []
+            self.fields = 0
+
+    def count(self, path, status, started):
+        with self.lock:
+            counts = self.requests.setdefault(path, {})
+            counts[status] = counts.get(status, 0) + 1
+            self.latencies.append(time.time() - started)
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                'requests': self.requests,
+                'fields': self.fields,
+                'latency_p50': latencies[len(latencies) // 2] if latencies else None,
+                'latency_p99': latencies[int(len(latencies) * 0.99)] if latencies else None,
+            }
+
+    # Returns (status, headers, body)
+    def handle(self, body):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        if self.rate_limit and not self.rate_limit.take():
+            return 429, {'Retry-After': '1'}, {'errors': [{'message': 'Too many requests'}]}
+        if random.random() < self.error_rate:
+            return 500, {}, {'errors': [{'message': 'Internal server error'}]}
+
+        try:
+            request = json.loads(body)
+            document = parse(request['query'])
+            variables = request.get('variables') or {}
+
+            selections = document.definitions[0].selection_set.selections
+            if self.max_aliases and len(selections) > self.max_aliases:
+                return 200, {}, {'errors': [{'message': 'Query too complex: %d fields' % len(selections)}]}
+
+            data = {}
+            for field in selections:
+                key = field.alias.value if field.alias else field.name.value
+                value = self.resolve(field.name.value, ArgumentsOf(field, variables))
+                data[key] = Project(value, field.selection_set)
+
+            with self.lock:
+                self.fields += len(selections)
+            return 200, {}, {'data': data}
+        except Exception as e:
+            return 200, {}, {'errors': [{'message': '%s: %s' % (type(e).__name__, e)}]}
+
+    def resolve(self, name, args):
+        if name == 'pairs':
+            return self.resolve_pairs(args)
+        if name == 'pair':
+            return self.resolve_pair(args)
+        if name == 'blocks':
+            return self.resolve_blocks(args)
+        if name == 'pairDayDatas':
+            return self.resolve_pair_day_datas(args)
+        if name == 'pairHourDatas':
+            return self.resolve_pair_hour_datas(args)
+        raise ValueError('Type `Query` has no field `%s`' % name)
+
+    def resolve_pairs(self, args):
+        where = args.get('where') or {}
+        pairs = self.pairs
+
+        if 'id_in' in where:
+            ids = set(where['id_in'])
+            pairs = [pair for pair in pairs if pair['id'] in ids]
+        if 'id_gt' in where:
+            pairs = [pair for pair in pairs if pair['id'] > where['id_gt']]
+        if 'createdAtTimestamp_gte' in where:
+            since = int(where['createdAtTimestamp_gte'])
+            pairs = [pair for pair in pairs if int(pair['createdAtTimestamp']) >= since]
+
+        order_by = args.get('orderBy')
+        if order_by != None:
+            numeric = order_by != 'id'
+            pairs = sorted(pairs, key=lambda pair: float(pair[order_by]) if numeric else pair[order_by],
+                           reverse=args.get('orderDirection') == 'desc')
+
+        head = self.head_block()
+        return [dict(pair, volumeUSD=self.volume_at(pair['id'], head)) for pair in pairs[:int(args.get('first', 100))]]
+
+    def resolve_pair(self, args):
+        pair = self.pairs_by_id.get(args['id'])
+        if pair == None:
+            return None
+
+        block = args.get('block')
+        if block == None:
+            return pair
+
+        volume = self.volume_at(pair['id'], int(block['number']))
+        if volume == None:
+            return None  # didn't exist yet
+        return dict(pair, volumeUSD=volume)
+
+    def resolve_pair_day_datas(self, args):
+        where = args.get('where') or {}
+        buckets = self.bucket_volumes(where.get('pairAddress_in', []), int(where.get('date_gte', 0)), 86400)
+        days = [{'id': bucket_id, 'pairAddress': pair_id, 'date': start, 'dailyVolumeUSD': volume}
+                for bucket_id, pair_id, start, volume in buckets]
+        return self.page(days, args)
+
+    def resolve_pair_hour_datas(self, args):
+        where = args.get('where') or {}
+        buckets = self.bucket_volumes(where.get('pair_in', []), int(where.get('hourStartUnix_gte', 0)), 3600)
+        hours = [{'id': bucket_id, 'pair': {'id': pair_id}, 'hourStartUnix': start, 'hourlyVolumeUSD': volume}
+                 for bucket_id, pair_id, start, volume in buckets]
+        return self.page(hours, args)
+
+    # [(id, pair, bucket start, volume)] for every bucket since 'since' a pair traded in
+    def bucket_volumes(self, pair_ids, since, size):
+        now = time.time()
+
+        buckets = []
+        for pair_id in pair_ids:
+            if pair_id not in self.pairs_by_id:
+                continue
+            for start in range(since - since % size, int(now), size):
+                begin = self.volume_at(pair_id, self.block_at(start))
+                end = self.volume_at(pair_id, self.block_at(min(start + size, now)))
+                if end == None:
+                    continue
+                volume = float(end) - float(begin or 0)
+                if volume > 0:  # the subgraph only has buckets with swaps
+                    buckets.append(('%s-%d' % (pair_id, start // size), pair_id, start, '%.6f' % volume))
+
+        return buckets
+
+    def page(self, entities, args):
+        where = args.get('where') or {}
+        entities.sort(key=lambda entity: entity['id'])
+        if 'id_gt' in where:
+            entities = [entity for entity in entities if entity['id'] > where['id_gt']]
+        return entities[:int(args.get('first', 100))]
+
+    # Cumulative volumeUSD (as the subgraph's string) at block 'number', or
+    # None before the pair existed
+    def volume_at(self, pair_id, number):
+        points = self.snapshots.get(pair_id)
+        if points == None or number < points[0][0]:
+            return None
+
+        volume = Interpolate(points[0], points[1], number)
+        return '%.6f' % max(volume, points[1][0])
+
+    def block_at(self, timestamp):
+        return int(Interpolate(self.block_timestamps, self.block_numbers, timestamp))
+
+    def head_block(self):
+        return self.block_at(time.time())
+
+    def resolve_blocks(self, args):
+        where = args.get('where') or {}
+        timestamp = int(where.get('timestamp_gt', 0))
+
+        # first block after 'timestamp'
+        number = int(Interpolate(self.block_timestamps, self.block_numbers, timestamp)) + 1
+        while Interpolate(self.block_numbers, self.block_timestamps, number) <= timestamp:
+            number += 1
+        block_timestamp = int(Interpolate(self.block_numbers, self.block_timestamps, number))
+
+        return [{'id': '0x%064x' % number, 'number': str(number), 'timestamp': str(block_timestamp)}]
+
+
+def MakeHandler(subgraph):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, status, headers, body):
+            payload = json.dumps(body).encode('utf-8') if body != None else b''
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            if body != None:
+                self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self.send(200, {}, subgraph.stats())
+            else:
+                self.send(404, {}, {'error': 'not found'})
+
+        def do_POST(self):
+            started = time.time()
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            if self.path == '/reset':
+                subgraph.reset()
+                self.send(200, {}, {})
+                return
+            if self.path == '/webhook':
+                subgraph.count(self.path, 204, started)
+                self.send(204, {}, None)
+                return
+            if self.path not in ('/uniswap-v2', '/ethereum-blocks'):
+                self.send(404, {}, {'error': 'not found'})
+                return
+
+            status, headers, response = subgraph.handle(body)
+            subgraph.count(self.path, status, started)
+            self.send(status, headers, response)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve subgraph fixtures locally')
+    parser.add_argument('--fixtures', required=True)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- seconds of random latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that get a 500')
+    parser.add_argument('--rate-limit', type=float, default=None, help='requests per second before 429s')
+    parser.add_argument('--max-aliases', type=int, default=None, help='reject documents with more fields')
+    args = parser.parse_args()
+
+    with open(args.fixtures, 'r') as f:
+        fixtures = json.load(f)
+
+    subgraph = FakeSubgraph(fixtures, args.latency, args.jitter, args.error_rate, args.rate_limit, args.max_aliases)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), MakeHandler(subgraph))
+    print('Serving %d pairs on port %d' % (len(subgraph.pairs), args.port))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,22 @@
+import os
+
 from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+
+from block_cache import BlockCache
+from snapshot_store import SnapshotStore, FINALITY_BLOCKS
+from rate_control import RateController, SubgraphTransport, IsQueryTooLargeError
+
+# subgraph endpoints, overridable to point the scanner at a stand-in server
+UNISWAP_SUBGRAPH_URL = os.environ.get('UNISWAP_SUBGRAPH_URL', 'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v2')
+BLOCKS_SUBGRAPH_URL = os.environ.get('BLOCKS_SUBGRAPH_URL', 'https://api.thegraph.com/subgraphs/name/blocklytics/ethereum-blocks')
+
+# every subgraph request goes through this, so we back off together
+rate_controller = RateController()
 
 # uniswap api
-uni_transport = RequestsHTTPTransport(
-    url='https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v2',
-    verify=True,
-    retries=5,
+uni_transport = SubgraphTransport(
+    UNISWAP_SUBGRAPH_URL,
+    rate_controller,
 )
 
 client = Client(
@@ -13,15 +24,20 @@ client = Client(
 )
 
 # eth block api
-eth_block_transport = RequestsHTTPTransport(
-    url='https://api.thegraph.com/subgraphs/name/blocklytics/ethereum-blocks',
-    verify=True,
-    retries=5,
+eth_block_transport = SubgraphTransport(
+    BLOCKS_SUBGRAPH_URL,
+    rate_controller,
 )
 eth_block_client = Client(
     transport=eth_block_transport
 )
 
+# timestamp -> block lookups that are already final
+block_cache = BlockCache()
+
+# (pair, block) -> volumeUSD snapshots that are already final
+snapshot_store = SnapshotStore()
+
 def GetFirstThousandPairs():
 
     # get 1000 most liquid pairs from client
@@ -47,40 +63,301 @@ def GetFirstThousandPairs():
 
 
 
-# convert timestamps to blocks
-def ConvertTimeStampsToBlocks(timestamps):
+# Page through every pair using id_gt cursors (no skip limit) and yield
+# each pair as soon as its page arrives, so callers can start on the first
+# pairs while the rest are still downloading.
+def IterAllPairs(page_size=1000, uni_client=None):
 
-    blocks = [None]*(len(timestamps))
+    uni_client = uni_client or client
 
-    for i in range(0 , len(timestamps)):
-        params_name = {
-            "timestamp_gt": timestamps[i]
+    query = gql('''
+        query ($first: Int!, $cursor: ID!) {
+         pairs(first: $first, orderBy: id, orderDirection: asc, where: {id_gt: $cursor}) {
+           id
+           token0 {
+            id
+            symbol
+            name
+          }
+          token1 {
+            id
+            symbol
+            name
+          }
+         }
         }
+    ''')
 
-        block = gql("""
-        query($timestamp_gt: BigInt! )
-        {
-            blocks(first: 1, orderBy: timestamp, orderDirection: asc,
-            where: {timestamp_gt: $timestamp_gt})
-        {
+    cursor = ''
+    while True:
+        page = uni_client.execute(query, variable_values={'first': page_size, 'cursor': cursor})['pairs']
+        for pair in page:
+            yield pair
+
+        if len(page) < page_size:
+            return
+        cursor = page[-1]['id']
+
+
+
+PAIR_FIELDS = '''
+           id
+           createdAtTimestamp
+           token0 {
             id
-        number
-        timestamp
+            symbol
+            name
+          }
+          token1 {
+            id
+            symbol
+            name
+          }
+'''
+
+# Just the ids of the n most active pairs, for refreshing the ranking
+# without downloading token data we already have
+def GetTopPairIds(n=1000, uni_client=None):
+
+    uni_client = uni_client or client
+
+    query = gql('''
+        query ($first: Int!) {
+         pairs(first: $first, orderBy: txCount, orderDirection: desc) {
+           id
+         }
         }
-        }""")
+    ''')
+    list_of_pairs = uni_client.execute(query, variable_values={'first': n})
+    return [pair['id'] for pair in list_of_pairs['pairs']]
+
+# Every pair created at or after 'timestamp', oldest first
+def IterPairsCreatedSince(timestamp, page_size=1000, uni_client=None):
+
+    uni_client = uni_client or client
+
+    query = gql('''
+        query ($first: Int!, $since: BigInt!) {
+         pairs(first: $first, orderBy: createdAtTimestamp, orderDirection: asc,
+               where: {createdAtTimestamp_gte: $since}) {%s}
+        }
+    ''' % PAIR_FIELDS)
+
+    # pairs can share a timestamp, so each page starts at the last page's
+    # newest timestamp and repeats are skipped
+    seen = set()
+    while True:
+        page = uni_client.execute(query, variable_values={'first': page_size, 'since': timestamp})['pairs']
+        for pair in page:
+            if pair['id'] not in seen:
+                yield pair
+
+        if len(page) < page_size:
+            return
+
+        newest = int(page[-1]['createdAtTimestamp'])
+        seen = set(pair['id'] for pair in page if int(pair['createdAtTimestamp']) == newest)
+        if newest == timestamp and len(seen) == len(page):
+            return  # a whole page on one timestamp, can't get past it with a cursor
+        timestamp = newest
+
+def GetPairsById(ids, uni_client=None):
+
+    uni_client = uni_client or client
+
+    query = gql('''
+        query ($first: Int!, $ids: [ID!]!) {
+         pairs(first: $first, where: {id_in: $ids}) {%s}
+        }
+    ''' % PAIR_FIELDS)
+
+    pairs = []
+    for i in range(0, len(ids), 1000):
+        chunk = ids[i:i + 1000]
+        pairs.extend(uni_client.execute(query, variable_values={'first': len(chunk), 'ids': chunk})['pairs'])
+
+    return pairs
 
-        block_data = eth_block_client.execute(block, variable_values=params_name)
-        blocks[i] = int(block_data['blocks'][0]['number'])
+# Precomputed daily volume for many pairs at once, paged with an id cursor:
+# yields {'pairAddress', 'date' (UTC midnight), 'dailyVolumeUSD'} for every
+# day on or after 'since' that a pair in 'addresses' traded. Days without
+# swaps have no entry. with_reserves adds the day's closing 'reserve0' and
+# 'reserve1'.
+def IterPairDayDatas(addresses, since, page_size=1000, uni_client=None, with_reserves=False):
 
-    return blocks
+    uni_client = uni_client or client
+
+    query = gql('''
+        query ($first: Int!, $pairs: [Bytes!]!, $since: Int!, $cursor: ID!) {
+         pairDayDatas(first: $first, orderBy: id, orderDirection: asc,
+                      where: {pairAddress_in: $pairs, date_gte: $since, id_gt: $cursor}) {
+           id
+           pairAddress
+           date
+           dailyVolumeUSD
+           %s
+         }
+        }
+    ''' % ('reserve0\n           reserve1' if with_reserves else ''))
+
+    cursor = ''
+    while True:
+        page = uni_client.execute(query, variable_values={'first': page_size, 'pairs': addresses, 'since': since,
+                                                         'cursor': cursor})['pairDayDatas']
+        for day in page:
+            yield day
+
+        if len(page) < page_size:
+            return
+        cursor = page[-1]['id']
+
+# Same for hourly volume: yields {'pair': {'id'}, 'hourStartUnix',
+# 'hourlyVolumeUSD'} for every hour on or after 'since' that a pair in 'ids'
+# traded
+def IterPairHourDatas(ids, since, page_size=1000, uni_client=None):
+
+    uni_client = uni_client or client
+
+    query = gql('''
+        query ($first: Int!, $pairs: [String!]!, $since: Int!, $cursor: ID!) {
+         pairHourDatas(first: $first, orderBy: id, orderDirection: asc,
+                       where: {pair_in: $pairs, hourStartUnix_gte: $since, id_gt: $cursor}) {
+           id
+           pair {
+            id
+           }
+           hourStartUnix
+           hourlyVolumeUSD
+         }
+        }
+    ''')
+
+    cursor = ''
+    while True:
+        page = uni_client.execute(query, variable_values={'first': page_size, 'pairs': ids, 'since': since,
+                                                         'cursor': cursor})['pairHourDatas']
+        for hour in page:
+            yield hour
+
+        if len(page) < page_size:
+            return
+        cursor = page[-1]['id']
+
+# Live cumulative volumeUSD for each pair, {id: volume}
+def GetCurrentVolumes(ids, uni_client=None):
+
+    uni_client = uni_client or client
+
+    query = gql('''
+        query ($first: Int!, $ids: [ID!]!) {
+         pairs(first: $first, where: {id_in: $ids}) {
+           id
+           volumeUSD
+         }
+        }
+    ''')
+
+    volumes = {}
+    for i in range(0, len(ids), 1000):
+        chunk = ids[i:i + 1000]
+        for pair in uni_client.execute(query, variable_values={'first': len(chunk), 'ids': chunk})['pairs']:
+            volumes[pair['id']] = float(pair['volumeUSD'])
+
+    return volumes
+
+# convert timestamps to blocks
+# Finalized timestamps come out of the block cache, the rest are resolved in
+# a single aliased request:
+#   t0: blocks(first: 1, ..., where: {timestamp_gt: $t0}) { number timestamp }
+#   t1: blocks(first: 1, ..., where: {timestamp_gt: $t1}) { number timestamp }
+#   ...
+def ConvertTimeStampsToBlocks(timestamps, cache=None):
+
+    cache = cache or block_cache
+    known = cache.get_many(timestamps)
+
+    missing = sorted(set(timestamps) - set(known))
+    if len(missing) > 0:
+        params = {}
+        fields = []
+        for i in range(0, len(missing)):
+            params['t%d' % i] = missing[i]
+            fields.append('t%d: blocks(first: 1, orderBy: timestamp, orderDirection: asc, '
+                          'where: {timestamp_gt: $t%d}) { number timestamp }' % (i, i))
+
+        query = gql('query (%s) {\n%s\n}' % (', '.join(['$%s: BigInt!' % name for name in params]), '\n'.join(fields)))
+        block_data = eth_block_client.execute(query, variable_values=params)
+
+        rows = []
+        for i in range(0, len(missing)):
+            block = block_data['t%d' % i][0]
+            known[missing[i]] = int(block['number'])
+            rows.append((missing[i], int(block['number']), int(block['timestamp'])))
+        cache.put_many(rows)
+
+    return [known[timestamp] for timestamp in timestamps]
+
+# Build one aliased document that asks for the pair at every block:
+#   b0: pair(id: $id, block: {number: $n0}) { volumeUSD }
+#   b1: pair(id: $id, block: {number: $n1}) { volumeUSD }
+#   ...
+def BuildVolumeHistoryQuery(num_blocks):
+
+    params = ['$id: ID!']
+    fields = []
+    for i in range(0, num_blocks):
+        params.append('$n%d: Int!' % i)
+        fields.append('b%d: pair(id: $id, block: {number: $n%d}) { volumeUSD }' % (i, i))
+
+    return gql('query (%s) {\n%s\n}' % (', '.join(params), '\n'.join(fields)))
 
 # Get volume for the blocks contained in 'blocks'
 # Return the volume as
 # volume = [vol_from_block0_to_block1, vol_from_block1_to_block2, ...]
 # where blocks = [block0, block1, ...]
-def GetVolumeStatistics(contract, blocks):
+# Snapshots we already have come out of the snapshot store, so usually only
+# the newest block is actually fetched.
+def GetVolumeStatistics(contract, blocks, uni_client=None, batched=True, store=None):
+
+    store = store or snapshot_store
+
+    snapshots = store.get_many([(contract, block) for block in blocks])
+    missing = [block for block in blocks if (contract, block) not in snapshots]
+
+    if len(missing) > 0:
+        fetched = GetVolumeSnapshots(contract, missing, uni_client, batched)
+        fetched = dict(((contract, block), volume) for block, volume in fetched.items())
+        store.put_many(fetched, max(blocks) - FINALITY_BLOCKS)
+        snapshots.update(fetched)
 
     tv_volume = [None]*len(blocks)
+    for i in range(0, len(blocks)):
+        tv_volume[i] = snapshots.get((contract, blocks[i]))
+        if(tv_volume[i] == None):
+            return None
+
+    return tv_volume
+
+# Get the pair's total volumeUSD at each block.
+# Returns {block: volume, or None if the pair didn't exist yet}. Blocks after
+# the first None may be left out.
+# By default every block is fetched in one aliased request. If the server
+# rejects that as too large (complexity limits, ...) we fall back to one
+# request per block. Any other error is raised: more requests won't help a
+# server that's already failing.
+def GetVolumeSnapshots(contract, blocks, uni_client=None, batched=True):
+
+    uni_client = uni_client or client
+
+    if batched and len(blocks) > 1:
+        try:
+            return GetVolumeSnapshotsBatched(contract, blocks, uni_client)
+        except Exception as e:
+            if not IsQueryTooLargeError(e):
+                raise
+            print('Batched volume query failed for %s (%s). Falling back to per-block queries.' % (contract, e))
+
+    snapshots = {}
     for i in range(0, len(blocks)):
         params = {
             "id": contract,
@@ -95,10 +372,32 @@ def GetVolumeStatistics(contract, blocks):
               }        
         """)
 
-        vol_data = client.execute(query, variable_values=params)
+        vol_data = uni_client.execute(query, variable_values=params)
         if(vol_data['pair'] == None):
-            return None
+            snapshots[blocks[i]] = None
+            return snapshots
+        else:
+            snapshots[blocks[i]] = int(float(vol_data['pair']['volumeUSD'])) # round the fractional stuff
+
+    return snapshots
+
+# Same as GetVolumeSnapshots, but all of the snapshots come back in a single request
+def GetVolumeSnapshotsBatched(contract, blocks, uni_client=None):
+
+    uni_client = uni_client or client
+
+    params = {"id": contract}
+    for i in range(0, len(blocks)):
+        params['n%d' % i] = blocks[i]
+
+    vol_data = uni_client.execute(BuildVolumeHistoryQuery(len(blocks)), variable_values=params)
+
+    snapshots = {}
+    for i in range(0, len(blocks)):
+        snapshot = vol_data['b%d' % i]
+        if(snapshot == None):
+            snapshots[blocks[i]] = None
         else:
-            tv_volume[i] = int(float(vol_data['pair']['volumeUSD'])) # round the fractional stuff
+            snapshots[blocks[i]] = int(float(snapshot['volumeUSD'])) # round the fractional stuff
 
-    return tv_volume
\ No newline at end of file
+    return snapshots
@@ -0,0 +1,90 @@
+import numpy as np
+
+import graphqlstuff
+from rolling import RollingStats
+from scan_engine import map_bounded, MAX_IN_FLIGHT
+
+SECONDS_PER_HOUR = 60 * 60
+HOURLY_WINDOW = 7 * 24  # hours
+HOURLY_HOLDOUT = 3  # hours left out of the baseline at the end of the window
+HOURLY_CHEBY_THRESH = 0.4
+HOUR_DATA_GROUP = 100  # pairs per pair_in filter
+
+
+# {pair: {hour index: volume}} for every hour since 'since' the pairs traded in
+def FetchHourVolumes(ids, since, uni_client=None, max_in_flight=MAX_IN_FLIGHT):
+    volumes = dict((pair_id, {}) for pair_id in ids)
+
+    groups = [ids[i:i + HOUR_DATA_GROUP] for i in range(0, len(ids), HOUR_DATA_GROUP)]
+    hour_datas = map_bounded(lambda group: list(graphqlstuff.IterPairHourDatas(group, since, uni_client=uni_client)),
+                             groups, max_in_flight)
+    for hours in hour_datas:
+        for hour in hours:
+            if hour['pair']['id'] in volumes:
+                volumes[hour['pair']['id']][int(hour['hourStartUnix']) // SECONDS_PER_HOUR] = float(hour['hourlyVolumeUSD'])
+
+    return volumes
+
+
+# Hourly volume for the listed pairs, kept in a RollingStats between scans.
+# update() only downloads the hours since the last update (and the whole
+# window for pairs it hasn't seen before), pushes the hours that have
+# finished, and returns how much each pair has done in the current hour so
+# far. Pairs that drop out of the listing are dropped here too.
+class HourlyTracker(object):
+
+    def __init__(self, window=HOURLY_WINDOW, holdout=HOURLY_HOLDOUT, uni_client=None):
+        self.stats = RollingStats(window, holdout)
+        self.uni_client = uni_client
+        self.last_hour = None  # newest finished hour in the window
+
+    # Returns (stats row of each pair, current hour's volume per stats row)
+    def update(self, pairs, now):
+        current_hour = now // SECONDS_PER_HOUR
+        finished = current_hour - 1
+        window = self.stats.window
+
+        if self.last_hour == None or finished - self.last_hour >= window:
+            # first update, or it's been so long nothing in the window counts
+            self.stats.retain([])
+            self.last_hour = finished
+
+        ids = [pair['id'] for pair in pairs]
+        created_hour = dict((pair['id'], int(pair.get('createdAtTimestamp') or 0) // SECONDS_PER_HOUR) for pair in pairs)
+
+        self.stats.retain(ids)
+        new_ids = [pair_id for pair_id in ids if pair_id not in self.stats.index]
+        known_ids = list(self.stats.ids)
+
+        volumes = {}
+        if len(known_ids) > 0:
+            volumes.update(FetchHourVolumes(known_ids, (self.last_hour + 1) * SECONDS_PER_HOUR, self.uni_client))
+        if len(new_ids) > 0:
+            first_hour = self.last_hour - window + 1
+            volumes.update(FetchHourVolumes(new_ids, first_hour * SECONDS_PER_HOUR, self.uni_client))
+
+            self.stats.add_rows(new_ids, [[self.volume(volumes, pair_id, hour, created_hour[pair_id])
+                                           for hour in range(first_hour, self.last_hour + 1)] for pair_id in new_ids])
+
+        for hour in range(self.last_hour + 1, finished + 1):
+            self.stats.push([self.volume(volumes, pair_id, hour, created_hour[pair_id]) for pair_id in self.stats.ids])
+        self.last_hour = finished
+
+        current = np.array([self.volume(volumes, pair_id, current_hour, created_hour[pair_id])
+                            for pair_id in self.stats.ids])
+        return [self.stats.index[pair_id] for pair_id in ids], current
+
+    # No entry means no swaps that hour, unless the pair didn't exist yet
+    def volume(self, volumes, pair_id, hour, created_hour):
+        if hour < created_hour:
+            return np.nan
+        return volumes[pair_id].get(hour, 0.0)
+
+    # Rows with a full baseline whose current hour is already above anything
+    # in the baseline and anomalously high by Chebyshev
+    def hits(self, current, cheby_thresh=HOURLY_CHEBY_THRESH):
+        scores = self.stats.scores(current)
+        full_history = self.stats.count == self.stats.window - self.stats.holdout
+
+        with np.errstate(invalid='ignore'):
+            return full_history & (current > scores['max']) & (scores['latest_dev'] > 0) & (scores['p_cheby'] < cheby_thresh)
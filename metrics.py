@@ -0,0 +1,193 @@
+import contextlib
+import threading
+import time
+
+METRICS_PORT = 9102
+
+# seconds; covers a single request up to a whole scan
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def EscapeLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def FormatLabels(names, values, extra=None):
+    pairs = ['%s="%s"' % (name, EscapeLabel(value)) for name, value in zip(names, values)]
+    if extra != None:
+        pairs.append('%s="%s"' % extra)
+    if len(pairs) == 0:
+        return ''
+    return '{%s}' % ','.join(pairs)
+
+
+def FormatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+# A metric with zero or more labels. Values are kept per label combination,
+# e.g. requests.inc(subgraph='uniswap-v2', status='200')
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.description), '# TYPE %s %s' % (self.name, self.kind)]
+        with self.lock:
+            for key in sorted(self.values):
+                lines.extend(self.render_value(key, self.values[key]))
+        return lines
+
+    def render_value(self, key, value):
+        return ['%s%s %s' % (self.name, FormatLabels(self.labels, key), FormatValue(value))]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    # Summed over every label combination
+    def total(self):
+        with self.lock:
+            return sum(self.values.values())
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, description, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts == None:
+                counts = self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+
+            for i in range(0, len(self.buckets)):
+                if value <= self.buckets[i]:
+                    counts['buckets'][i] += 1
+            counts['sum'] += value
+            counts['count'] += 1
+
+    def render_value(self, key, counts):
+        lines = []
+        for i in range(0, len(self.buckets)):
+            lines.append('%s_bucket%s %d' % (self.name, FormatLabels(self.labels, key, ('le', FormatValue(self.buckets[i]))),
+                                             counts['buckets'][i]))
+        lines.append('%s_sum%s %s' % (self.name, FormatLabels(self.labels, key), FormatValue(counts['sum'])))
+        lines.append('%s_count%s %d' % (self.name, FormatLabels(self.labels, key), counts['count']))
+        return lines
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def add(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    # Prometheus text exposition format
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# scan loop
+stage_seconds = registry.add(Histogram('trawler_stage_seconds', 'Time spent in each stage of a scan', ['stage']))
+last_stage_seconds = registry.add(Gauge('trawler_last_stage_seconds', 'Time the latest scan spent in each stage', ['stage']))
+scans_total = registry.add(Counter('trawler_scans_total', 'Scans completed'))
+scan_pairs = registry.add(Gauge('trawler_scan_pairs', 'Pairs examined in the latest scan'))
+scan_missing_history = registry.add(Gauge('trawler_scan_missing_history', 'Pairs without full volume history in the latest scan'))
+scan_hits = registry.add(Gauge('trawler_scan_hits', 'Pairs flagged in the latest scan'))
+
+# subgraph requests
+request_seconds = registry.add(Histogram('trawler_subgraph_request_seconds', 'Subgraph HTTP request latency',
+                                         ['subgraph']))
+requests_total = registry.add(Counter('trawler_subgraph_requests_total', 'Subgraph HTTP requests by outcome',
+                                      ['subgraph', 'status']))
+retries_total = registry.add(Counter('trawler_subgraph_retries_total', 'Subgraph requests retried, by reason',
+                                     ['subgraph', 'reason']))
+errors_total = registry.add(Counter('trawler_subgraph_errors_total', 'Subgraph requests that failed for good',
+                                    ['subgraph']))
+
+# discord
+discord_posts_total = registry.add(Counter('trawler_discord_posts_total', 'Discord webhook posts by outcome',
+                                           ['status']))
+discord_post_seconds = registry.add(Histogram('trawler_discord_post_seconds', 'Discord webhook post latency'))
+discord_pending = registry.add(Gauge('trawler_discord_pending', 'Discord payloads waiting to be sent'))
+
+
+# Time a stage of the scan:
+#   with TimeStage('detection'):
+#       ...
+@contextlib.contextmanager
+def TimeStage(stage):
+    started = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - started
+        stage_seconds.observe(elapsed, stage=stage)
+        last_stage_seconds.set(elapsed, stage=stage)
+
+
+def CreateMetricsApp(metrics_registry=None):
+    from flask import Flask, Response
+
+    metrics_registry = metrics_registry or registry
+    app = Flask(__name__)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+    return app
+
+
+# Serve /metrics from a daemon thread. Returns the server (server.shutdown() stops it)
+def StartMetricsServer(port=METRICS_PORT, host='0.0.0.0', app=None):
+    from werkzeug.serving import make_server
+
+    server = make_server(host, port, app or CreateMetricsApp(), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server')
+    thread.daemon = True
+    thread.start()
+    return server
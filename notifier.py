@@ -0,0 +1,219 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+import requests
+
+import metrics
+from rate_control import ParseRetryAfter
+from scan_history import HISTORY_DB_PATH
+
+MESSAGE_LIMIT = 2000  # characters per split
+MAX_EMBEDS = 10  # embeds per webhook post
+EMBED_TOTAL_LIMIT = 6000  # characters across all embeds in one post
+MAX_BACKOFF = 300  # seconds
+
+
+# Split text into pieces of at most 'limit' characters, breaking on line
+# boundaries. A single line longer than the limit is cut into pieces.
+# Linear in the length of the text.
+def SplitMessage(text, limit=MESSAGE_LIMIT):
+    pieces = []
+    current = []
+    current_len = 0
+
+    for line in text.split('\n'):
+        while len(line) > limit:
+            if current:
+                pieces.append('\n'.join(current))
+                current, current_len = [], 0
+            pieces.append(line[:limit])
+            line = line[limit:]
+
+        added_len = len(line) + (1 if current else 0)
+        if current and current_len + added_len > limit:
+            pieces.append('\n'.join(current))
+            current, current_len = [], 0
+            added_len = len(line)
+
+        current.append(line)
+        current_len += added_len
+
+    if current and current_len > 0:
+        pieces.append('\n'.join(current))
+
+    return pieces
+
+
+# Pack split messages into webhook payloads of up to MAX_EMBEDS embeds each
+def BuildPayloads(pieces):
+    payloads = []
+    embeds = []
+    total = 0
+
+    for piece in pieces:
+        if embeds and (len(embeds) == MAX_EMBEDS or total + len(piece) > EMBED_TOTAL_LIMIT):
+            payloads.append({'embeds': embeds})
+            embeds, total = [], 0
+
+        embeds.append({'description': piece})
+        total += len(piece)
+
+    if embeds:
+        payloads.append({'embeds': embeds})
+
+    return payloads
+
+
+# Posts messages to a Discord webhook from a background thread, so a scan
+# never waits on the webhook. Payloads sit in an on-disk outbox until Discord
+# accepts them. 429s are retried after Discord's retry_after, other failures
+# back off exponentially, and anything left over is resent after a restart.
+class DiscordNotifier(object):
+
+    def __init__(self, url, path=HISTORY_DB_PATH, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.messages = queue.Queue()
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS discord_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+        self.sent = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.dropped = 0
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='discord-notifier')
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Queue a message and return straight away
+    def notify(self, text):
+        self.messages.put(text)
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                text = self.messages.get(timeout=1)
+            except queue.Empty:
+                text = None
+
+            if text != None:
+                self.add_to_outbox(BuildPayloads(SplitMessage(text)))
+                self.messages.task_done()
+
+            self.drain_outbox()
+
+    def add_to_outbox(self, payloads):
+        with self.lock:
+            self.conn.executemany('INSERT INTO discord_outbox (payload) VALUES (?)',
+                                  [(json.dumps(payload),) for payload in payloads])
+            self.conn.commit()
+
+    def drain_outbox(self):
+        backoff = 1
+        while not self.stopped.is_set():
+            with self.lock:
+                row = self.conn.execute('SELECT id, payload FROM discord_outbox ORDER BY id LIMIT 1').fetchone()
+            if row == None:
+                return
+
+            row_id, payload = row
+            try:
+                wait = self.post(json.loads(payload))
+            except Exception as e:
+                # keep the sender alive, and try this payload again later
+                print('could not send to discord: %s' % e)
+                self.failed += 1
+                wait = 0
+
+            if wait == None:
+                with self.lock:
+                    self.conn.execute('DELETE FROM discord_outbox WHERE id = ?', (row_id,))
+                    self.conn.commit()
+                backoff = 1
+            else:
+                if wait == 0:
+                    wait = backoff
+                    backoff = min(MAX_BACKOFF, backoff * 2)
+                self.stopped.wait(wait)
+
+    # Returns None when the payload is done with, or how long to wait before
+    # trying it again (0 = use the backoff)
+    def post(self, payload):
+        started = time.time()
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            print('could not send to discord: %s' % e)
+            self.failed += 1
+            metrics.discord_posts_total.inc(status='connection_error')
+            return 0
+
+        metrics.discord_post_seconds.observe(time.time() - started)
+        metrics.discord_posts_total.inc(status=response.status_code)
+
+        if response.status_code == 429:
+            self.rate_limited += 1
+            try:
+                retry_after = float(response.json().get('retry_after'))
+            except (ValueError, TypeError, AttributeError):
+                retry_after = ParseRetryAfter(response.headers.get('Retry-After'))
+                if retry_after == None:
+                    retry_after = 1
+            return max(retry_after, 0.1)
+
+        if response.status_code >= 500:
+            self.failed += 1
+            return 0
+
+        if response.status_code >= 400:
+            # won't get any better by retrying
+            print('discord rejected message (%d): %s' % (response.status_code, response.text[:200]))
+            self.dropped += 1
+            return None
+
+        self.sent += 1
+        return None
+
+    def pending(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM discord_outbox').fetchone()[0]
+
+    # Wait for everything queued so far to be sent, or for the timeout (the
+    # sender can be backing off for minutes). Returns whether it all went.
+    def flush(self, timeout=30):
+        deadline = time.time() + timeout
+        while self.messages.unfinished_tasks > 0 or self.pending() > 0:
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    # Stop sending; whatever is still in the outbox goes out next time
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        with self.lock:
+            self.conn.close()
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'rate_limited': self.rate_limited,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'pending': self.pending() + self.messages.qsize(),
+        }
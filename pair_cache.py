@@ -0,0 +1,106 @@
+import sqlite3
+import threading
+
+import graphqlstuff
+from block_cache import CACHE_DB_PATH
+
+
+# Local copy of pair/token metadata (token ids, symbols and names).
+# That data almost never changes, so each refresh only downloads the ranking
+# (ids only), pairs created since the last refresh, and any ranked pair we
+# somehow still don't have. Everything else is filled in from the cache.
+class PairCache(object):
+
+    def __init__(self, path=CACHE_DB_PATH, uni_client=None):
+        self.uni_client = uni_client or graphqlstuff.client
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS pairs (
+                id TEXT PRIMARY KEY,
+                created_at INTEGER NOT NULL,
+                token0_id TEXT NOT NULL,
+                token0_symbol TEXT NOT NULL,
+                token0_name TEXT NOT NULL,
+                token1_id TEXT NOT NULL,
+                token1_symbol TEXT NOT NULL,
+                token1_name TEXT NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+        self.reset_stats()
+
+    def put_many(self, pairs):
+        rows = []
+        for pair in pairs:
+            token0 = pair['token0']
+            token1 = pair['token1']
+            rows.append((pair['id'], int(pair['createdAtTimestamp']),
+                         token0['id'], token0['symbol'], token0['name'],
+                         token1['id'], token1['symbol'], token1['name']))
+
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+
+    # Returns {id: pair} for the ids we have, shaped like the subgraph's pairs
+    def get_many(self, ids):
+        found = {}
+
+        with self.lock:
+            for i in range(0, len(ids), 500):  # stay under sqlite's variable limit
+                chunk = ids[i:i + 500]
+                rows = self.conn.execute('SELECT * FROM pairs WHERE id IN (%s)' % ','.join('?' * len(chunk)), chunk)
+                for row in rows:
+                    found[row[0]] = {
+                        'id': row[0],
+                        'createdAtTimestamp': row[1],
+                        'token0': {'id': row[2], 'symbol': row[3], 'name': row[4]},
+                        'token1': {'id': row[5], 'symbol': row[6], 'name': row[7]},
+                    }
+
+        return found
+
+    def newest_created_at(self):
+        with self.lock:
+            return self.conn.execute('SELECT MAX(created_at) FROM pairs').fetchone()[0]
+
+    # Drop-in replacement for GetFirstThousandPairs()[0:n]
+    def refresh(self, n=1000):
+        ranked_ids = graphqlstuff.GetTopPairIds(n, self.uni_client)
+        self.ranked_ids += len(ranked_ids)
+
+        since = self.newest_created_at()
+        if since != None:
+            new_pairs = list(graphqlstuff.IterPairsCreatedSince(since, uni_client=self.uni_client))
+            self.put_many(new_pairs)
+            self.new_pairs += len(new_pairs)
+
+        pairs = self.get_many(ranked_ids)
+        self.hydrated += len(pairs)
+
+        missing = [pair_id for pair_id in ranked_ids if pair_id not in pairs]
+        if len(missing) > 0:
+            fetched = graphqlstuff.GetPairsById(missing, self.uni_client)
+            self.put_many(fetched)
+            self.fetched += len(fetched)
+            for pair in fetched:
+                pairs[pair['id']] = pair
+
+        return [pairs[pair_id] for pair_id in ranked_ids if pair_id in pairs]
+
+    def reset_stats(self):
+        self.ranked_ids = 0
+        self.new_pairs = 0
+        self.hydrated = 0
+        self.fetched = 0
+
+    def stats(self):
+        return {
+            'ranked_ids': self.ranked_ids,
+            'new_pairs': self.new_pairs,
+            'hydrated_from_cache': self.hydrated,
+            'fetched': self.fetched,
+        }
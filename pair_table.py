@@ -0,0 +1,212 @@
+import numpy as np
+
+INITIAL_CAPACITY = 1024  # rows, doubled as needed
+
+
+# '0x...' pair ids -> (n,) array of 20 byte addresses. ValueError for
+# anything that isn't one
+def AddressBytes(addresses):
+    keys = [bytes.fromhex(address[2:]) for address in addresses]
+    if any(len(key) != 20 for key in keys):
+        raise ValueError('not a 20 byte address')
+    return np.frombuffer(b''.join(keys), dtype='S20')
+
+
+# numpy drops trailing zero bytes from 'S' values, so pad them back
+def AddressHex(key):
+    return '0x' + key.ljust(20, b'\0').hex()
+
+
+# Last 'window' buckets of volume for many rows, oldest first, in a float64
+# buffer twice as wide as the window. Every bucket is written to both halves,
+# so the window is always one contiguous slice and view() never copies,
+# wherever the head is:
+#
+#   head = 2, window = 4:   [ c  d | a  b  c  d | a  b ]   view() = a b c d
+#                                  ^ head
+class VolumeRing(object):
+
+    def __init__(self, window, capacity=INITIAL_CAPACITY):
+        self.window = window
+        self.size = 0
+        self.head = 0  # column of the oldest bucket
+        self.buffer = np.full((capacity, 2 * window), np.nan)
+
+    def capacity(self):
+        return self.buffer.shape[0]
+
+    # (size, window) view, oldest bucket first
+    def view(self):
+        return self.buffer[:self.size, self.head:self.head + self.window]
+
+    # Buffer columns for window positions (oldest first) in the first half
+    def columns(self):
+        return (self.head + np.arange(0, self.window)) % self.window
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity():
+            return
+        buffer = np.full((max(capacity, 2 * self.capacity()), 2 * self.window), np.nan)
+        buffer[:self.size] = self.buffer[:self.size]
+        self.buffer = buffer
+
+    # Append rows, history is (n, window) oldest first. Returns the new rows.
+    def add_rows(self, history):
+        history = np.asarray(history, dtype=np.float64).reshape(-1, self.window)
+        rows = np.arange(self.size, self.size + len(history))
+        self.reserve(self.size + len(history))
+        self.size += len(history)
+        self.write(rows, history)
+        return rows
+
+    # Keep only 'rows', in that order
+    def keep(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        self.buffer[:len(rows)] = self.buffer[rows]
+        self.buffer[len(rows):self.size] = np.nan
+        self.size = len(rows)
+
+    # Replace whole windows, history is (len(rows), window) oldest first
+    def write(self, rows, history):
+        history = np.asarray(history, dtype=np.float64)
+        half = np.empty((len(history), self.window))
+        half[:, self.columns()] = history
+        self.buffer[rows, :self.window] = half
+        self.buffer[rows, self.window:] = half
+
+    # Overwrite the newest bucket of 'rows'
+    def set_latest(self, rows, values):
+        column = (self.head + self.window - 1) % self.window
+        self.buffer[rows, column] = values
+        self.buffer[rows, column + self.window] = values
+
+    # Add the next bucket for every row; the oldest one drops out
+    def push(self, values):
+        self.buffer[:self.size, self.head] = values
+        self.buffer[:self.size, self.head + self.window] = values
+        self.head = (self.head + 1) % self.window
+
+    def nbytes(self):
+        return self.buffer.nbytes
+
+
+# Columnar store of every pair we've seen, addressed by row number: 20 byte
+# addresses, token symbols as ids into one table of distinct symbols, and
+# each pair's volume window in a VolumeRing. Rows never move or go away, so a
+# row number stays good for the life of the table, and the arrays are only
+# ever swapped for bigger copies, so readers in other threads don't need a
+# lock. Costs about 60 bytes a pair plus the volume window, instead of a few
+# kilobytes of nested dicts.
+class PairTable(object):
+
+    def __init__(self, window, capacity=INITIAL_CAPACITY):
+        self.size = 0
+        self.addresses = np.zeros(capacity, dtype='S20')
+        self.token0 = np.zeros(capacity, dtype=np.int32)
+        self.token1 = np.zeros(capacity, dtype=np.int32)
+        self.created_at = np.zeros(capacity, dtype=np.int64)
+
+        self.symbols = []
+        self.symbol_ids = {}
+
+        # (addresses sorted, their rows), for lookups with searchsorted
+        self.lookup = (np.zeros(0, dtype='S20'), np.zeros(0, dtype=np.int64))
+
+        self.volumes = VolumeRing(window, capacity)
+
+    def __len__(self):
+        return self.size
+
+    def intern(self, symbol):
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id == None:
+            symbol_id = self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return symbol_id
+
+    def reserve(self, capacity):
+        if capacity <= len(self.addresses):
+            return
+        capacity = max(capacity, 2 * len(self.addresses))
+        for column in ('addresses', 'token0', 'token1', 'created_at'):
+            old = getattr(self, column)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, column, new)
+        self.volumes.reserve(capacity)
+
+    # Rows of the 20 byte 'keys', -1 where we don't have them
+    def find(self, keys):
+        sorted_keys, sorted_rows = self.lookup
+        if len(sorted_keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+
+        positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        return np.where(sorted_keys[positions] == keys, sorted_rows[positions], -1)
+
+    # Rows of '0x...' addresses, -1 where we don't have them
+    def rows_of(self, addresses):
+        if len(addresses) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return self.find(AddressBytes(addresses))
+
+    def row(self, address):
+        row = self.rows_of([address])[0]
+        return None if row < 0 else int(row)
+
+    # Add pairs shaped like the subgraph's (id, token symbols, created at) we
+    # don't have yet. Returns every pair's row, in order.
+    def add(self, pairs):
+        pairs = list(pairs)
+        if len(pairs) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        keys = AddressBytes([pair['id'] for pair in pairs])
+        rows = self.find(keys)
+
+        new = np.flatnonzero(rows < 0)
+        new_keys, first, inverse = np.unique(keys[new], return_index=True, return_inverse=True)
+        if len(new_keys) > 0:
+            new_rows = np.arange(self.size, self.size + len(new_keys))
+            self.reserve(self.size + len(new_keys))
+
+            self.addresses[new_rows] = new_keys
+            for row, i in zip(new_rows, new[first]):
+                pair = pairs[i]
+                self.token0[row] = self.intern(pair['token0']['symbol'])
+                self.token1[row] = self.intern(pair['token1']['symbol'])
+                self.created_at[row] = int(pair.get('createdAtTimestamp') or 0)
+
+            self.size += len(new_keys)
+            self.volumes.add_rows(np.full((len(new_keys), self.volumes.window), np.nan))
+
+            order = np.argsort(self.addresses[:self.size], kind='stable')
+            self.lookup = (self.addresses[order], order)
+            rows[new] = new_rows[inverse]
+
+        return rows
+
+    def address(self, row):
+        return AddressHex(self.addresses[row])
+
+    def name(self, row):
+        return self.symbols[self.token0[row]] + '-' + self.symbols[self.token1[row]]
+
+    # The row as a subgraph-shaped pair, for code that wants one
+    def pair(self, row):
+        return {
+            'id': self.address(row),
+            'createdAtTimestamp': int(self.created_at[row]),
+            'token0': {'symbol': self.symbols[self.token0[row]]},
+            'token1': {'symbol': self.symbols[self.token1[row]]},
+        }
+
+    def stats(self):
+        metadata = sum(column.itemsize for column in (self.addresses, self.token0, self.token1, self.created_at))
+        metadata += self.lookup[0].itemsize + self.lookup[1].itemsize
+        return {
+            'pairs': self.size,
+            'symbols': len(self.symbols),
+            'bytes_per_pair': metadata,
+            'volume_bytes': self.volumes.nbytes(),
+        }
@@ -0,0 +1,237 @@
+import collections
+import itertools
+import json
+import threading
+
+from gql import gql
+
+import graphqlstuff
+from rate_control import IsQueryTooLargeError
+from snapshot_store import FINALITY_BLOCKS
+from scan_engine import imap_bounded, MAX_IN_FLIGHT
+
+# Rough size of one snapshot in the response, e.g.
+#   "s123": {"volumeUSD": "1234567890.123456789012345678"},
+# used to turn a response byte budget into an alias count.
+BYTES_PER_SNAPSHOT = 64
+
+# how many pairs to look up in the snapshot store at once
+STORE_LOOKUP_GROUP = 100
+
+# Split an iterable into lists of up to n items, without reading ahead
+def Grouper(items, n):
+    it = iter(items)
+    while True:
+        group = list(itertools.islice(it, n))
+        if len(group) == 0:
+            return
+        yield group
+
+
+# Packs (pair, block) snapshot lookups for many pairs into aliased documents:
+#   s0: pair(id: "0xabc...", block: {number: 11700000}) { volumeUSD }
+#   s1: pair(id: "0xabc...", block: {number: 11706500}) { volumeUSD }
+#   s2: pair(id: "0xdef...", block: {number: 11700000}) { volumeUSD }
+#   ...
+# Each document holds at most max_aliases lookups (and at most
+# max_response_bytes worth of expected response). A chunk the server rejects
+# as too large is split up and retried until it goes through or is down to a
+# single lookup, and later chunks are sized between the largest chunk
+# that went through and the smallest that was too large, so the planner
+# settles just under the server's limit. Lookups already in the snapshot
+# store are never sent, and up to max_in_flight chunks are requested at once.
+class SnapshotPlanner(object):
+
+    def __init__(self, max_aliases=250, max_response_bytes=None, max_in_flight=MAX_IN_FLIGHT, uni_client=None,
+                 store=None):
+        self.max_aliases = max_aliases
+        self.max_response_bytes = max_response_bytes
+        self.max_in_flight = max_in_flight
+        self.uni_client = uni_client or graphqlstuff.client
+        self.store = store or graphqlstuff.snapshot_store
+
+        self.lock = threading.Lock()  # chunks run on several threads
+        self.requests = 0
+        self.failed_requests = 0
+        self.splits = 0
+        self.failed_lookups = 0
+
+        self.largest_ok = 0  # largest chunk the server took
+        self.too_large = None  # smallest chunk it rejected as too large
+        self.probe = None  # size of the chunk trying a bigger size, while it's in flight
+
+    # Largest chunk to send: the configured limit until the server rejects one
+    # as too large, then the largest it has taken (half the rejected size
+    # while it hasn't taken any)
+    def chunk_size(self):
+        size = self.max_aliases
+        if self.max_response_bytes:
+            size = min(size, self.max_response_bytes // BYTES_PER_SNAPSHOT)
+        with self.lock:
+            if self.too_large != None:
+                size = min(size, self.largest_ok or self.too_large // 2)
+        return max(1, size)
+
+    # Size for the next chunk, with up to 'available' lookups to go in it.
+    # One chunk at a time tries halfway between the largest size that went
+    # through and the smallest that didn't, so the planner works up to the
+    # server's limit without every chunk in flight failing at once.
+    def next_chunk_size(self, available):
+        size = self.chunk_size()
+        with self.lock:
+            if self.too_large != None and self.probe == None:
+                probe = (self.largest_ok + self.too_large) // 2
+                if size < probe <= available:
+                    self.probe = size = probe
+        return size
+
+    def build_query(self, chunk):
+        fields = []
+        for i in range(0, len(chunk)):
+            contract, block = chunk[i]
+            fields.append('s%d: pair(id: %s, block: {number: %d}) { volumeUSD }' % (i, json.dumps(contract), block))
+
+        return gql('{\n%s\n}' % '\n'.join(fields))
+
+    # Fetch one chunk, splitting it up if the server says it's too large.
+    # Returns {(pair, block): volumeUSD or None}. Lookups that failed outright
+    # are left out, so they never end up in the snapshot store.
+    def execute_chunk(self, chunk):
+        with self.lock:
+            self.requests += 1
+        try:
+            data = self.uni_client.execute(self.build_query(chunk))
+        except Exception as e:
+            too_large = IsQueryTooLargeError(e)
+            with self.lock:
+                self.failed_requests += 1
+                if self.probe == len(chunk):
+                    self.probe = None
+                if too_large:
+                    self.too_large = len(chunk) if self.too_large == None else min(self.too_large, len(chunk))
+                    self.largest_ok = min(self.largest_ok, len(chunk) - 1)
+
+            if len(chunk) == 1 or not too_large:
+                print('Snapshot lookups failed for %s at block %d (%d in chunk): %s' %
+                      (chunk[0][0], chunk[0][1], len(chunk), e))
+                with self.lock:
+                    self.failed_lookups += len(chunk)
+                return {}
+
+            with self.lock:
+                self.splits += 1
+
+            # retry as pieces of the size we've learned so far, re-read for
+            # each piece since other chunks are learning at the same time
+            results = {}
+            rest = chunk
+            while len(rest) > 0:
+                size = min(self.next_chunk_size(len(rest)), len(chunk) - 1)
+                results.update(self.execute_chunk(rest[:size]))
+                rest = rest[size:]
+            return results
+
+        with self.lock:
+            self.largest_ok = max(self.largest_ok, len(chunk))
+            if self.probe == len(chunk):
+                self.probe = None
+            if self.too_large != None and self.too_large <= self.largest_ok:
+                self.too_large = None  # the server's limit went up
+
+        results = {}
+        for i in range(0, len(chunk)):
+            snapshot = data['s%d' % i]
+            if snapshot == None:
+                results[chunk[i]] = None
+            else:
+                results[chunk[i]] = int(float(snapshot['volumeUSD']))  # round the fractional stuff
+
+        return results
+
+    # Streaming, batched equivalent of calling GetVolumeStatistics(key(item), blocks)
+    # for every item. Items are pulled lazily (e.g. from IterAllPairs), their
+    # missing snapshots are packed into chunks as they arrive, and
+    # (item, tv_volume or None) pairs are yielded in order as soon as every
+    # chunk they depend on is back. Snapshots up to final_block are stored,
+    # by default the ones FINALITY_BLOCKS behind the newest block asked for.
+    def iter_volume_statistics(self, items, blocks, key=lambda item: item, final_block=None):
+        if final_block == None:
+            final_block = max(blocks) - FINALITY_BLOCKS
+
+        # [item, contract, lookups queued up to and including its own, snapshots from the store]
+        # filled in by chunks() on the engine's thread, drained here
+        waiting = collections.deque()
+        fetched = {}
+
+        def chunks():
+            buffer = []
+            queued = 0  # lookups handed to chunks so far
+
+            for group in Grouper(items, STORE_LOOKUP_GROUP):
+                lookups = [(key(item), block) for item in group for block in blocks]
+                known = self.store.get_many(lookups)
+
+                for item in group:
+                    contract = key(item)
+                    missing = [(contract, block) for block in blocks if (contract, block) not in known]
+                    buffer.extend(missing)
+                    queued += len(missing)
+                    waiting.append((item, contract, queued, known))
+
+                # sized chunk by chunk, as chunk_size() learns the server's limit
+                while len(buffer) >= self.chunk_size():
+                    size = self.next_chunk_size(len(buffer))
+                    yield buffer[:size]
+                    buffer = buffer[size:]
+
+            if len(buffer) > 0:
+                yield buffer
+
+        def ready(lookups_done):
+            while len(waiting) > 0 and waiting[0][2] <= lookups_done:
+                item, contract, queued, known = waiting.popleft()
+
+                tv_volume = [None]*len(blocks)
+                for i in range(0, len(blocks)):
+                    lookup = (contract, blocks[i])
+                    tv_volume[i] = known[lookup] if lookup in known else fetched.pop(lookup, None)
+
+                yield item, (None if None in tv_volume else tv_volume)
+
+        def execute(chunk):
+            return len(chunk), self.execute_chunk(chunk)
+
+        lookups_done = 0
+        for chunk_length, results in imap_bounded(execute, chunks(), self.max_in_flight):
+            self.store.put_many(results, final_block)
+            fetched.update(results)
+            lookups_done += chunk_length
+
+            for result in ready(lookups_done):
+                yield result
+
+        for result in ready(float('inf')):
+            yield result
+
+    # Returns {contract: tv_volume or None}
+    def fetch_volume_statistics(self, contracts, blocks):
+        return dict(self.iter_volume_statistics(contracts, blocks))
+
+    def reset_stats(self):
+        self.requests = 0
+        self.failed_requests = 0
+        self.splits = 0
+        self.failed_lookups = 0
+        self.store.hits = 0
+        self.store.misses = 0
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'failed_requests': self.failed_requests,
+            'splits': self.splits,
+            'failed_lookups': self.failed_lookups,
+            'chunk_size': self.chunk_size(),
+            'cache_hits': self.store.hits,
+            'cache_misses': self.store.misses,
+        }
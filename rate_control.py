@@ -0,0 +1,218 @@
+import email.utils
+import threading
+import time
+
+import requests
+from graphql.execution import ExecutionResult
+from graphql.language.printer import print_ast
+from gql.transport import Transport
+
+import metrics
+
+# GraphQL error messages that mean we're being rate limited rather than that
+# the query is bad
+RATE_LIMIT_MESSAGES = ('rate limit', 'too many requests', 'throttl')
+
+# Error messages that mean the document was too big for the server, as
+# opposed to the server being down or busy
+QUERY_TOO_LARGE_MESSAGES = ('too complex', 'complexity', 'too large', 'too big', 'too many', 'exceeds')
+
+RETRY_BACKOFF = 0.5  # seconds before the first retry when the server doesn't say
+MAX_RETRY_BACKOFF = 8.0
+
+
+# Shared AIMD rate controller for the subgraph clients.
+# Every successful response raises the allowed rate by about 'increase'
+# requests/second per second, every 429/5xx/rate limit error cuts it by
+# 'decrease' (at most once per second, since one overload shows up in every
+# request that was in flight). Retry-After pauses everyone.
+# Every request gets min_retries retries of its own. Retries past those come
+# out of a global budget that successful requests slowly refill, so a
+# struggling server doesn't get hammered with retries.
+class RateController(object):
+
+    def __init__(self, rate=5.0, min_rate=0.5, max_rate=200.0, increase=1.0, decrease=0.5,
+                 retry_budget=20, retry_refill=0.1, min_retries=2):
+        self.rate = rate  # requests per second
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.retry_budget = retry_budget
+        self.retry_refill = retry_refill  # retry tokens earned per successful request
+        self.min_retries = min_retries
+
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+        self.blocked_until = 0.0
+        self.last_cut = 0.0
+        self.retry_tokens = float(retry_budget)
+
+        self.successes = 0
+        self.throttles = 0
+        self.retries = 0
+
+    # Blocks until the caller is allowed to send a request
+    def acquire(self):
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_slot, self.blocked_until)
+            self.next_slot = start + 1.0 / self.rate
+
+        if start > now:
+            time.sleep(start - now)
+
+    def on_success(self):
+        with self.lock:
+            self.successes += 1
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+            self.retry_tokens = min(self.retry_budget, self.retry_tokens + self.retry_refill)
+
+    def on_throttle(self, retry_after=None):
+        with self.lock:
+            now = time.time()
+            self.throttles += 1
+
+            if now - self.last_cut >= 1.0:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.last_cut = now
+
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    # Returns True if a request that has been retried 'attempt' times already
+    # may be retried again
+    def take_retry(self, attempt=0):
+        with self.lock:
+            if attempt >= self.min_retries:
+                if self.retry_tokens < 1:
+                    return False
+                self.retry_tokens -= 1
+
+            self.retries += 1
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'rate': round(self.rate, 2),
+                'successes': self.successes,
+                'throttles': self.throttles,
+                'retries': self.retries,
+                'retry_tokens': round(self.retry_tokens, 1),
+            }
+
+
+# Retry-After is either a number of seconds or an HTTP date
+def ParseRetryAfter(value):
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def IsRateLimitError(errors):
+    for error in errors or []:
+        message = str(error.get('message', error) if isinstance(error, dict) else error).lower()
+        if any(text in message for text in RATE_LIMIT_MESSAGES):
+            return True
+
+    return False
+
+
+# Whether a request failed because the document was too large, so it's worth
+# retrying as smaller ones. 429s, 5xx and connection errors have been retried
+# by the transport already, and splitting wouldn't help them anyway.
+def IsQueryTooLargeError(e):
+    if isinstance(e, requests.RequestException):
+        return e.response != None and e.response.status_code == 413
+    if IsRateLimitError([str(e)]):
+        return False
+    message = str(e).lower()
+    return any(text in message for text in QUERY_TOO_LARGE_MESSAGES)
+
+
+# gql transport that sends every request through a RateController.
+# Used instead of RequestsHTTPTransport(retries=5). 429s, 5xx and rate limit
+# errors slow everyone down; connection errors only back off the request
+# that hit them. Retries without a Retry-After wait RETRY_BACKOFF, doubling
+# up to MAX_RETRY_BACKOFF.
+class SubgraphTransport(Transport):
+
+    def __init__(self, url, controller, timeout=30, name=None):
+        self.url = url
+        self.name = name or url.rstrip('/').rsplit('/', 1)[-1]  # metrics label
+        self.controller = controller
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def execute(self, document, variable_values=None, operation_name=None, timeout=None):
+        payload = {'query': print_ast(document)}
+        if variable_values:
+            payload['variables'] = variable_values
+        if operation_name:
+            payload['operationName'] = operation_name
+
+        attempt = 0
+        while True:
+            self.controller.acquire()
+
+            retry_after = None
+            started = time.time()
+            try:
+                response = self.session.post(self.url, json=payload, timeout=timeout or self.timeout)
+            except requests.RequestException as e:
+                error = e
+                reason = 'connection'
+                metrics.requests_total.inc(subgraph=self.name, status='connection_error')
+            else:
+                metrics.request_seconds.observe(time.time() - started, subgraph=self.name)
+                metrics.requests_total.inc(subgraph=self.name, status=response.status_code)
+
+                try:
+                    result = response.json()
+                    if not isinstance(result, dict):
+                        raise ValueError
+                except ValueError:
+                    result = {}
+
+                if response.status_code == 429 or response.status_code >= 500:
+                    retry_after = ParseRetryAfter(response.headers.get('Retry-After'))
+                    error = requests.HTTPError('%d from %s' % (response.status_code, self.url), response=response)
+                    reason = 'throttled' if response.status_code == 429 else 'server_error'
+                elif IsRateLimitError(result.get('errors')):
+                    error = Exception(str(result['errors'][0]))
+                    reason = 'rate_limit_error'
+                else:
+                    if 'errors' not in result and 'data' not in result:
+                        metrics.errors_total.inc(subgraph=self.name)
+                        response.raise_for_status()
+                        raise requests.HTTPError('Server did not return a GraphQL result', response=response)
+
+                    if result.get('errors'):
+                        metrics.errors_total.inc(subgraph=self.name)
+
+                    self.controller.on_success()
+                    return ExecutionResult(errors=result.get('errors'), data=result.get('data'))
+
+            if reason != 'connection':
+                self.controller.on_throttle(retry_after)
+            if not self.controller.take_retry(attempt):
+                metrics.errors_total.inc(subgraph=self.name)
+                raise error
+            metrics.retries_total.inc(subgraph=self.name, reason=reason)
+
+            if retry_after == None:
+                time.sleep(min(MAX_RETRY_BACKOFF, RETRY_BACKOFF * 2 ** attempt))  # Retry-After holds everyone up in acquire()
+            attempt += 1
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,233 @@
+import collections
+import hashlib
+import json
+import threading
+
+import numpy as np
+
+RESULTS_PORT = 9103
+RESULTS_HISTORY = 20  # scans kept for /scans and /scans/diff
+
+
+# Everything the API serves about one scan. Never modified once published,
+# so readers can use it without locks. Pairs are rows of the scanner's
+# PairTable (which only ever grows), in scan order. Response bodies are built
+# on first request (by the server threads, not the scanner) and kept.
+class ScanResults(object):
+
+    def __init__(self, scan_id, scan, table, rows, vol_matrix, hits, staleness=None, schedule=None):
+        self.scan_id = scan_id
+        self.scan = scan
+        self.table = table
+        self.rows = np.asarray(rows)
+        self.vol_matrix = vol_matrix
+        self.hits = hits
+        self.staleness = staleness  # how old each pair's volumes were, if not all fetched this scan
+        self.schedule = schedule
+        self.order = np.argsort(self.rows, kind='stable')  # scan positions by table row
+        self.hit_addresses = set(table.address(row) for row in self.rows[np.flatnonzero(hits)])
+
+        self.bodies = {}  # cache key -> (body, etag)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def address(self, i):
+        return self.table.address(self.rows[i])
+
+    def name(self, i):
+        return self.table.name(self.rows[i])
+
+    # Scan positions of '0x...' addresses, -1 for pairs not in this scan
+    def positions(self, addresses):
+        rows = self.table.rows_of(addresses)
+        sorted_rows = self.rows[self.order]
+        if len(sorted_rows) == 0:
+            return np.full(len(rows), -1, dtype=np.int64)
+
+        found = np.minimum(np.searchsorted(sorted_rows, rows), len(sorted_rows) - 1)
+        return np.where((rows >= 0) & (sorted_rows[found] == rows), self.order[found], -1)
+
+    def summary(self):
+        summary = {
+            'scan_id': self.scan_id,
+            'start_time': self.scan['start_time'][0],
+            'end_time': self.scan['end_time'][0],
+            'num_searched': self.scan['num_searched'],
+            'num_hits': len(self.hit_addresses),
+        }
+        if self.schedule != None:
+            summary['schedule'] = self.schedule
+        return summary
+
+    def volumes(self, i):
+        return [None if np.isnan(value) else float(value) for value in self.vol_matrix[i]]
+
+    def hit_list(self):
+        found = []
+        for i in np.flatnonzero(self.hits):
+            found.append({
+                'name': self.name(i),
+                'address': self.address(i),
+                'volumes': self.volumes(i),
+            })
+        return found
+
+    def pair_volumes(self, address):
+        try:
+            i = self.positions([address])[0]
+        except ValueError:
+            return None  # not an address
+        if i < 0:
+            return None
+
+        found = {
+            'scan_id': self.scan_id,
+            'name': self.name(i),
+            'address': address,
+            'hit': address in self.hit_addresses,
+            'volumes': self.volumes(i),
+        }
+        if self.staleness is not None:
+            staleness = self.staleness[i]
+            found['staleness_seconds'] = None if np.isnan(staleness) else round(float(staleness), 1)
+        return found
+
+    # Returns (body, etag), building it with make_data() the first time
+    def body(self, key, make_data):
+        cached = self.bodies.get(key)
+        if cached == None:
+            data = make_data()
+            if data == None:
+                return None
+            body = json.dumps(data)
+            cached = self.bodies[key] = (body, hashlib.sha1(body.encode('utf-8')).hexdigest())
+        return cached
+
+
+# The latest scan and a ring of recent ones, held in memory for the API.
+# publish() is all the scanner does: it swaps in a new ScanResults, which is
+# O(1), so readers never hold up a scan and a slow reader only ever sees a
+# complete scan.
+class ResultsStore(object):
+
+    def __init__(self, history=RESULTS_HISTORY):
+        self.lock = threading.Lock()
+        self.scans = collections.deque(maxlen=history)
+        self.next_id = 1
+
+    # rows are the scanned pairs' PairTable rows. vol_matrix and hits must
+    # not be changed after this
+    def publish(self, scan, table, rows, vol_matrix, hits, staleness=None, schedule=None):
+        with self.lock:
+            results = ScanResults(self.next_id, scan, table, rows, vol_matrix, hits, staleness, schedule)
+            self.next_id += 1
+            self.scans.append(results)
+        return results
+
+    def latest(self):
+        with self.lock:
+            return self.scans[-1] if len(self.scans) > 0 else None
+
+    def get(self, scan_id):
+        with self.lock:
+            for results in self.scans:
+                if results.scan_id == scan_id:
+                    return results
+        return None
+
+    def recent(self):
+        with self.lock:
+            return list(self.scans)
+
+
+def ScanDiff(old, new):
+    return {
+        'from': old.scan_id,
+        'to': new.scan_id,
+        'added': sorted(new.hit_addresses - old.hit_addresses),
+        'removed': sorted(old.hit_addresses - new.hit_addresses),
+        'unchanged': sorted(new.hit_addresses & old.hit_addresses),
+    }
+
+
+#   GET /hits                      current hits with their daily volumes
+#   GET /pairs/<address>/volumes   one pair's daily volumes from the latest scan
+#   GET /scans                     summaries of the scans still in memory
+#   GET /scans/latest              summary of the latest scan
+#   GET /scans/diff?from=&to=      hits added/removed between two scans
+#                                  (default: the previous scan to the latest)
+# Responses carry an ETag, and If-None-Match gets a 304.
+def CreateResultsApp(store):
+    from flask import Flask, Response, request, abort
+
+    app = Flask(__name__)
+
+    def respond(cached):
+        if cached == None:
+            abort(404)
+        body, etag = cached
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    def latest_or_404():
+        results = store.latest()
+        if results == None:
+            abort(404)
+        return results
+
+    @app.route('/hits')
+    def hits():
+        results = latest_or_404()
+        return respond(results.body('hits', lambda: {'scan_id': results.scan_id, 'hits': results.hit_list()}))
+
+    @app.route('/pairs/<address>/volumes')
+    def pair_volumes(address):
+        results = latest_or_404()
+        address = address.lower()
+        return respond(results.body(('pair', address), lambda: results.pair_volumes(address)))
+
+    @app.route('/scans')
+    def scans():
+        summaries = [results.summary() for results in store.recent()]
+        body = json.dumps(summaries)
+        return respond((body, hashlib.sha1(body.encode('utf-8')).hexdigest()))
+
+    @app.route('/scans/latest')
+    def latest():
+        results = latest_or_404()
+        return respond(results.body('summary', results.summary))
+
+    @app.route('/scans/diff')
+    def diff():
+        recent = store.recent()
+        if len(recent) == 0:
+            abort(404)
+
+        new = store.get(request.args.get('to', type=int)) if 'to' in request.args else recent[-1]
+        if new == None:
+            abort(404)
+
+        if 'from' in request.args:
+            old = store.get(request.args.get('from', type=int))
+        else:
+            position = recent.index(new)
+            old = recent[position - 1] if position > 0 else None
+        if old == None:
+            abort(404)
+
+        return respond(new.body(('diff', old.scan_id), lambda: ScanDiff(old, new)))
+
+    return app
+
+
+# Serve the API from a daemon thread. Returns the server (server.shutdown() stops it)
+def StartResultsServer(store, port=RESULTS_PORT, host='0.0.0.0'):
+    from werkzeug.serving import make_server
+
+    server = make_server(host, port, CreateResultsApp(store), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='results-server')
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,139 @@
+import numpy as np
+
+from pair_table import VolumeRing
+
+
+# Rolling window of the last 'window' buckets of volume for many pairs, one
+# row per pair, all pairs advancing one bucket at a time. The baseline is the
+# window minus its newest 'holdout' buckets (like CHEBY_HOLDOUT), and its
+# mean, std and max are kept up to date as buckets arrive: push() costs the
+# same however long the window is. Only rows whose max just fell out of the
+# window have their max recomputed, and sums are recomputed from scratch once
+# per window to keep float error from building up. The buckets live in a
+# VolumeRing, so the window and baseline are views, never copies.
+# NaN means no data, and is left out of the statistics.
+class RollingStats(object):
+
+    def __init__(self, window, holdout=0):
+        if holdout >= window:
+            raise ValueError('holdout (%d) has to be smaller than the window (%d)' % (holdout, window))
+
+        self.window = window
+        self.holdout = holdout
+        self.ids = []
+        self.index = {}
+        self.pushes = 0
+
+        self.ring = VolumeRing(window, 0)
+        self.sum = np.zeros(0)
+        self.sumsq = np.zeros(0)
+        self.count = np.zeros(0)
+        self.max = np.zeros(0)
+
+    # (rows, window - holdout) view of the baseline, oldest first
+    def baseline(self):
+        return self.ring.view()[:, :self.window - self.holdout]
+
+    # Add rows for new pairs with their history, oldest bucket first:
+    # history is (len(ids), window), lined up with the buckets already in the window
+    def add_rows(self, ids, history):
+        rows = self.ring.add_rows(np.asarray(history, dtype=np.float64).reshape(len(ids), self.window))
+
+        for pair_id in ids:
+            self.index[pair_id] = len(self.ids)
+            self.ids.append(pair_id)
+
+        self.sum = np.concatenate([self.sum, np.zeros(len(ids))])
+        self.sumsq = np.concatenate([self.sumsq, np.zeros(len(ids))])
+        self.count = np.concatenate([self.count, np.zeros(len(ids))])
+        self.max = np.concatenate([self.max, np.zeros(len(ids))])
+        self.refresh(rows)
+
+    # Keep only the rows for 'ids' (that we have)
+    def retain(self, ids):
+        keep = sorted(self.index[pair_id] for pair_id in set(ids) if pair_id in self.index)
+        self.ids = [self.ids[i] for i in keep]
+        self.index = dict((self.ids[i], i) for i in range(0, len(self.ids)))
+        self.ring.keep(keep)
+        self.sum = self.sum[keep]
+        self.sumsq = self.sumsq[keep]
+        self.count = self.count[keep]
+        self.max = self.max[keep]
+
+    # Recompute the statistics for 'rows' (default: all) from the buffer
+    def refresh(self, rows=None):
+        if rows is None:
+            rows = slice(None)
+
+        baseline = self.baseline()[rows]
+        present = ~np.isnan(baseline)
+        self.sum[rows] = np.where(present, baseline, 0).sum(axis=1)
+        self.sumsq[rows] = np.where(present, baseline ** 2, 0).sum(axis=1)
+        self.count[rows] = present.sum(axis=1)
+        self.max[rows] = np.where(present, baseline, -np.inf).max(axis=1)
+
+    # Add the next bucket, one value per row
+    def push(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        window = self.ring.view()
+
+        evicted = window[:, 0].copy()  # oldest, leaves the baseline
+        if self.holdout == 0:
+            aging = values
+        else:
+            aging = window[:, self.window - self.holdout].copy()  # joins the baseline
+
+        self.ring.push(values)
+        self.pushes += 1
+
+        evicted_present = ~np.isnan(evicted)
+        aging_present = ~np.isnan(aging)
+        evicted_value = np.where(evicted_present, evicted, 0)
+        aging_value = np.where(aging_present, aging, 0)
+
+        self.sum += aging_value - evicted_value
+        self.sumsq += aging_value ** 2 - evicted_value ** 2
+        self.count += aging_present.astype(np.float64) - evicted_present
+
+        lost_max = np.flatnonzero(evicted_present & (evicted >= self.max))
+        self.max = np.where(aging_present, np.maximum(self.max, aging_value), self.max)
+
+        if self.pushes % self.window == 0:
+            self.refresh()
+        elif len(lost_max) > 0:
+            baseline = self.baseline()[lost_max]
+            self.max[lost_max] = np.where(np.isnan(baseline), -np.inf, baseline).max(axis=1)
+
+    def mean(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 0, self.sum / self.count, np.nan)
+
+    def std(self):
+        mean = self.mean()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = np.where(self.count > 0, self.sumsq / self.count - mean ** 2, np.nan)
+        return np.sqrt(np.maximum(variance, 0))
+
+    # Chebyshev bound on how likely 'latest' (one value per row) is given the
+    # baseline, same as anomaly.ChebyshevScores:  k = |latest - mean| / std,  p = 1 / k^2
+    def scores(self, latest):
+        latest = np.asarray(latest, dtype=np.float64)
+        mean = self.mean()
+        std = self.std()
+        dev = latest - mean
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p_cheby = 1 / (np.abs(dev) / std) ** 2
+
+        return {
+            'mean': mean,
+            'std': std,
+            'max': np.where(np.isinf(self.max), np.nan, self.max),
+            'latest_dev': dev,
+            'p_cheby': p_cheby,
+        }
+
+    # The buckets in time order, oldest first, (rows, window). A view: it
+    # changes with the next push()
+    def window_values(self):
+        return self.ring.view()
@@ -0,0 +1,53 @@
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_IN_FLIGHT = 16
+
+_END = object()
+
+
+# Runs func(item) for every item, with at most max_in_flight calls running at
+# once. Items are pulled lazily, so 'items' can be a generator that is still
+# downloading, and results are yielded in the same order as the items.
+# func is blocking (gql's requests transport), so calls run on the executor.
+async def amap_bounded(func, items, max_in_flight=MAX_IN_FLIGHT, executor=None):
+    loop = asyncio.get_event_loop()
+    it = iter(items)
+    pending = collections.deque()
+    exhausted = False
+
+    while True:
+        while not exhausted and len(pending) < max_in_flight:
+            item = await loop.run_in_executor(executor, next, it, _END)
+            if item is _END:
+                exhausted = True
+            else:
+                pending.append(loop.run_in_executor(executor, func, item))
+
+        if len(pending) == 0:
+            return
+
+        yield await pending.popleft()
+
+
+# Blocking generator version of amap_bounded, for the scan loops
+def imap_bounded(func, items, max_in_flight=MAX_IN_FLIGHT):
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=max_in_flight + 1)  # +1 for pulling items
+    results = amap_bounded(func, items, max_in_flight, executor)
+
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
+        executor.shutdown(wait=False)
+
+
+def map_bounded(func, items, max_in_flight=MAX_IN_FLIGHT):
+    return list(imap_bounded(func, items, max_in_flight))
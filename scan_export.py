@@ -0,0 +1,211 @@
+# Every scan's volumes, written as plain .npy files that can be memory
+# mapped, so notebooks and backtest.py can go through weeks of scans without
+# the subgraph and without reading whole files in:
+#
+#   scans/20261018T051825Z/
+#       manifest.json   scan time, volume source, column start times, shapes
+#       volumes.npy     (pairs, columns) float64 volume, NaN = no data
+#       addresses.npy   (pairs,) S20 pair addresses, row i = volumes row i
+#       names.npy       (pairs,) unicode TOKEN0-TOKEN1
+#       hits.npy        (pairs,) bool
+#       staleness.npy   (pairs,) float64 seconds, only with the scan scheduler
+#
+#   from scan_export import OpenScans
+#   for scan in OpenScans('scans', since=time.time() - 7 * 86400):
+#       scan.volumes[scan.row('0x...')]
+#
+# A scan is written to a temporary directory and renamed into place, so
+# readers never see half of one.
+#
+# Exporting is off unless TRAWLER_EXPORT_DIR is set. In hour_data mode a scan
+# of 1000 pairs is ~1.35MB every couple of minutes, so PruneScans drops the
+# oldest scans once they're older than TRAWLER_EXPORT_MAX_DAYS or the
+# directory is over TRAWLER_EXPORT_MAX_MB (0 = no limit).
+
+import datetime
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from pair_table import AddressBytes, AddressHex
+
+EXPORT_DIR = os.environ.get('TRAWLER_EXPORT_DIR', '')  # '' = don't export
+EXPORT_MAX_AGE = float(os.environ.get('TRAWLER_EXPORT_MAX_DAYS', 30)) * 86400  # seconds
+EXPORT_MAX_BYTES = int(float(os.environ.get('TRAWLER_EXPORT_MAX_MB', 5000)) * 1000000)
+EXPORT_VERSION = 1
+
+
+def ScanDirName(scanned_at):
+    return datetime.datetime.fromtimestamp(int(scanned_at), datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def ScanTime(name):
+    scanned_at = datetime.datetime.strptime(name, '%Y%m%dT%H%M%SZ')
+    return scanned_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+# Write one published scan (results_api.ScanResults). column_starts are the
+# unix times each volume column starts at, column_seconds how long they are.
+# Returns the scan's directory.
+def ExportScan(export_dir, results, scanned_at, volume_source, column_starts, column_seconds):
+    path = os.path.join(export_dir, ScanDirName(scanned_at))
+    partial = path + '.partial'
+    if os.path.exists(partial):
+        shutil.rmtree(partial)
+    os.makedirs(partial)
+
+    arrays = {
+        'volumes': np.asarray(results.vol_matrix, dtype=np.float64),
+        'addresses': results.table.addresses[results.rows],
+        'names': np.array([results.name(i) for i in range(0, len(results))], dtype=np.str_),
+        'hits': np.asarray(results.hits, dtype=bool),
+    }
+    if results.staleness is not None:
+        arrays['staleness'] = np.asarray(results.staleness, dtype=np.float64)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(partial, name + '.npy'), array)
+
+    manifest = {
+        'version': EXPORT_VERSION,
+        'scan_id': results.scan_id,
+        'scanned_at': scanned_at,
+        'volume_source': volume_source,
+        'column_starts': [int(start) for start in column_starts],
+        'column_seconds': column_seconds,
+        'num_pairs': len(results),
+        'num_hits': len(results.hit_addresses),
+        'files': dict((name, {'file': name + '.npy', 'dtype': array.dtype.str, 'shape': list(array.shape)})
+                      for name, array in arrays.items()),
+    }
+    with open(os.path.join(partial, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)  # same second as the last scan
+    os.rename(partial, path)
+    return path
+
+
+# One exported scan. Arrays are memory mapped read only (mmap_mode=None
+# reads them in instead) and opened on first use.
+class ScanExport(object):
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            self.manifest = json.load(f)
+
+        self.scanned_at = self.manifest['scanned_at']
+        self.volume_source = self.manifest['volume_source']
+        self.column_starts = np.array(self.manifest['column_starts'])
+        self.arrays = {}
+        self.sorted = None  # (addresses sorted, their rows), for row()
+
+    def __len__(self):
+        return self.manifest['num_pairs']
+
+    def array(self, name):
+        if name not in self.arrays:
+            if name not in self.manifest['files']:
+                return None
+            self.arrays[name] = np.load(os.path.join(self.path, self.manifest['files'][name]['file']),
+                                        mmap_mode=self.mmap_mode)
+        return self.arrays[name]
+
+    @property
+    def volumes(self):
+        return self.array('volumes')
+
+    @property
+    def addresses(self):
+        return self.array('addresses')
+
+    @property
+    def names(self):
+        return self.array('names')
+
+    @property
+    def hits(self):
+        return self.array('hits')
+
+    @property
+    def staleness(self):
+        return self.array('staleness')
+
+    def address(self, i):
+        return AddressHex(self.addresses[i])
+
+    # Rows of '0x...' addresses, -1 for pairs not in this scan
+    def rows(self, addresses):
+        if self.sorted == None:
+            order = np.argsort(self.addresses, kind='stable')
+            self.sorted = (self.addresses[order], order)
+
+        sorted_keys, order = self.sorted
+        keys = AddressBytes(addresses)
+        if len(sorted_keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+
+        found = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        return np.where(sorted_keys[found] == keys, order[found], -1)
+
+    def row(self, address):
+        row = self.rows([address])[0]
+        return None if row < 0 else int(row)
+
+
+# Exported scans between 'since' and 'until' (unix times, inclusive), oldest first
+def ListScans(export_dir=EXPORT_DIR, since=None, until=None):
+    if not os.path.isdir(export_dir):
+        return []
+
+    paths = []
+    for name in sorted(os.listdir(export_dir)):
+        path = os.path.join(export_dir, name)
+        if name.endswith('.partial') or not os.path.exists(os.path.join(path, 'manifest.json')):
+            continue
+        try:
+            scanned_at = ScanTime(name)
+        except ValueError:
+            continue  # not ours
+        if (since == None or scanned_at >= since) and (until == None or scanned_at <= until):
+            paths.append(path)
+
+    return paths
+
+
+def OpenScans(export_dir=EXPORT_DIR, since=None, until=None, mmap_mode='r'):
+    return [ScanExport(path, mmap_mode) for path in ListScans(export_dir, since, until)]
+
+
+# Delete exported scans, oldest first, that are older than max_age seconds
+# or don't fit in max_bytes (0 = no limit). The newest scan is always kept.
+# Returns how many were deleted.
+def PruneScans(export_dir=EXPORT_DIR, max_age=EXPORT_MAX_AGE, max_bytes=EXPORT_MAX_BYTES, now=None):
+    if now == None:
+        now = time.time()
+
+    paths = ListScans(export_dir)
+    sizes = [DirectorySize(path) for path in paths]
+    total = sum(sizes)
+
+    deleted = 0
+    for path, size in zip(paths[:-1], sizes[:-1]):
+        too_old = max_age and now - ScanTime(os.path.basename(path)) > max_age
+        too_big = max_bytes and total > max_bytes
+        if not (too_old or too_big):
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        deleted += 1
+
+    return deleted
+
+
+def DirectorySize(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
@@ -0,0 +1,133 @@
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+
+HISTORY_DB_PATH = os.environ.get('TRAWLER_HISTORY_DB', './history.db')
+DATA_JSON_PATH = './data.json'
+
+
+# Append-only log of every scan and the pairs it found, indexed by pair name,
+# address and time. Writing a scan costs the same no matter how much history
+# there is. The previous scan's pair names are kept in memory for diffing,
+# and the last few scans are kept in memory for data.json.
+class ScanHistory(object):
+
+    def __init__(self, path=HISTORY_DB_PATH, recent=5):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS scans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recorded_at INTEGER NOT NULL,
+                start_time TEXT,
+                end_time TEXT,
+                num_searched INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS scans_recorded_at ON scans (recorded_at);
+
+            CREATE TABLE IF NOT EXISTS scan_pairs (
+                scan_id INTEGER NOT NULL REFERENCES scans (id),
+                name TEXT NOT NULL,
+                address TEXT NOT NULL,
+                time TEXT
+            );
+            CREATE INDEX IF NOT EXISTS scan_pairs_name ON scan_pairs (name, scan_id);
+            CREATE INDEX IF NOT EXISTS scan_pairs_address ON scan_pairs (address, scan_id);
+        ''')
+        self.conn.commit()
+
+        self.recent = collections.deque(self.load_recent(recent), maxlen=recent)
+
+        if len(self.recent) == 0:
+            self.recent.extend(LoadDataJson()[-recent:])
+
+        if len(self.recent) > 0:
+            self.last_pairs = set(pair['name'] for pair in self.recent[-1]['pairs'])
+        else:
+            self.last_pairs = set()
+
+    def load_recent(self, n):
+        with self.lock:
+            rows = self.conn.execute('SELECT id, start_time, end_time, num_searched FROM scans ORDER BY id DESC LIMIT ?', (n,))
+            scans = []
+            for scan_id, start_time, end_time, num_searched in reversed(rows.fetchall()):
+                pairs = self.conn.execute('SELECT name, address, time FROM scan_pairs WHERE scan_id = ?', (scan_id,))
+                scans.append({
+                    'start_time': [start_time],
+                    'end_time': [end_time],
+                    'num_searched': num_searched,
+                    'pairs': [{'name': name, 'address': address, 'time': [pair_time]} for name, address, pair_time in pairs],
+                })
+
+            return scans
+
+    # Names of the pairs in 'scan' that the previous scan didn't have
+    def new_pairs(self, scan):
+        current_pairs = set(pair['name'] for pair in scan['pairs'])
+        return list(current_pairs - self.last_pairs)
+
+    # Pairs already announced some other way since the last scan (streaming
+    # alerts), so the next scan doesn't call them new again
+    def mark_announced(self, names):
+        self.last_pairs = self.last_pairs | set(names)
+
+    def append(self, scan):
+        with self.lock:
+            cursor = self.conn.execute(
+                'INSERT INTO scans (recorded_at, start_time, end_time, num_searched) VALUES (?, ?, ?, ?)',
+                (int(time.time()), FirstOf(scan['start_time']), FirstOf(scan['end_time']), scan['num_searched']),
+            )
+            self.conn.executemany(
+                'INSERT INTO scan_pairs (scan_id, name, address, time) VALUES (?, ?, ?, ?)',
+                [(cursor.lastrowid, pair['name'], pair['address'], FirstOf(pair['time'])) for pair in scan['pairs']],
+            )
+            self.conn.commit()
+
+        self.recent.append(scan)
+        self.last_pairs = set(pair['name'] for pair in scan['pairs'])
+
+    # Every time a pair showed up, newest first: [(recorded_at, name, address, time), ...]
+    def pair_history(self, name=None, address=None, since=0):
+        where = ['scans.recorded_at >= ?']
+        params = [since]
+        if name != None:
+            where.append('scan_pairs.name = ?')
+            params.append(name)
+        if address != None:
+            where.append('scan_pairs.address = ?')
+            params.append(address)
+
+        with self.lock:
+            rows = self.conn.execute('''
+                SELECT scans.recorded_at, scan_pairs.name, scan_pairs.address, scan_pairs.time
+                FROM scan_pairs JOIN scans ON scans.id = scan_pairs.scan_id
+                WHERE %s ORDER BY scan_pairs.scan_id DESC
+            ''' % ' AND '.join(where), params)
+            return rows.fetchall()
+
+    # Keep data.json around for anything still reading it: the last few scans,
+    # written from memory to a temp file and swapped in, so readers never see
+    # a half written file
+    def write_data_json(self, path=DATA_JSON_PATH):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self.recent), f, indent=4)
+        os.replace(tmp_path, path)
+
+
+# getCurrentTime() returns a 1-tuple
+def FirstOf(value):
+    if isinstance(value, (list, tuple)):
+        return value[0]
+    return value
+
+
+def LoadDataJson(path=DATA_JSON_PATH):
+    try:
+        with open(path, 'r') as r:
+            return json.load(r)
+    except (IOError, ValueError):
+        return []
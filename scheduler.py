@@ -0,0 +1,165 @@
+import warnings
+
+import numpy as np
+
+import metrics
+from anomaly import ChebyshevScores
+
+MAX_REFRESH_INTERVAL = 6 * 60 * 60  # seconds, for the quietest pairs
+CLOSE_FROM = 0.5  # latest day at this fraction of the earlier max starts to count as close to a hit
+CHEBY_THRESH = 0.4  # same as the chebyshev detector
+VOLATILE_CV = 2.0  # std / mean of daily volume that counts as fully volatile
+VOLATILE_WEIGHT = 0.5  # volatility alone only makes a pair this urgent
+DEFAULT_PAIR_COST = 0.05  # requests per refreshed pair until we've measured it
+COST_SMOOTHING = 0.3  # weight of the latest scan in the cost estimates
+
+schedule_coverage = metrics.registry.add(metrics.Gauge('trawler_schedule_coverage',
+                                                       'Fraction of listed pairs refreshed within their interval'))
+schedule_refreshed = metrics.registry.add(metrics.Gauge('trawler_schedule_refreshed_pairs',
+                                                        'Pairs refreshed in the latest scan'))
+schedule_max_staleness = metrics.registry.add(metrics.Gauge('trawler_schedule_max_staleness_seconds',
+                                                            'Age of the stalest listed pair\'s volumes'))
+schedule_pair_cost = metrics.registry.add(metrics.Gauge('trawler_schedule_pair_cost',
+                                                        'Estimated subgraph requests per refreshed pair'))
+
+
+# How soon each pair needs another look, 0 (dead) to 1 (refresh every scan),
+# from its (pairs, days) daily volume: the most of
+#   - how close the latest day is to beating the earlier max (MaxVolumeHits)
+#   - how anomalous the latest day is by Chebyshev, if it's above the mean
+#   - how volatile the window is (std / mean), which only goes so far
+def RefreshUrgency(vol):
+    days = vol.shape[1]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN rows
+        earlier_max = np.nanmax(vol[:, :days - 1], axis=1)
+        vol_mean = np.nanmean(vol, axis=1)
+        vol_std = np.nanstd(vol, axis=1)
+
+    scores = ChebyshevScores(vol, min_history=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        closeness = (vol[:, -1] / earlier_max - CLOSE_FROM) / (1 - CLOSE_FROM)
+        cheby = np.where(scores['todays_vol_dev'] > 0, (1 - scores['p_cheby_today']) / (1 - CHEBY_THRESH), 0)
+        volatility = VOLATILE_WEIGHT * (vol_std / vol_mean) / VOLATILE_CV
+
+    urgency = np.fmax(np.fmax(closeness, cheby), volatility)  # fmax skips NaN
+    return np.clip(np.nan_to_num(urgency, nan=0.0), 0, 1)
+
+
+# Decides which listed pairs get fresh volume each scan, so the scan stays
+# under a subgraph request budget. Each pair gets a refresh interval between
+# one scan (urgency 1) and MAX_REFRESH_INTERVAL (urgency 0), spaced
+# geometrically, and each scan refreshes, as far as the budget goes:
+#   1. pairs we've never fetched
+#   2. pairs due a refresh, most urgent first
+#   3. everything else, most overdue (age / interval) first
+# Pairs that aren't refreshed keep their last volumes (in the pair table).
+# The cost of a pair is measured, not guessed: requests made while fetching
+# volumes over pairs refreshed, plus a fixed cost per scan (listing, blocks).
+# State is kept per PairTable row.
+class ScanScheduler(object):
+
+    def __init__(self, requests_per_minute, min_interval, max_interval=MAX_REFRESH_INTERVAL):
+        self.requests_per_minute = requests_per_minute
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+
+        self.refreshed_at = np.zeros(0)
+        self.interval = np.zeros(0)
+        self.urgency = np.zeros(0)
+
+        self.pair_cost = None
+        self.scan_cost = 0.0
+        self.last_select = None
+        self.budget = 0
+
+    def grow(self, size):
+        if size <= len(self.refreshed_at):
+            return
+        extra = size - len(self.refreshed_at)
+        self.refreshed_at = np.concatenate([self.refreshed_at, np.full(extra, np.nan)])
+        self.interval = np.concatenate([self.interval, np.full(extra, float(self.min_interval))])
+        self.urgency = np.concatenate([self.urgency, np.ones(extra)])
+
+    # How many pairs the budget covers this scan: requests for the time since
+    # the last scan, less the fixed cost, over the cost of a pair
+    def capacity(self, now):
+        cycle_seconds = self.min_interval if self.last_select == None else max(now - self.last_select, 1)
+        requests = self.requests_per_minute * cycle_seconds / 60.0 - self.scan_cost
+        pair_cost = self.pair_cost or DEFAULT_PAIR_COST
+        return max(1, int(requests / pair_cost))
+
+    # Positions in 'rows' (PairTable rows of the listed pairs) to refresh now, in order
+    def select(self, rows, now):
+        rows = np.asarray(rows)
+        self.grow(int(rows.max()) + 1 if len(rows) > 0 else 0)
+        self.budget = self.capacity(now)
+        self.last_select = now
+
+        age = now - self.refreshed_at[rows]
+        interval = self.interval[rows]
+        never = np.isnan(age)
+        due = ~never & (age >= interval - self.min_interval / 2.0)
+        with np.errstate(invalid='ignore'):
+            overdue = np.where(never, np.inf, age / interval)
+
+        group = np.where(never, 0, np.where(due, 1, 2))
+        urgency = np.where(due, self.urgency[rows], 0)
+        order = np.lexsort((-overdue, -urgency, group))  # last key sorts first
+
+        return np.sort(order[:self.budget])
+
+    # 'rows' were just refreshed and their latest (rows, days) volumes are 'vol'
+    def refreshed(self, rows, now, vol):
+        rows = np.asarray(rows)
+        self.grow(int(rows.max()) + 1 if len(rows) > 0 else 0)
+        urgency = RefreshUrgency(vol)
+        self.refreshed_at[rows] = now
+        self.urgency[rows] = urgency
+        self.interval[rows] = self.min_interval * (self.max_interval / float(self.min_interval)) ** (1 - urgency)
+
+    # Update the cost estimates from one scan's request counts
+    def record_cost(self, scan_requests, volume_requests, pairs_refreshed):
+        if pairs_refreshed > 0:
+            pair_cost = max(volume_requests, 1) / float(pairs_refreshed)
+            if self.pair_cost == None:
+                self.pair_cost = pair_cost
+            else:
+                self.pair_cost += COST_SMOOTHING * (pair_cost - self.pair_cost)
+        self.scan_cost += COST_SMOOTHING * (scan_requests - volume_requests - self.scan_cost)
+
+    # Seconds since each of 'rows' was refreshed (NaN = never)
+    def staleness(self, rows, now):
+        self.grow(int(np.max(rows)) + 1 if len(rows) > 0 else 0)
+        return now - self.refreshed_at[rows]
+
+    # Share of 'rows' refreshed within their interval
+    def coverage(self, rows, now):
+        if len(rows) == 0:
+            return 1.0
+        with np.errstate(invalid='ignore'):
+            fresh = self.staleness(rows, now) <= self.interval[rows] + self.min_interval / 2.0
+        return np.count_nonzero(fresh) / float(len(rows))
+
+    def stats(self, rows, now, refreshed):
+        staleness = self.staleness(rows, now)
+        coverage = self.coverage(rows, now)
+        max_staleness = float(np.nanmax(staleness)) if np.any(~np.isnan(staleness)) else 0.0
+
+        schedule_coverage.set(coverage)
+        schedule_refreshed.set(refreshed)
+        schedule_max_staleness.set(max_staleness)
+        schedule_pair_cost.set(self.pair_cost or DEFAULT_PAIR_COST)
+
+        return {
+            'listed': len(rows),
+            'refreshed': refreshed,
+            'budget': self.budget,
+            'never_refreshed': int(np.count_nonzero(np.isnan(staleness))),
+            'coverage': round(float(coverage), 3),
+            'max_staleness': round(max_staleness),
+            'pair_cost': round(self.pair_cost or DEFAULT_PAIR_COST, 4),
+            'scan_cost': round(self.scan_cost, 1),
+        }
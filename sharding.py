@@ -0,0 +1,176 @@
+# Sharded scanning: pairs are split across worker processes (on this machine
+# or others) by a stable hash of the pair address, so a pair always lands on
+# the same worker and that worker's snapshot cache stays warm between scans.
+#
+# The coordinator (ShardedScanner, run by volume_tracker.main with
+# TRAWLER_SHARDS > 1) resolves blocks and lists pairs once, streams each
+# shard its pairs through a queue as they are listed, and merges what the
+# workers send back into one scan for history, charts, the results API and
+# discord. Workers fetch volume and run detection for their shard only.
+#
+# Queues are served by a multiprocessing manager, on a free port on
+# 127.0.0.1 for local workers and on SHARD_PORT for remote ones, which
+# connect with:
+#   TRAWLER_SHARD_AUTHKEY=<secret> python sharding.py worker --coordinator <host>:<port> --shard <k>
+# with the same secret the coordinator was started with. Each worker has its
+# own subgraph rate controller and cache database.
+
+import argparse
+import hashlib
+import os
+import queue
+import time
+
+from multiprocessing.managers import BaseManager
+
+SHARD_PORT = 50050
+SHARD_AUTHKEY = os.environ.get('TRAWLER_SHARD_AUTHKEY', '').encode('utf-8') or None
+SHARD_BATCH = 100  # pairs per task message
+SHARD_TIMEOUT = 300  # seconds to wait for the last shard after every pair is handed out
+
+
+# Stable across processes, hosts and restarts (unlike hash())
+def ShardOf(address, num_shards):
+    digest = hashlib.sha1(address.lower().encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+
+# Key for the shard manager. The manager speaks pickle, so anyone with the
+# key can run code in the coordinator: local workers get a random key, remote
+# ones need TRAWLER_SHARD_AUTHKEY set on every host.
+def ShardAuthkey(local):
+    if SHARD_AUTHKEY != None:
+        return SHARD_AUTHKEY
+    if local:
+        return os.urandom(32)
+    raise ValueError('remote shard workers need TRAWLER_SHARD_AUTHKEY set to the same secret on every host')
+
+
+# ./cache.db -> ./cache-shard3.db
+def ShardPath(path, shard):
+    root, ext = os.path.splitext(path)
+    return '%s-shard%d%s' % (root, shard, ext)
+
+
+# These live in the manager's process, everyone else gets proxies
+_task_queues = {}
+_result_queue = queue.Queue()
+
+
+def GetTaskQueue(shard):
+    return _task_queues.setdefault(shard, queue.Queue())
+
+
+def GetResultQueue():
+    return _result_queue
+
+
+class ShardManager(BaseManager):
+    pass
+
+
+ShardManager.register('get_task_queue', callable=GetTaskQueue)
+ShardManager.register('get_result_queue', callable=GetResultQueue)
+
+
+# Worker loop. Task messages for a scan ('cycle') are
+#   {'type': 'start', 'cycle': n, 'blocks': [...]}
+#   {'type': 'pairs', 'cycle': n, 'pairs': [...]}   (any number of these)
+#   {'type': 'end', 'cycle': n}
+# and one result goes back per cycle. Messages from a cycle we didn't see
+# start (e.g. after a restart) are skipped. A message from another cycle in
+# the middle of one ends it and is handled next, so the coordinator giving up
+# on us and starting the next scan doesn't cost us that scan too.
+def RunWorker(address, shard, authkey):
+    import volume_tracker
+    from block_cache import CACHE_DB_PATH
+    from query_planner import SnapshotPlanner
+    from snapshot_store import SnapshotStore
+
+    manager = ShardManager(address=address, authkey=authkey)
+    manager.connect()
+    tasks = manager.get_task_queue(shard)
+    results = manager.get_result_queue()
+
+    planner = SnapshotPlanner(max_aliases=volume_tracker.SNAPSHOT_BATCH_ALIASES,
+                              max_response_bytes=volume_tracker.SNAPSHOT_BATCH_BYTES,
+                              max_in_flight=volume_tracker.MAX_IN_FLIGHT,
+                              store=SnapshotStore(ShardPath(CACHE_DB_PATH, shard)))
+    print('Shard %d worker connected to %s:%d' % (shard, address[0], address[1]))
+
+    pushed_back = []  # a message read ahead, for the next cycle
+
+    def next_message():
+        if len(pushed_back) > 0:
+            return pushed_back.pop()
+        return tasks.get()
+
+    while True:
+        message = next_message()
+        if message['type'] != 'start':
+            continue
+
+        cycle = message['cycle']
+        blocks = message['blocks']
+
+        def shard_pairs():
+            while True:
+                message = next_message()
+                if message['cycle'] != cycle:
+                    pushed_back.append(message)
+                    return
+                if message['type'] == 'end':
+                    return
+                for pair in message.get('pairs', []):
+                    yield pair
+
+        started = time.time()
+        planner.reset_stats()
+        ids = []
+        tv_volumes = []
+        for pair, tv_data in planner.iter_volume_statistics(shard_pairs(), blocks, key=lambda pair: pair['id']):
+            ids.append(pair['id'])
+            tv_volumes.append(tv_data)
+        fetched = time.time()
+
+        vol_matrix, hits = volume_tracker.DetectHits(tv_volumes)
+
+        results.put({
+            'cycle': cycle,
+            'shard': shard,
+            'ids': ids,
+            'vol_matrix': vol_matrix,
+            'hits': hits,
+            'missing': sum(1 for tv_data in tv_volumes if tv_data == None),
+            'fetch_seconds': fetched - started,
+            'detection_seconds': time.time() - fetched,
+            'stats': planner.stats(),
+        })
+
+
+def ParseAddress(text):
+    host, port = text.rsplit(':', 1)
+    return (host, int(port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run one shard of a sharded scan')
+    commands = parser.add_subparsers(dest='command')
+
+    worker = commands.add_parser('worker')
+    worker.add_argument('--coordinator', required=True, help='host:port of the coordinator')
+    worker.add_argument('--shard', type=int, required=True)
+
+    args = parser.parse_args()
+    if args.command == 'worker':
+        try:
+            authkey = ShardAuthkey(local=False)
+        except ValueError as e:
+            parser.error(str(e))
+        RunWorker(ParseAddress(args.coordinator), args.shard, authkey)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import sqlite3
+import threading
+
+from block_cache import CACHE_DB_PATH
+
+# Snapshots this close to the newest block we asked about could still be
+# reorged, so they're never stored.
+FINALITY_BLOCKS = 64
+
+
+# On-disk store of a pair's cumulative volumeUSD at a block.
+# That number never changes for a final block, so entries never expire.
+# A pair that didn't exist yet at a block is stored as None.
+class SnapshotStore(object):
+
+    def __init__(self, path=CACHE_DB_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS volume_snapshots (
+                pair TEXT NOT NULL,
+                block INTEGER NOT NULL,
+                volume INTEGER,
+                PRIMARY KEY (pair, block)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    # lookups = [(pair, block), ...]
+    # Returns {(pair, block): volume or None} for the lookups we already have
+    def get_many(self, lookups):
+        lookups = list(set(lookups))
+        found = {}
+
+        with self.lock:
+            for i in range(0, len(lookups), 400):  # stay under sqlite's variable limit
+                chunk = lookups[i:i + 400]
+                rows = self.conn.execute(
+                    'SELECT pair, block, volume FROM volume_snapshots WHERE (pair, block) IN (VALUES %s)'
+                    % ','.join(['(?, ?)'] * len(chunk)),
+                    [value for lookup in chunk for value in lookup],
+                )
+                for pair, block, volume in rows:
+                    found[(pair, block)] = volume
+
+            self.hits += len(found)
+            self.misses += len(lookups) - len(found)
+
+        return found
+
+    # snapshots = {(pair, block): volume or None}
+    # Anything newer than final_block is left out.
+    def put_many(self, snapshots, final_block):
+        rows = [(pair, block, volume) for (pair, block), volume in snapshots.items() if block <= final_block]
+
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO volume_snapshots VALUES (?, ?, ?)', rows)
+            self.conn.commit()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,222 @@
+# Streaming mode: instead of only rescanning every SCAN_INTERVAL, follow new
+# blocks over an Ethereum node's websocket (eth_subscribe newHeads). For each
+# block, eth_getLogs finds the Uniswap V2 Swap events on pairs we track, and
+# only those pairs get a fresh volumeUSD and are run through detection again.
+# New hits are sent to discord straight away. Blocks without swaps on our
+# pairs cost one eth_getLogs call and nothing else.
+#
+# Full scans still run every SCAN_INTERVAL to move the day boundaries along,
+# and each one resets what streaming has alerted on. Streaming alerts go into
+# the scan history's last pairs, so the next scan doesn't announce them again.
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import websockets
+
+import graphqlstuff
+import metrics
+from anomaly import MaxVolumeHits
+
+# Swap(address,uint256,uint256,uint256,uint256,address)
+SWAP_TOPIC = '0xd78ad95fa46c994b6551d0da85fc275fe613ce37657fb8d5e3d130840159d822'
+
+MAX_LOG_RANGE = 100  # blocks of logs to catch up on after a reconnect
+RPC_TIMEOUT = 30  # seconds
+MAX_RECONNECT_WAIT = 60  # seconds
+
+blocks_total = metrics.registry.add(metrics.Counter('trawler_stream_blocks_total', 'New blocks seen while streaming'))
+swap_pairs_total = metrics.registry.add(metrics.Counter('trawler_stream_swap_pairs_total',
+                                                        'Tracked pairs with swaps, summed over blocks'))
+stream_alerts_total = metrics.registry.add(metrics.Counter('trawler_stream_alerts_total', 'Alerts sent while streaming'))
+alert_delay_seconds = metrics.registry.add(metrics.Histogram('trawler_stream_alert_delay_seconds',
+                                                             'Time from block timestamp to alert'))
+
+
+class RpcError(Exception):
+    pass
+
+
+# JSON-RPC over a websocket: call() waits for the matching response, and
+# subscription notifications are put on a queue (None once the socket closes)
+class JsonRpcSocket(object):
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.next_id = 1
+        self.pending = {}
+        self.notifications = asyncio.Queue()
+
+    async def read_loop(self):
+        try:
+            async for message in self.websocket:
+                message = json.loads(message)
+                if message.get('method') == 'eth_subscription':
+                    await self.notifications.put(message['params']['result'])
+                    continue
+
+                future = self.pending.pop(message.get('id'), None)
+                if future == None or future.done():
+                    continue
+                if 'error' in message:
+                    future.set_exception(RpcError(message['error']))
+                else:
+                    future.set_result(message.get('result'))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(RpcError('connection closed'))
+            self.pending = {}
+            await self.notifications.put(None)
+
+    async def call(self, method, params):
+        request_id = self.next_id
+        self.next_id += 1
+
+        future = asyncio.get_event_loop().create_future()
+        self.pending[request_id] = future
+        await self.websocket.send(json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}))
+        return await asyncio.wait_for(future, RPC_TIMEOUT)
+
+
+# Per-pair state between full scans, updated from swaps. Pairs are the
+# latest scan's positions; their volumes are kept in the scanner's pair table.
+class StreamWatcher(object):
+
+    def __init__(self, scanner, ws_url, scan_interval):
+        self.scanner = scanner
+        self.table = scanner.table
+        self.ws_url = ws_url
+        self.scan_interval = scan_interval
+
+        # scans and swap updates take turns on this one thread
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.results = None
+        self.addresses = []
+        self.day_start = None  # cumulative volumeUSD at the start of the latest day, by scan position
+        self.alerted = set()
+        self.last_block = None
+
+    # Full scan, then take its pairs and volumes as the starting point
+    def rescan(self):
+        self.scanner.scan_once()
+        self.results = self.scanner.results.latest()
+        self.addresses = [self.results.address(i) for i in range(0, len(self.results))]
+
+        live = graphqlstuff.GetCurrentVolumes(self.addresses)
+        current = np.array([live.get(address, np.nan) for address in self.addresses])
+        self.day_start = current - self.results.vol_matrix[:, -1]
+
+        self.alerted = set(self.results.hit_addresses)  # the scan already reported these
+
+    # Pairs in 'addresses' just swapped: bring their latest day up to date
+    # and alert on any that became hits
+    def on_swaps(self, addresses, block_number, block_timestamp):
+        addresses = list(addresses)
+        positions = self.results.positions(addresses)
+        ids = [addresses[i] for i in np.flatnonzero(positions >= 0)]
+        positions = positions[positions >= 0]
+        if len(ids) == 0:
+            return
+
+        live = graphqlstuff.GetCurrentVolumes(ids)
+        rows = self.results.rows[positions]
+        self.table.volumes.set_latest(rows, np.array([live.get(pair_id, np.nan) for pair_id in ids]) - self.day_start[positions])
+
+        vol_matrix = self.table.volumes.view()[rows]
+        hits = MaxVolumeHits(vol_matrix)
+        new_hits = []
+        for i in np.flatnonzero(hits):
+            if ids[i] not in self.alerted:
+                self.alerted.add(ids[i])
+                new_hits.append((ids[i], self.table.name(rows[i]), vol_matrix[i]))
+
+        if len(new_hits) > 0:
+            self.alert(new_hits, block_number)
+            stream_alerts_total.inc(len(new_hits))
+            alert_delay_seconds.observe(max(0, time.time() - block_timestamp))
+
+    # One discord message per block, however many pairs it tipped over
+    def alert(self, new_hits, block_number):
+        strs = ['~~~ \n Block {0}: 24hr volume is most in 10 day period:'.format(block_number)]
+        for address, name, vol in new_hits:
+            print('Block %d: 24hr volume is most in 10 day period for pair %s (%s).' % (block_number, name, address))
+
+            self.scanner.renderer.submit(name, vol)
+            dextools_url = 'https://www.dextools.io/app/uniswap/pair-explorer/' + address
+            strs.append(' - **NEW** {0}: [dextools]({1})'.format(name, dextools_url))
+
+        self.scanner.notifier.notify('\n'.join(strs))
+        self.scanner.history.mark_announced([name for address, name, vol in new_hits])
+
+    async def handle_head(self, rpc, head):
+        loop = asyncio.get_event_loop()
+        number = int(head['number'], 16)
+        timestamp = int(head.get('timestamp', '0x0'), 16)
+        blocks_total.inc()
+
+        first = number if self.last_block == None else max(self.last_block + 1, number - MAX_LOG_RANGE + 1)
+        self.last_block = number
+        if first > number or len(self.addresses) == 0:
+            return
+
+        logs = await rpc.call('eth_getLogs', [{
+            'fromBlock': hex(first),
+            'toBlock': hex(number),
+            'address': self.addresses,
+            'topics': [SWAP_TOPIC],
+        }])
+
+        addresses = set(log['address'].lower() for log in logs or [])
+        if len(addresses) > 0:
+            swap_pairs_total.inc(len(addresses))
+            await loop.run_in_executor(self.executor, self.on_swaps, addresses, number, timestamp)
+
+    # Follow new blocks, reconnecting with backoff when the socket drops
+    async def watch(self):
+        wait = 1
+        while True:
+            try:
+                async with websockets.connect(self.ws_url, max_size=None) as websocket:
+                    rpc = JsonRpcSocket(websocket)
+                    reader = asyncio.ensure_future(rpc.read_loop())
+                    await rpc.call('eth_subscribe', ['newHeads'])
+                    print('Streaming new blocks from %s' % self.ws_url)
+                    wait = 1
+
+                    while True:
+                        head = await rpc.notifications.get()
+                        if head == None:
+                            break
+                        await self.handle_head(rpc, head)
+
+                    reader.cancel()
+            except (OSError, RpcError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                print('Block stream error: %s' % e)
+
+            print('Block stream disconnected, retrying in %ds' % wait)
+            await asyncio.sleep(wait)
+            wait = min(MAX_RECONNECT_WAIT, wait * 2)
+
+    async def rescan_forever(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.scan_interval)
+            await loop.run_in_executor(self.executor, self.rescan)
+
+    def run(self):
+        self.rescan()
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(asyncio.gather(self.watch(), self.rescan_forever()))
+
+
+def RunStreaming(scanner, ws_url, scan_interval):
+    StreamWatcher(scanner, ws_url, scan_interval).run()
@@ -0,0 +1,226 @@
+import email.utils
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from notifier import DiscordNotifier, SplitMessage, BuildPayloads, MAX_EMBEDS, EMBED_TOTAL_LIMIT
+
+
+# Stand-in Discord webhook. Answers each post with the next status in
+# 'script' (204 once it runs out) and keeps the payloads it accepted.
+# 429s say how long to wait in the JSON body, or only in a Retry-After
+# header when 'retry_after_header' is given.
+class FakeWebhook(object):
+
+    def __init__(self, script=(), retry_after=0.2, retry_after_header=None):
+        self.script = list(script)
+        self.retry_after = retry_after
+        self.retry_after_header = retry_after_header
+        self.accepted = []
+        self.posts = 0
+        self.lock = threading.Lock()
+
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with webhook.lock:
+                    webhook.posts += 1
+                    status = webhook.script.pop(0) if webhook.script else 204
+                    if status == 204:
+                        webhook.accepted.append(body)
+
+                response = b''
+                if status == 429 and webhook.retry_after_header == None:
+                    response = json.dumps({'message': 'You are being rate limited.',
+                                           'retry_after': webhook.retry_after}).encode()
+                self.send_response(status)
+                if status == 429 and webhook.retry_after_header != None:
+                    self.send_header('Retry-After', webhook.retry_after_header)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/webhook' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def descriptions(self):
+        with self.lock:
+            return [embed['description'] for payload in self.accepted for embed in payload['embeds']]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SplitMessageTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(SplitMessage(''), [])
+
+    def test_short_message_is_one_piece(self):
+        self.assertEqual(SplitMessage('a\nb', limit=10), ['a\nb'])
+
+    def test_exactly_the_limit(self):
+        self.assertEqual(SplitMessage('abcd\nefgh', limit=9), ['abcd\nefgh'])
+        self.assertEqual(SplitMessage('abcd\nefghi', limit=9), ['abcd', 'efghi'])
+
+    def test_breaks_on_lines(self):
+        text = '\n'.join('line %02d' % i for i in range(0, 20))
+        pieces = SplitMessage(text, limit=30)
+        self.assertTrue(all(len(piece) <= 30 for piece in pieces))
+        self.assertEqual('\n'.join(pieces), text)
+
+    def test_long_line_is_cut(self):
+        pieces = SplitMessage('ab\n' + 'x' * 25 + '\ncd', limit=10)
+        self.assertEqual(pieces, ['ab', 'x' * 10, 'x' * 10, 'x' * 5 + '\ncd'])
+
+    def test_blank_lines_kept(self):
+        self.assertEqual(SplitMessage('a\n\nb\n', limit=100), ['a\n\nb\n'])
+
+
+class BuildPayloadsTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(BuildPayloads([]), [])
+
+    def test_embed_count_limit(self):
+        payloads = BuildPayloads(['p%d' % i for i in range(0, MAX_EMBEDS + 1)])
+        self.assertEqual([len(payload['embeds']) for payload in payloads], [MAX_EMBEDS, 1])
+
+    def test_total_length_limit(self):
+        piece = 'x' * 2000
+        payloads = BuildPayloads([piece] * 4)
+        self.assertEqual([len(payload['embeds']) for payload in payloads], [3, 1])
+        for payload in payloads:
+            self.assertLessEqual(sum(len(embed['description']) for embed in payload['embeds']), EMBED_TOTAL_LIMIT)
+
+    def test_keeps_order(self):
+        pieces = ['p%d' % i for i in range(0, 25)]
+        payloads = BuildPayloads(pieces)
+        self.assertEqual([embed['description'] for payload in payloads for embed in payload['embeds']], pieces)
+
+
+# DiscordNotifier whose first post blows up, like an unparseable response
+class FlakyNotifier(DiscordNotifier):
+
+    def post(self, payload):
+        if not getattr(self, 'blew_up', False):
+            self.blew_up = True
+            raise ValueError('unexpected response')
+        return DiscordNotifier.post(self, payload)
+
+
+class DiscordNotifierTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = os.path.join(self.dir, 'history.db')
+        self.webhooks = []
+        self.notifiers = []
+
+    def tearDown(self):
+        for notifier in self.notifiers:
+            notifier.close()
+        for webhook in self.webhooks:
+            webhook.close()
+        shutil.rmtree(self.dir)
+
+    def webhook(self, script=(), retry_after_header=None):
+        webhook = FakeWebhook(script, retry_after_header=retry_after_header)
+        self.webhooks.append(webhook)
+        return webhook
+
+    def start_notifier(self, webhook):
+        notifier = DiscordNotifier(webhook.url, path=self.db)
+        self.notifiers.append(notifier)
+        return notifier
+
+    def test_rate_limited_messages_are_delivered_once_in_order(self):
+        webhook = self.webhook([429, 429, 204, 429])
+        notifier = self.start_notifier(webhook)
+
+        messages = ['scan %d' % i for i in range(0, 5)]
+        for message in messages:
+            notifier.notify(message)
+
+        self.assertTrue(notifier.flush(timeout=10))
+        self.assertEqual(webhook.descriptions(), messages)
+        self.assertEqual(webhook.posts, len(messages) + 3)
+        self.assertEqual(notifier.pending(), 0)
+        self.assertEqual(notifier.stats()['rate_limited'], 3)
+        self.assertEqual(notifier.stats()['sent'], len(messages))
+
+    def test_retry_after_http_date(self):
+        webhook = self.webhook([429, 429], retry_after_header=email.utils.formatdate(time.time() + 0.5, usegmt=True))
+        notifier = self.start_notifier(webhook)
+        notifier.notify('first')
+        notifier.notify('second')
+
+        self.assertTrue(notifier.flush(timeout=10))
+        self.assertEqual(webhook.descriptions(), ['first', 'second'])
+        self.assertTrue(notifier.thread.is_alive())
+        self.assertEqual(notifier.stats()['rate_limited'], 2)
+
+    def test_sender_survives_a_bad_response(self):
+        webhook = self.webhook([429], retry_after_header='soon')
+        notifier = FlakyNotifier(webhook.url, path=self.db)
+        self.notifiers.append(notifier)
+        notifier.notify('hello')
+
+        self.assertTrue(notifier.flush(timeout=10))
+        self.assertEqual(webhook.descriptions(), ['hello'])
+        self.assertTrue(notifier.thread.is_alive())
+        self.assertEqual(notifier.stats()['failed'], 1)
+
+    def test_long_message_is_split_and_reassembled(self):
+        webhook = self.webhook([429])
+        notifier = self.start_notifier(webhook)
+
+        text = '\n'.join(' - **NEW** PAIR%d-WETH: [dextools](https://example.com/%d)' % (i, i) for i in range(0, 400))
+        notifier.notify(text)
+
+        self.assertTrue(notifier.flush(timeout=10))
+        self.assertEqual('\n'.join(webhook.descriptions()), text)
+        self.assertEqual(notifier.pending(), 0)
+
+    def test_flush_gives_up_on_a_dead_webhook(self):
+        webhook = self.webhook([500] * 100)
+        notifier = self.start_notifier(webhook)
+        notifier.notify('hello')
+
+        started = time.time()
+        self.assertFalse(notifier.flush(timeout=0.5))
+        self.assertLess(time.time() - started, 2)
+        self.assertEqual(notifier.pending(), 1)
+
+    def test_outbox_is_resent_after_a_restart(self):
+        dead = self.webhook([500] * 100)
+        notifier = self.start_notifier(dead)
+        notifier.notify('left over')
+        self.assertFalse(notifier.flush(timeout=0.5))
+
+        notifier.close()
+        webhook = self.webhook()
+        restarted = self.start_notifier(webhook)
+        self.assertTrue(restarted.flush(timeout=10))
+        self.assertEqual(webhook.descriptions(), ['left over'])
+        self.assertEqual(restarted.pending(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+
+import numpy as np
+
+from pair_table import VolumeRing
+
+
+class VolumeRingTest(unittest.TestCase):
+
+    # The ring holds the last 'window' buckets of 'history', without copying
+    def check(self, ring, history):
+        view = ring.view()
+        np.testing.assert_array_equal(view, history[:, -ring.window:])
+        self.assertTrue(np.shares_memory(view, ring.buffer))
+        np.testing.assert_array_equal(ring.buffer[:ring.size, :ring.window], ring.buffer[:ring.size, ring.window:])
+        self.assertTrue(np.all(np.isnan(ring.buffer[ring.size:])))
+
+    def test_push_wraps_around(self):
+        rng = np.random.default_rng(0)
+        window = 5
+        volumes = rng.lognormal(5, 1, (10, 4 * window + 2))
+        volumes[rng.random(volumes.shape) < 0.1] = np.nan
+
+        ring = VolumeRing(window, capacity=16)
+        ring.add_rows(volumes[:, :window])
+        self.check(ring, volumes[:, :window])
+        for bucket in range(window, volumes.shape[1]):
+            ring.push(volumes[:, bucket])
+            self.check(ring, volumes[:, :bucket + 1])
+            np.testing.assert_array_equal(ring.view()[:, -1], volumes[:, bucket])
+
+    def test_window_of_one(self):
+        ring = VolumeRing(1, capacity=2)
+        ring.add_rows([[1.0], [2.0]])
+        ring.push([3.0, 4.0])
+        self.check(ring, np.array([[1.0, 3.0], [2.0, 4.0]]))
+
+    def test_set_latest_and_write_after_wrapping(self):
+        rng = np.random.default_rng(1)
+        window = 4
+        volumes = rng.random((6, 11))
+
+        ring = VolumeRing(window, capacity=8)
+        ring.add_rows(volumes[:, :window])
+        for bucket in range(window, volumes.shape[1]):
+            ring.push(volumes[:, bucket])
+
+            if bucket % 3 == 0:
+                rows = np.array([1, 4])
+                volumes[rows, bucket] = rng.random(2)
+                ring.set_latest(rows, volumes[rows, bucket])
+            if bucket % 5 == 0:
+                rows = np.array([5, 0])
+                volumes[rows, bucket - window + 1:bucket + 1] = rng.random((2, window))
+                ring.write(rows, volumes[rows, bucket - window + 1:bucket + 1])
+            self.check(ring, volumes[:, :bucket + 1])
+
+    def test_rows_past_capacity(self):
+        rng = np.random.default_rng(2)
+        window = 3
+        volumes = rng.random((9, 10))
+
+        ring = VolumeRing(window, capacity=2)
+        ring.add_rows(volumes[:2, :window])
+        ring.push(volumes[:2, window])
+        ring.push(volumes[:2, window + 1])
+
+        # new rows come with their history, lined up with the window
+        rows = ring.add_rows(volumes[2:, window - 1:window + 2])
+        np.testing.assert_array_equal(rows, np.arange(2, 9))
+        self.assertGreaterEqual(ring.capacity(), 9)
+        self.check(ring, volumes[:, :window + 2])
+
+        for bucket in range(window + 2, volumes.shape[1]):
+            ring.push(volumes[:, bucket])
+            self.check(ring, volumes[:, :bucket + 1])
+
+    def test_keep_evicts_rows(self):
+        rng = np.random.default_rng(3)
+        window = 4
+        volumes = rng.random((8, 12))
+
+        ring = VolumeRing(window, capacity=8)
+        ring.add_rows(volumes[:, :window])
+        for bucket in range(window, 7):
+            ring.push(volumes[:, bucket])
+
+        kept = [6, 0, 3]
+        ring.keep(kept)
+        self.assertEqual(ring.size, 3)
+        self.check(ring, volumes[kept, :7])
+
+        for bucket in range(7, volumes.shape[1]):
+            ring.push(volumes[kept, bucket])
+            self.check(ring, volumes[kept, :bucket + 1])
+
+        # freed rows are reused
+        rows = ring.add_rows(volumes[1:2, -window:])
+        np.testing.assert_array_equal(rows, [3])
+        self.check(ring, np.vstack([volumes[kept], volumes[1:2]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from gql import Client
+
+from fake_subgraph import FakeSubgraph, MakeHandler, ThreadingHTTPServer
+from query_planner import SnapshotPlanner
+from rate_control import RateController, SubgraphTransport
+from snapshot_store import SnapshotStore, FINALITY_BLOCKS
+
+NUM_PAIRS = 30
+BLOCKS = list(range(1100, 2001, 100))  # 10 lookups per pair
+
+
+def PairAddress(i):
+    return '0x%040x' % (0xdef000 + i)
+
+
+# Pairs trade steadily from block 1000 on, except the last one, which only
+# shows up at block 1450
+def Fixtures():
+    now = int(time.time())
+    snapshots = dict((PairAddress(i), [[1000, 0.0], [2000, 1000000.0 * (i + 1)]]) for i in range(0, NUM_PAIRS))
+    snapshots[PairAddress(NUM_PAIRS - 1)] = [[1450, 0.0], [2000, 5000.0]]
+    return {
+        'recorded_at': now,
+        'pairs': [{'id': PairAddress(i), 'createdAtTimestamp': str(now - 86400)} for i in range(0, NUM_PAIRS)],
+        'blocks': [[1000, now - 13000], [2000, now]],
+        'snapshots': snapshots,
+    }
+
+
+class SnapshotPlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.dir)
+
+    # Planner (configured for 250 aliases) against a fake subgraph started
+    # with 'options'. Requests fail on their first error, so error counts
+    # are exact.
+    def planner(self, **options):
+        self.subgraph = FakeSubgraph(Fixtures(), **options)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), MakeHandler(self.subgraph))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers.append(server)
+
+        controller = RateController(rate=1000, retry_budget=0, min_retries=0)
+        url = 'http://127.0.0.1:%d/uniswap-v2' % server.server_address[1]
+        client = Client(transport=SubgraphTransport(url, controller))
+        self.store = SnapshotStore(os.path.join(self.dir, 'cache-%d.db' % len(self.servers)))
+        return SnapshotPlanner(max_aliases=250, max_in_flight=4, uni_client=client, store=self.store)
+
+    def expected(self, contract, blocks=BLOCKS):
+        volumes = [self.subgraph.volume_at(contract, block) for block in blocks]
+        if None in volumes:
+            return None
+        return [int(float(volume)) for volume in volumes]
+
+    def pairs(self):
+        return [PairAddress(i) for i in range(0, NUM_PAIRS)]
+
+    def test_fetches_every_pair_in_order(self):
+        planner = self.planner()
+        results = list(planner.iter_volume_statistics(self.pairs(), BLOCKS))
+
+        self.assertEqual([contract for contract, tv_volume in results], self.pairs())
+        for contract, tv_volume in results:
+            self.assertEqual(tv_volume, self.expected(contract))
+        self.assertIsNone(results[-1][1])  # didn't exist at the first blocks
+        self.assertEqual(planner.stats()['requests'], 2)  # 300 lookups, 250 a chunk
+
+    def test_learns_the_alias_limit(self):
+        planner = self.planner(max_aliases=40)
+
+        results = dict(planner.iter_volume_statistics(self.pairs(), BLOCKS))
+        for contract in self.pairs():
+            self.assertEqual(results[contract], self.expected(contract))
+        self.assertEqual(planner.stats()['failed_lookups'], 0)
+        self.assertGreater(planner.stats()['splits'], 0)
+        self.assertLessEqual(planner.chunk_size(), 40)
+        self.assertGreaterEqual(planner.chunk_size(), 20)
+
+        # later chunks start out at the learned size
+        planner.reset_stats()
+        blocks = [block + 1 for block in BLOCKS]
+        results = dict(planner.iter_volume_statistics(self.pairs(), blocks))
+        for contract in self.pairs():
+            self.assertEqual(results[contract], self.expected(contract, blocks))
+        self.assertLessEqual(planner.stats()['failed_requests'], 1)  # at most a probe for a bigger size
+
+    def test_splits_a_chunk_that_is_too_large(self):
+        planner = self.planner(max_aliases=30)
+        chunk = [(contract, block) for contract in self.pairs()[:10] for block in BLOCKS]
+
+        results = planner.execute_chunk(chunk)
+        self.assertEqual(sorted(results), sorted(chunk))
+        for (contract, block), volume in results.items():
+            self.assertEqual(volume, int(float(self.subgraph.volume_at(contract, block))))
+
+        stats = planner.stats()
+        self.assertGreater(stats['splits'], 0)
+        self.assertEqual(stats['failed_lookups'], 0)
+        self.assertLessEqual(planner.too_large, 100)
+        self.assertLessEqual(planner.largest_ok, 30)
+
+    def test_does_not_split_on_server_errors(self):
+        planner = self.planner(error_rate=1.0)
+        chunk = [(contract, block) for contract in self.pairs()[:10] for block in BLOCKS]
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(planner.execute_chunk(chunk), {})
+        stats = planner.stats()
+        self.assertEqual((stats['requests'], stats['splits'], stats['failed_lookups']), (1, 0, len(chunk)))
+        self.assertEqual(planner.chunk_size(), 250)  # nothing learned from a 500
+        self.assertEqual(self.store.get_many(chunk), {})
+
+    def test_does_not_split_when_rate_limited(self):
+        planner = self.planner(rate_limit=0.01)
+        chunk = [(contract, block) for contract in self.pairs()[:10] for block in BLOCKS]
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(planner.execute_chunk(chunk), {})
+        stats = planner.stats()
+        self.assertEqual((stats['requests'], stats['splits'], stats['failed_lookups']), (1, 0, len(chunk)))
+        self.assertIsNone(planner.too_large)
+
+    def test_only_final_snapshots_are_stored(self):
+        planner = self.planner()
+        lookups = [(contract, block) for contract in self.pairs() for block in BLOCKS]
+
+        list(planner.iter_volume_statistics(self.pairs(), BLOCKS))
+        stored = self.store.get_many(lookups)
+        self.assertEqual(set(block for contract, block in stored), set(BLOCKS[:-1]))  # within FINALITY_BLOCKS of 2000
+        self.assertGreater(max(BLOCKS) - BLOCKS[-2], FINALITY_BLOCKS)
+
+        # with an explicit final block, only up to it
+        planner = self.planner()
+        list(planner.iter_volume_statistics(self.pairs(), BLOCKS, final_block=1500))
+        stored = self.store.get_many(lookups)
+        self.assertEqual(set(block for contract, block in stored), set(block for block in BLOCKS if block <= 1500))
+
+        # and the next run only asks for what wasn't stored
+        planner.reset_stats()
+        results = dict(planner.iter_volume_statistics(self.pairs(), BLOCKS, final_block=1500))
+        for contract in self.pairs():
+            self.assertEqual(results[contract], self.expected(contract))
+        self.assertEqual(planner.stats()['cache_hits'], len(stored))
+        self.assertEqual(planner.stats()['cache_misses'], len(lookups) - len(stored))
+
+
+if __name__ == '__main__':
+    unittest.main()
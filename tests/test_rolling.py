@@ -0,0 +1,107 @@
+import unittest
+import warnings
+
+import numpy as np
+
+from rolling import RollingStats
+
+
+# Random volumes with NaN gaps, zero days, and rows that only go down, so a
+# row's max keeps falling out of the window
+def RandomVolumes(rng, rows, buckets):
+    volumes = rng.lognormal(5, 1, (rows, buckets))
+    volumes[rng.random((rows, buckets)) < 0.1] = np.nan
+    volumes[rng.random((rows, buckets)) < 0.05] = 0
+    volumes[0] = np.linspace(1000, 1, buckets)
+    volumes[1] = np.nan
+    return volumes
+
+
+class RollingStatsTest(unittest.TestCase):
+
+    # RollingStats' statistics against numpy over the same buckets
+    def check(self, stats, history):
+        window = history[:, -stats.window:]
+        np.testing.assert_array_equal(stats.window_values(), window)
+
+        baseline = window[:, :stats.window - stats.holdout]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN rows
+            mean = np.nanmean(baseline, axis=1)
+            std = np.nanstd(baseline, axis=1)
+            max_ = np.nanmax(baseline, axis=1)
+
+        np.testing.assert_array_equal(stats.count, np.sum(~np.isnan(baseline), axis=1))
+        np.testing.assert_allclose(stats.mean(), mean, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(stats.std(), std, rtol=1e-6, atol=1e-6)
+
+        latest = window[:, -1]
+        scores = stats.scores(latest)
+        np.testing.assert_array_equal(scores['max'], max_)
+        np.testing.assert_allclose(scores['latest_dev'], latest - mean, rtol=1e-9, atol=1e-9)
+
+    def replay(self, window, holdout, seed):
+        rng = np.random.default_rng(seed)
+        volumes = RandomVolumes(rng, 20, window + 5 * window + 3)  # wraps around several times
+
+        stats = RollingStats(window, holdout)
+        stats.add_rows(['pair%d' % i for i in range(0, 20)], volumes[:, :window])
+        self.check(stats, volumes[:, :window])
+
+        for bucket in range(window, volumes.shape[1]):
+            stats.push(volumes[:, bucket])
+            self.check(stats, volumes[:, :bucket + 1])
+
+    def test_matches_numpy(self):
+        self.replay(7, 0, 0)
+
+    def test_matches_numpy_with_holdout(self):
+        self.replay(10, 3, 1)
+
+    def test_window_of_one(self):
+        self.replay(1, 0, 2)
+
+    def test_max_falls_out_of_the_window(self):
+        stats = RollingStats(4)
+        stats.add_rows(['a'], [[9, 1, 2, 3]])
+        self.assertEqual(stats.scores([0])['max'][0], 9)
+
+        stats.push([1])
+        self.assertEqual(stats.scores([0])['max'][0], 3)
+        stats.push([np.nan])
+        stats.push([np.nan])
+        stats.push([np.nan])
+        self.assertEqual(stats.count[0], 1)
+        self.assertEqual(stats.scores([0])['max'][0], 1)
+        stats.push([np.nan])
+        self.assertEqual(stats.count[0], 0)
+        self.assertTrue(np.isnan(stats.scores([0])['max'][0]))
+        self.assertTrue(np.isnan(stats.mean()[0]))
+
+    def test_rows_added_and_retained_between_pushes(self):
+        rng = np.random.default_rng(3)
+        window = 6
+        volumes = RandomVolumes(rng, 12, 40)
+
+        stats = RollingStats(window, 2)
+        stats.add_rows(['pair%d' % i for i in range(0, 8)], volumes[:8, :window])
+        kept = list(range(0, 8))
+        for bucket in range(window, volumes.shape[1]):
+            if bucket == 15:
+                # new pairs come with their history, lined up with the window
+                stats.add_rows(['pair%d' % i for i in range(8, 12)], volumes[8:, bucket - window:bucket])
+                kept = kept + list(range(8, 12))
+            if bucket == 25:
+                stats.retain(['pair%d' % i for i in (11, 0, 5, 9, 2)] + ['unknown'])
+                kept = [0, 2, 5, 9, 11]
+                self.assertEqual(stats.ids, ['pair%d' % i for i in kept])
+
+            stats.push(volumes[kept, bucket])
+            self.check(stats, volumes[kept, :bucket + 1])
+
+    def test_holdout_has_to_be_smaller_than_the_window(self):
+        self.assertRaises(ValueError, RollingStats, 5, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from scan_export import PruneScans, ListScans, ScanDirName, ScanTime
+
+NOW = 1760000000
+
+
+class PruneScansTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    # An exported scan from 'age' seconds ago, 'size' bytes of volumes
+    def scan(self, age, size=1000):
+        path = os.path.join(self.dir, ScanDirName(NOW - age))
+        os.makedirs(path)
+        with open(os.path.join(path, 'manifest.json'), 'w') as f:
+            f.write('{}')
+        with open(os.path.join(path, 'volumes.npy'), 'wb') as f:
+            f.write(b'\0' * size)
+        return path
+
+    def ages(self):
+        return [NOW - ScanTime(os.path.basename(path)) for path in ListScans(self.dir)]
+
+    def test_scan_dir_name_is_utc(self):
+        self.assertEqual(ScanDirName(NOW), '20251009T085320Z')
+        self.assertEqual(ScanTime(ScanDirName(NOW)), NOW)
+
+    def test_drops_scans_past_max_age(self):
+        for age in (300, 200, 100, 0):
+            self.scan(age)
+        self.assertEqual(PruneScans(self.dir, max_age=150, max_bytes=0, now=NOW), 2)
+        self.assertEqual(self.ages(), [100, 0])
+
+    def test_drops_oldest_scans_over_max_bytes(self):
+        for age in (300, 200, 100, 0):
+            self.scan(age, size=1000)
+        self.assertEqual(PruneScans(self.dir, max_age=0, max_bytes=2500, now=NOW), 2)
+        self.assertEqual(self.ages(), [100, 0])
+
+    def test_keeps_the_newest_scan(self):
+        self.scan(1000, size=5000)
+        self.scan(500, size=5000)
+        self.assertEqual(PruneScans(self.dir, max_age=10, max_bytes=100, now=NOW), 1)
+        self.assertEqual(self.ages(), [500])
+
+    def test_no_limits(self):
+        for age in (300, 0):
+            self.scan(age)
+        self.assertEqual(PruneScans(self.dir, max_age=0, max_bytes=0, now=NOW), 0)
+        self.assertEqual(PruneScans(os.path.join(self.dir, 'missing'), now=NOW), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+import websockets
+
+import graphqlstuff
+import streaming
+from anomaly import MaxVolumeHits
+from fake_node import FakeNode
+from pair_table import PairTable
+from results_api import ResultsStore
+from scan_history import ScanHistory
+from volume_tracker import formatDiscordString
+
+LOOKBACK = 10
+NUM_PAIRS = 40
+
+
+def PairAddress(i):
+    return '0x%040x' % (0xabc000 + i)
+
+
+# FakeNode that remembers the block ranges it was asked for logs over
+class RecordingNode(FakeNode):
+
+    def __init__(self, fixtures, block_time, swap_rate):
+        FakeNode.__init__(self, fixtures, block_time, swap_rate)
+        self.log_ranges = []
+        self.published = []
+
+    def logs(self, from_block, to_block, addresses):
+        self.log_ranges.append((from_block, to_block))
+        return FakeNode.logs(self, from_block, to_block, addresses)
+
+    def header(self, number):
+        self.published.append(number)
+        return FakeNode.header(self, number)
+
+    async def drop_connections(self):
+        for websocket in list(self.subscribers):
+            await websocket.close()
+
+
+# Stand-in subgraph client for GetCurrentVolumes. Once 'swapping' is on,
+# every pair asked about has traded another 100 since it was last asked.
+class VolumeClient(object):
+
+    def __init__(self):
+        self.volumes = dict((PairAddress(i), 1000.0) for i in range(0, NUM_PAIRS))
+        self.swapping = False
+        self.asked = []
+
+    def execute(self, query, variable_values=None):
+        ids = variable_values['ids']
+        if self.swapping:
+            self.asked.extend(ids)
+            for pair_id in ids:
+                self.volumes[pair_id] += 100
+        return {'pairs': [{'id': pair_id, 'volumeUSD': str(self.volumes[pair_id])} for pair_id in ids]}
+
+
+# The parts of volume_tracker.Scanner that StreamWatcher uses. Every pair's
+# earlier days start out peaking at 100 and today is 50, so one swap makes it
+# a hit. Later scans keep the volumes streaming brought up to date, and
+# announce new hits the way the scanner does.
+class FakeScanner(object):
+
+    def __init__(self, history_path):
+        self.table = PairTable(LOOKBACK)
+        self.results = ResultsStore()
+        self.history = ScanHistory(history_path)
+        self.charts = []
+        self.messages = []
+        self.renderer = self
+        self.notifier = self
+
+    def scan_once(self):
+        pairs = [{'id': PairAddress(i), 'token0': {'symbol': 'TK%d' % i}, 'token1': {'symbol': 'WETH'}}
+                 for i in range(0, NUM_PAIRS)]
+        rows = self.table.add(pairs)
+        if self.results.latest() == None:
+            vol_matrix = np.full((len(rows), LOOKBACK), 80.0)
+            vol_matrix[:, 0] = 100
+            vol_matrix[:, -1] = 50
+            self.table.volumes.write(rows, vol_matrix)
+
+        vol_matrix = self.table.volumes.view()[rows]
+        hits = MaxVolumeHits(vol_matrix)
+        scan = {'start_time': [''], 'end_time': [''], 'num_searched': len(rows), 'pairs': [
+            {'name': self.table.name(row), 'address': self.table.address(row), 'time': ['']} for row in rows[hits]]}
+        self.results.publish(scan, self.table, rows, vol_matrix, hits)
+
+        new_pairs = self.history.new_pairs(scan)
+        self.history.append(scan)
+        discord_string = formatDiscordString(scan, new_pairs)
+        if discord_string != None:
+            self.notify(discord_string)
+
+    def submit(self, name, vol):
+        self.charts.append(name)
+
+    def notify(self, text):
+        self.messages.append(text)
+
+
+class StreamWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        now = int(time.time())
+        self.node = RecordingNode({'recorded_at': now, 'blocks': [[1000, now - 13000], [2000, now]]},
+                                  block_time=0.05, swap_rate=0.02)
+        self.client = VolumeClient()
+        self.original_client = graphqlstuff.client
+        graphqlstuff.client = self.client
+
+        self.dir = tempfile.mkdtemp()
+        self.scanner = FakeScanner(os.path.join(self.dir, 'history.db'))
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        graphqlstuff.client = self.original_client
+        self.loop.close()
+        shutil.rmtree(self.dir)
+
+    # Serve the fake node and stream from it, dropping every connection
+    # after 'drop_after' seconds
+    def stream(self, watcher, seconds, drop_after=None):
+        async def scenario():
+            server = await websockets.serve(self.node.handle, '127.0.0.1', 0)
+            watcher.ws_url = 'ws://127.0.0.1:%d' % server.sockets[0].getsockname()[1]
+            publisher = asyncio.ensure_future(self.node.publish())
+            watching = asyncio.ensure_future(watcher.watch())
+
+            if drop_after != None:
+                await asyncio.sleep(drop_after)
+                await self.node.drop_connections()
+                await asyncio.sleep(seconds - drop_after)
+            else:
+                await asyncio.sleep(seconds)
+
+            watching.cancel()
+            publisher.cancel()
+            await asyncio.gather(watching, publisher, return_exceptions=True)
+            server.close()
+            await server.wait_closed()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(scenario())
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            watcher.rescan()
+            self.client.swapping = True
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+        watcher.executor.shutdown(wait=True)
+
+    # Pairs with Swap logs over every block range the watcher asked about
+    def swapped(self, watcher):
+        addresses = set()
+        for from_block, to_block in self.node.log_ranges:
+            for log in FakeNode.logs(self.node, from_block, to_block, watcher.addresses):
+                addresses.add(log['address'])
+        return addresses
+
+    def alerted(self):
+        return [line.split('](https://www.dextools.io/app/uniswap/pair-explorer/')[1].rstrip(')')
+                for message in self.scanner.messages for line in message.split('\n') if '**NEW**' in line]
+
+    def test_only_swapped_pairs_are_rechecked(self):
+        watcher = streaming.StreamWatcher(self.scanner, None, 3600)
+        self.stream(watcher, 1.5)
+
+        swapped = self.swapped(watcher)
+        self.assertGreater(len(swapped), 0)
+        self.assertLess(len(swapped), NUM_PAIRS)
+        self.assertEqual(set(self.client.asked), swapped)
+
+        # every re-checked pair was one swap from a hit, and is alerted once
+        self.assertEqual(sorted(self.alerted()), sorted(swapped))
+        rows = self.scanner.table.rows_of(sorted(swapped))
+        self.assertTrue(np.all(self.scanner.table.volumes.view()[rows, -1] > 100))
+
+    def test_reconnect_resumes_without_losing_blocks(self):
+        watcher = streaming.StreamWatcher(self.scanner, None, 3600)
+        self.stream(watcher, 3.0, drop_after=0.8)
+
+        self.assertGreaterEqual(self.node.next_subscription, 3)  # subscribed again after the drop
+
+        # the log ranges asked for cover every block from the first head on, without gaps
+        ranges = sorted(self.node.log_ranges)
+        for (_, previous_to), (from_block, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(from_block, previous_to + 1)
+        self.assertGreaterEqual(ranges[-1][1], max(self.node.published) - 1)
+
+        # and the blocks missed while disconnected were caught up on in one go
+        self.assertTrue(any(to_block - from_block > 5 for from_block, to_block in ranges))
+
+        swapped = self.swapped(watcher)
+        self.assertEqual(set(self.client.asked), swapped)
+        self.assertEqual(sorted(self.alerted()), sorted(swapped))
+
+    def test_next_scan_does_not_announce_streaming_alerts_again(self):
+        watcher = streaming.StreamWatcher(self.scanner, None, 3600)
+        self.stream(watcher, 1.5)
+
+        streamed = self.alerted()
+        self.assertGreater(len(streamed), 0)
+
+        # one more pair becomes a hit without streaming seeing it
+        quiet = sorted(set(PairAddress(i) for i in range(0, NUM_PAIRS)) - set(streamed))[0]
+        self.scanner.table.volumes.set_latest(self.scanner.table.rows_of([quiet]), np.array([150.0]))
+
+        messages = len(self.scanner.messages)
+        with contextlib.redirect_stdout(io.StringIO()):
+            watcher.rescan()
+
+        # the scan finds the streamed hits again, but only the new one is **NEW**
+        hits = self.scanner.results.latest().hit_addresses
+        self.assertIn(quiet, hits)
+        self.assertGreater(len(hits & set(streamed)), 0)
+        self.assertEqual(len(self.scanner.messages), messages + 1)
+        self.assertEqual(self.alerted(), streamed + [quiet])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,15 @@
-import matplotlib.pyplot as plt
-# from matplotlib.pyplot import figure
 import numpy as np
 import time
 import datetime
 
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+from gql import gql
 
+from graphqlstuff import client, ConvertTimeStampsToBlocks, GetVolumeStatistics
+from scan_engine import map_bounded
+from anomaly import DailyVolumes, TotalVolumeMatrix
+from detectors import DETECTORS, RunDetectors
+from charts import ChartRenderer
 
-plt.rcParams["figure.figsize"] = (5,3)
 
 #os.environ["PROVIDER"] = "https://mainnet.infura.io/v3/ac6c8b97894749d09f1c78f9577b56d9" # Go to Infura and copy paste "Endpoints"
 
@@ -50,72 +51,6 @@ def Return24hrTimestamps(init_timestamp, num_days):
 
     return timestamps
 
-# convert timestamps to blocks
-def ConvertTimeStampsToBlocks(timestamps):
-
-    blocks = [None]*(len(timestamps))
-
-    # eth block api
-    sample_transport_ETH = RequestsHTTPTransport(
-        url='https://api.thegraph.com/subgraphs/name/blocklytics/ethereum-blocks',
-        verify=True,
-        retries=5,
-    )
-    client_ETH = Client(
-        transport=sample_transport_ETH
-    )
-
-    for i in range(0 , len(timestamps)):
-        params_name = {
-            "timestamp_gt": timestamps[i]
-        }
-
-        block = gql("""
-        query($timestamp_gt: BigInt! )
-        {
-            blocks(first: 1, orderBy: timestamp, orderDirection: asc,
-            where: {timestamp_gt: $timestamp_gt})
-        {
-            id
-        number
-        timestamp
-        }
-        }""")
-
-        block_data = client_ETH.execute(block, variable_values=params_name)
-        blocks[i] = int(block_data['blocks'][0]['number'])
-
-    return blocks
-
-# Get volume for the blocks contained in 'blocks'
-# Return the volume as
-# volume = [vol_from_block0_to_block1, vol_from_block1_to_block2, ...]
-# where blocks = [block0, block1, ...]
-def GetVolumeStatistics(contract, blocks, client):
-
-    tv_volume = [None]*len(blocks)
-    for i in range(0, len(blocks)):
-        params = {
-            "id": contract,
-            "number": blocks[i]
-        }
-        query = gql("""
-            query ($id : ID!, $number : Int!) 
-              {
-               pair(id: $id, block: {number: $number}){
-                   volumeUSD
-               }
-              }        
-        """)
-
-        vol_data = client.execute(query, variable_values=params)
-        if(vol_data['pair'] == None):
-            return None
-        else:
-            tv_volume[i] = int(float(vol_data['pair']['volumeUSD'])) # round the fractional stuff
-
-    return tv_volume
-
 # Calculate Vol From TotalVolume
 def CalculateVolFromTotalVol(total_vol):
 
@@ -126,25 +61,26 @@ def CalculateVolFromTotalVol(total_vol):
 
     return dv_vol
 
+def PairName(pair):
+    return pair['token0']['symbol'] + '-' + pair['token1']['symbol']
+
+# GetVolumeStatistics for one pair, or None (missing history) if its requests
+# failed, so one pair can't end the whole run
+def TryGetVolumeStatistics(pair, blocks):
+    try:
+        return GetVolumeStatistics(pair['id'], blocks, client)
+    except Exception as e:
+        print('Volume lookups failed for %s: %s' % (PairName(pair), e))
+        return None
+
+# Fetch the top 1000 pairs' volume once and run every registered detector on it
 def main():
 
     LOOKBACK_PERIOD = 10 # days
-
-    # uniswap api
-    sample_transport = RequestsHTTPTransport(
-        url='https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v2',
-        verify=True,
-        retries=5,
-    )
-    client = Client(
-        transport=sample_transport
-    )
+    MAX_IN_FLIGHT = 16 # how many pairs to fetch at once
 
     pairs = GetFirstThousandPairs(client)
 
-    contracts = [None]*1000
-
-
     # get time now
     # calculate times going back every 24hrs for 30 days
     #
@@ -154,190 +90,30 @@ def main():
     timestamps = Return24hrTimestamps(time_now, LOOKBACK_PERIOD)
     blocks = ConvertTimeStampsToBlocks(timestamps)
 
-    text = input("Press 1 to find coins with Max Volume in past 30 days, Press 2 for more speculative large deviation analysis. 3 for variation on 2")  # Python 3
-
-    useToday = False
-
-    if(text == '1'):
-        for i in range(0, 1000):
-
-            if (i % 50 == 0):
-                print('Got through %d so far' % i)
-
-            current_pair = pairs[i]
-            contracts[i] = current_pair
-
-            token0 = current_pair['token0']
-            token1 = current_pair['token1']
-
-            pair_string = token0['symbol'] + '-' + token1['symbol']
-            pair_address = current_pair['id']
-
-            # get 10-30 days worth of volume statistics for a given currency
-            tv_data = GetVolumeStatistics(pair_address, blocks, client)
-            len_desired = LOOKBACK_PERIOD
-
-            if((tv_data == None) or (len(tv_data) != LOOKBACK_PERIOD+1)):
-                print('Pair %s full historical data not available. Examine it manually.' % pair_string)
-                time.sleep(0.1)
-            else:
-                vol = CalculateVolFromTotalVol(tv_data)
-
-                print('Examining Volume for Pair:' + pair_string)
-                print('Contract: %s.' % pair_address)
-
-                if(np.argmax(vol) == len_desired - 1 and (np.max(vol) < 2.5*float(np.max(vol[0:len_desired-2])))):
-                    # if most recent period is max, take a closer look:
-                    print('24hr volume is most in 30 day period for pair %s. Plotting:' % pair_string)
-
-                    plt.bar(np.arange(0, len_desired), vol)
-
-                    fileStr = pair_string
-
-                    plt.title(fileStr)
-                    # plt.show()
-                    plt.savefig('./images/' + fileStr)
-                    plt.clf()
-                time.sleep(0.1) # so i don't get DDOS warning (idk how fast i can poll yet)
-
-    elif(text == '2'): # large deviation stuff
-        for i in range(0, 3):
-
-            if (i % 50 == 0):
-                print('Got through %d so far' % i)
-
-            contracts[i] = pairs['pairs'][i]
-
-
-            # Get name data for convenience
-            # name_data = QueryNameData(contracts[i], client)
-
-            # get 10-30 days worth of volume statistics for a given currency
-            tv_data = GetVolumeStatistics(contracts[i], blocks, client)
-            len_desired = LOOKBACK_PERIOD
-
-            if((tv_data == None) or (len(tv_data) != LOOKBACK_PERIOD+1)):
-                print('Contract %s full historical data not available. Examine it manually.' % contracts[i])
-                time.sleep(0.1)
-            else:
-                vol = CalculateVolFromTotalVol(tv_data)
-                cheby_thresh = 0.4
-
-                print('Examining volume for contract %s.' % contracts[i])
-                print('Pair:' + name_data['pair']['token0']['symbol'] + '/' + name_data['pair']['token1']['symbol'])
-
-                vol_mean = np.mean(vol[0:len_desired-3])
-                vol_std = np.std(vol[0:len_desired-3]) # leave last two elements for examination
-
-                yesterdays_vol_dev = vol[len_desired - 2] - vol_mean
-                todays_vol_dev = vol[len_desired - 1] - vol_mean
-
-                k_cheby_yesterday = np.abs(yesterdays_vol_dev)/vol_std
-                p_cheby_yesterday = 1/(k_cheby_yesterday)**2
-
-                k_cheby_today = np.abs(todays_vol_dev) / vol_std
-                p_cheby_today = 1 / (k_cheby_today) ** 2
-
-                if(p_cheby_yesterday < cheby_thresh):
-                    if(yesterdays_vol_dev < 0):
-                        print('Yesterday, volume was anomalously low for this coin. Ignoring...')
-                    else:
-                        print('Yesterday, volume was anomalously high for this coin. Checking todays volume...')
-
-                        if(p_cheby_today < cheby_thresh and todays_vol_dev > 0):
-                            print('Todays volume is also anomalous. Plotting...')
-                            plt.bar(np.arange(0, len_desired), vol)
-                            plt.show()
-                            plt.clf()
-                        else:
-                            print('Todays volume is not anomalous, likely pumped already, ignoring...')
-
-                if(p_cheby_today < cheby_thresh and p_cheby_yesterday >= cheby_thresh): # plot all anomalous vols that were not caputred above
-
-                    if(todays_vol_dev < 0):
-                        print('Today, volume was anomalously low for this coin. Ignoring...')
-                    else:
-                        print('Today, volume was anomalously high for this coin. Plotting volume chart')
-                        plt.bar(np.arange(0, len_desired), vol)
-                        plt.show()
-                        plt.clf()
-
-                time.sleep(0.1) # so i don't get DDOS warning (idk how fast i can poll yet)
-
-    elif(text == '3'): # modified to filter events where today's vol is lower than yesterdays
-        for i in range(0, 1000):
-
-            if (i % 50 == 0):
-                print('Got through %d so far' % i)
-
-            contracts[i] = pairs['pairs'][i]['id']
+    # get 10-30 days worth of volume statistics for every pair, a few at a time
+    tv_volumes = map_bounded(lambda pair: TryGetVolumeStatistics(pair, blocks), pairs, MAX_IN_FLIGHT)
 
-            # Get name data for convenience
-            name_data = QueryNameData(contracts[i], client)
+    # daily volume for every pair at once, shared by every detector
+    vol_matrix = DailyVolumes(TotalVolumeMatrix(tv_volumes, LOOKBACK_PERIOD + 1))
 
-            # get 10-30 days worth of volume statistics for a given currency
-            tv_data = GetVolumeStatistics(contracts[i], blocks, client)
-            len_desired = LOOKBACK_PERIOD
+    for i in range(0, len(pairs)):
+        if((tv_volumes[i] == None) or (len(tv_volumes[i]) != LOOKBACK_PERIOD+1)):
+            print('Pair %s full historical data not available. Examine it manually.' % PairName(pairs[i]))
 
-            if((tv_data == None) or (len(tv_data) != LOOKBACK_PERIOD+1)):
-                print('Contract %s full historical data not available. Examine it manually.' % contracts[i])
-                time.sleep(0.1)
-            else:
-                vol = CalculateVolFromTotalVol(tv_data)
-                cheby_thresh = 0.5
+    results = RunDetectors(vol_matrix)
+    renderer = ChartRenderer(figsize=(5,3))
 
-                print('Examining volume for contract %s.' % contracts[i])
-                print('Pair:' + name_data['pair']['token0']['symbol'] + '/' + name_data['pair']['token1']['symbol'])
+    for name, hits in results.items():
+        print('%s: %s. %d hits.' % (name, DETECTORS[name]['description'], np.count_nonzero(hits)))
 
-                vol_mean = np.mean(vol[0:len_desired-3])
-                vol_std = np.std(vol[0:len_desired-3]) # leave last two elements for examination
+        for i in np.flatnonzero(hits):
+            pair_string = PairName(pairs[i])
+            print('  %s (contract %s). Plotting:' % (pair_string, pairs[i]['id']))
 
-                yesterdays_vol_dev = vol[len_desired - 2] - vol_mean
-                todays_vol_dev = vol[len_desired - 1] - vol_mean
-
-                k_cheby_yesterday = np.abs(yesterdays_vol_dev)/vol_std
-                p_cheby_yesterday = 1/(k_cheby_yesterday)**2
+            renderer.submit(name + '-' + pair_string, vol_matrix[i])
 
-                k_cheby_today = np.abs(todays_vol_dev) / vol_std
-                p_cheby_today = 1 / (k_cheby_today) ** 2
+    renderer.close()
 
-                if(p_cheby_yesterday < cheby_thresh):
-                    if(yesterdays_vol_dev < 0):
-                        print('Yesterday, volume was anomalously low for this coin. Ignoring...')
-                    else:
-                        print('Yesterday, volume was anomalously high for this coin. Checking todays volume...')
-
-                        if(p_cheby_today < cheby_thresh and todays_vol_dev > 0):
-                            if(todays_vol_dev < yesterdays_vol_dev):
-                                print('Todays volume is also anomalous. Probably too late tho. Ignore.')
-                            elif(p_cheby_today < cheby_thresh and todays_vol_dev > 0 and todays_vol_dev > yesterdays_vol_dev):
-                                print('Today, volume was anomalously high too and maybe a chance for something.')
-                                plt.bar(np.arange(0, len_desired), vol)
-                                plt.show()
-                                plt.clf()
-                            else:
-                                print('Today, volume was anomalously high too but probably too late.')
-                                #plt.bar(np.arange(0, len_desired), vol)
-                                #plt.show()
-                                #plt.clf()
-
-                        else:
-                            print('Todays volume is not anomalous, likely pumped already, ignoring...')
-
-                if(p_cheby_today < cheby_thresh and p_cheby_yesterday >= cheby_thresh): # plot all anomalous vols that were not caputred above
-
-                    if(todays_vol_dev < 0):
-                        print('Today, volume was anomalously low for this coin. Ignoring...')
-                    else:
-                        print('Today, volume was anomalously high for this coin. Plotting volume chart')
-                        plt.bar(np.arange(0, len_desired), vol)
-                        plt.show()
-                        plt.clf()
-
-                time.sleep(0.1) # so i don't get DDOS warning (idk how fast i can poll yet)
-
-    else:
-        print('you did not press 1 or 2 or 3')
 
 if __name__ == "__main__":
     main()
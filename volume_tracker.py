@@ -1,17 +1,34 @@
 # Graphql
 
-import matplotlib.pyplot as plt
-# from matplotlib.pyplot import figure
 import numpy as np
 
 import time
 import datetime
 import pytz
-import json
+import os
+import multiprocessing
+import queue
 
 import requests
 
-from graphqlstuff import GetFirstThousandPairs, ConvertTimeStampsToBlocks, GetVolumeStatistics
+from graphqlstuff import IterAllPairs, ConvertTimeStampsToBlocks, rate_controller
+from pair_cache import PairCache
+from query_planner import SnapshotPlanner
+from block_estimator import BlockEstimator
+from day_data import DayDataVolumes, UtcMidnight, SECONDS_PER_DAY
+from hour_data import HourlyTracker, HOURLY_WINDOW, SECONDS_PER_HOUR
+from pair_table import PairTable
+from scheduler import ScanScheduler
+from anomaly import DailyVolumes, TotalVolumeMatrix, MaxVolumeHits
+from charts import ChartRenderer, IMAGE_DIR
+from scan_history import ScanHistory
+from notifier import DiscordNotifier
+import metrics
+from metrics import TimeStage
+from sharding import ShardManager, ShardOf, ShardAuthkey, RunWorker, SHARD_BATCH, SHARD_PORT, SHARD_TIMEOUT
+from streaming import RunStreaming
+from results_api import ResultsStore, StartResultsServer, RESULTS_PORT as DEFAULT_RESULTS_PORT
+from scan_export import ExportScan, PruneScans, EXPORT_DIR
 
 # Constants
 LOOKBACK_PERIOD = 10  # days
@@ -20,17 +37,102 @@ TIMEZONE_DALLAS = pytz.timezone('America/Chicago')
 MAX_DATA_LENGTH = 5  # how many recent objects should be in data.json
 
 HOW_MANY_TO_SEARCH = 1000
-
-DISCORD_WEBHOOK_URL = "https://discord.com/api/webhooks/801724295751139328/aLNTXeNdZcAahKA2r02wSxt-YIzEGlYtcvO0TPObPHoCFb9Puk_wu-WXs9uZ8xxZ4ecu"
+SCAN_INTERVAL = 600  # seconds between scans
+SCAN_ALL_PAIRS = False  # page through every pair instead of the top HOW_MANY_TO_SEARCH
+
+# the earlier day boundaries are rounded down to this many seconds, so they
+# repeat between scans and come out of the block cache and snapshot store.
+# The latest day is always the 24hrs up to now.
+TIMESTAMP_GRID = 60 * 60
+
+# interpolate day boundary blocks from known blocks instead of asking the
+# blocks subgraph, as long as the estimate is within MAX_BLOCK_ERROR blocks
+ESTIMATE_BLOCKS = True
+MAX_BLOCK_ERROR = 50
+
+# how many (pair, block) snapshots to pack into one subgraph request
+SNAPSHOT_BATCH_ALIASES = 250
+SNAPSHOT_BATCH_BYTES = None  # optional cap on expected response size
+MAX_IN_FLIGHT = 16  # how many subgraph requests can run at once
+
+# where daily volume comes from:
+#   'snapshots' - volumeUSD at the start of each 24hr period, differenced
+#   'day_data'  - the subgraph's pairDayDatas (UTC days, the last one is
+#                 today so far), plus one live snapshot per pair
+#   'hour_data' - the subgraph's pairHourDatas, kept in a rolling window
+#                 between scans (see hour_data.py), scanned every
+#                 HOURLY_SCAN_INTERVAL
+VOLUME_SOURCE = os.environ.get('TRAWLER_VOLUME_SOURCE', 'snapshots')
+HOURLY_SCAN_INTERVAL = 120  # seconds
+
+# refresh only as many pairs each scan as fit in this many subgraph requests
+# a minute, the ones closest to a hit first, and keep the last volumes for
+# the rest (see scheduler.py). 0 = refresh every pair every scan
+REQUESTS_PER_MINUTE = float(os.environ.get('TRAWLER_REQUESTS_PER_MINUTE', 0))
+
+# Prometheus metrics are served on http://<host>:METRICS_PORT/metrics (0 = off)
+METRICS_PORT = int(os.environ.get('TRAWLER_METRICS_PORT', metrics.METRICS_PORT))
+
+# split the scan across this many worker processes (1 = no sharding). With
+# SHARD_WORKERS = 'remote' the workers are started by hand on other hosts
+# (see sharding.py) instead of here, and TRAWLER_SHARD_AUTHKEY has to be set
+NUM_SHARDS = int(os.environ.get('TRAWLER_SHARDS', 1))
+SHARD_WORKERS = os.environ.get('TRAWLER_SHARD_WORKERS', 'local')
+
+# follow new blocks over this node websocket (e.g. wss://...) and re-check
+# pairs as soon as they swap, between the regular scans. Unset = just scan
+ETH_WS_URL = os.environ.get('TRAWLER_ETH_WS_URL')
+
+# the latest scans are served read-only on http://<host>:RESULTS_PORT/ (0 = off)
+RESULTS_PORT = int(os.environ.get('TRAWLER_RESULTS_PORT', DEFAULT_RESULTS_PORT))
+
+DISCORD_WEBHOOK_URL = os.environ.get('DISCORD_WEBHOOK_URL', "https://discord.com/api/webhooks/801724295751139328/aLNTXeNdZcAahKA2r02wSxt-YIzEGlYtcvO0TPObPHoCFb9Puk_wu-WXs9uZ8xxZ4ecu")
 
 
 def getCurrentTime():
     return datetime.datetime.now(TIMEZONE_DALLAS).strftime("%m/%d/%Y %H:%M:%S"),
 
 
-def main():
-    while(1):
-
+def PairName(pair):
+    return pair['token0']['symbol'] + '-' + pair['token1']['symbol']
+
+
+# tv_volume lists at Return24hrTimestamps' blocks (None for missing) ->
+# (pairs, days) daily volume array and (pairs,) hits. The gap between the
+# last earlier day and the latest 24hrs is left out.
+def DetectHits(tv_volumes):
+    total_vol = TotalVolumeMatrix(tv_volumes, LOOKBACK_PERIOD + 2)
+    vol_matrix = np.delete(DailyVolumes(total_vol), -2, axis=1)
+    return vol_matrix, MaxVolumeHits(vol_matrix)
+
+
+# Everything a scan needs, kept between scans so the caches stay warm
+class Scanner(object):
+
+    def __init__(self, webhook_url=DISCORD_WEBHOOK_URL, image_dir=IMAGE_DIR, volume_source=VOLUME_SOURCE,
+                 requests_per_minute=REQUESTS_PER_MINUTE, export_dir=EXPORT_DIR):
+        if requests_per_minute > 0 and volume_source == 'hour_data':
+            raise ValueError('the scan scheduler needs daily volumes, not hour_data')
+
+        self.volume_source = volume_source
+        self.hourly = HourlyTracker() if volume_source == 'hour_data' else None
+        self.table = PairTable(HOURLY_WINDOW + 1 if volume_source == 'hour_data' else LOOKBACK_PERIOD)
+        self.scheduler = ScanScheduler(requests_per_minute, SCAN_INTERVAL) if requests_per_minute > 0 else None
+        self.planner = SnapshotPlanner(max_aliases=SNAPSHOT_BATCH_ALIASES, max_response_bytes=SNAPSHOT_BATCH_BYTES,
+                                       max_in_flight=MAX_IN_FLIGHT)
+        self.estimator = BlockEstimator(max_error_blocks=MAX_BLOCK_ERROR)
+        self.pair_cache = PairCache()
+        self.renderer = ChartRenderer(image_dir=image_dir)
+        self.history = ScanHistory(recent=MAX_DATA_LENGTH)
+        self.notifier = DiscordNotifier(webhook_url)
+        self.results = ResultsStore()
+        self.export_dir = export_dir
+
+    # Scan every pair once, save the results and tell discord about new finds.
+    # Every stage is timed into metrics.stage_seconds.
+    def scan_once(self):
+        scan_started = time.time()
+        scan_requests = self.count_requests()
         scan = {
             'start_time': getCurrentTime(),
             'end_time': None,
@@ -38,9 +140,6 @@ def main():
             'pairs': [],
         }
 
-        # Get 1000 pairs
-        pairs = GetFirstThousandPairs()
-
         # get time now.
         # calculate times going back every 24hrs for 30 days
         # int truncates ms, which aren't important for us.
@@ -48,96 +147,354 @@ def main():
         time_now = int(time.time()) - 300
 
         # get date 30 days before this moment.
-        timestamps = Return24hrTimestamps(time_now, LOOKBACK_PERIOD)
-        blocks = ConvertTimeStampsToBlocks(timestamps)
-
-        for i in range(0, HOW_MANY_TO_SEARCH):
-            if (i % 50 == 0):
-                print('Got through %d so far' % i)
-
-            # Pair data
-            pair = pairs[i]
-            token0 = pair['token0']
-            token1 = pair['token1']
-            pair_string = token0['symbol'] + '-' + token1['symbol']
-            pair_address = pair['id']
-
-            # get 10-30 days worth of volume statistics for a given currency
-            tv_data = GetVolumeStatistics(pair_address, blocks)
-            len_desired = LOOKBACK_PERIOD
-
-            if ((tv_data == None) or (len(tv_data) != LOOKBACK_PERIOD + 1)):
-                print('Pair %s full historical data not available. Examine it manually.' % pair_string)
-                time.sleep(0.1)
+        timestamps = Return24hrTimestamps(time_now, LOOKBACK_PERIOD, TIMESTAMP_GRID)
+        if self.volume_source == 'day_data':
+            timestamps = [UtcMidnight(time_now)]  # only need today's first block
+        elif self.volume_source == 'hour_data':
+            timestamps = []  # no blocks needed at all
+
+        with TimeStage('block_resolution'):
+            if len(timestamps) == 0:
+                blocks = []
+            elif ESTIMATE_BLOCKS:
+                blocks = self.estimator.convert(timestamps)
             else:
-                vol = CalculateVolFromTotalVol(tv_data)
-
-                print('Examining Volume for Pair:' + pair_string)
-                print('Contract: %s.' % pair_address)
+                blocks = ConvertTimeStampsToBlocks(timestamps)
+
+        # Get the 1000 most active pairs (token data comes from the pair cache),
+        # or stream every pair there is (then listing is timed as part of the
+        # volume fetch, since the two overlap)
+        with TimeStage('pair_listing'):
+            if SCAN_ALL_PAIRS:
+                pairs = IterAllPairs()
+            else:
+                self.pair_cache.reset_stats()
+                pairs = self.pair_cache.refresh(HOW_MANY_TO_SEARCH)
+                print('Listed pairs:', self.pair_cache.stats())
+
+        # Only refresh the pairs the scheduler picks
+        if self.scheduler != None:
+            pairs = list(pairs)
+            listed_rows = self.table.add(pairs)
+            pairs = [pairs[i] for i in self.scheduler.select(listed_rows, time.time())]
+
+        volume_requests = self.count_requests()
+        scanned_pairs, vol_matrix, hits = self.scan_pairs(pairs, blocks, timestamps)
+        volume_requests = self.count_requests() - volume_requests
+
+        # From here on pairs are rows of the pair table, not dicts
+        rows = self.table.add(scanned_pairs)
+        self.table.volumes.write(rows, vol_matrix)
+
+        # then look at every listed pair, with the latest volumes we have for it
+        staleness = None
+        schedule = None
+        if self.scheduler != None:
+            now = time.time()
+            self.scheduler.refreshed(rows, now, vol_matrix)
+            self.scheduler.record_cost(self.count_requests() - scan_requests, volume_requests, len(rows))
+            schedule = self.scheduler.stats(listed_rows, now, len(rows))
+            print('Schedule:', schedule)
+
+            rows = listed_rows
+            vol_matrix = self.table.volumes.view()[rows]
+            hits = MaxVolumeHits(vol_matrix)
+            staleness = self.scheduler.staleness(rows, now)
+
+        scan['num_searched'] = len(rows)
+        print('Examined volume for %d pairs, %d hits.' % (len(rows), np.count_nonzero(hits)))
+        print('Pair table:', self.table.stats())
+
+        with TimeStage('plotting'):
+            for i in np.flatnonzero(hits):
+                pair_string = self.table.name(rows[i])
+                address = self.table.address(rows[i])
+                vol = vol_matrix[i]
+
+                # if most recent period is max, take a closer look:
+                print('24hr volume is most in 10 day period for pair %s. Plotting:' % pair_string)
+                print('Contract: %s.' % address)
+
+                # Append find to data for this scan
+                pair_object = {
+                    'name': pair_string,
+                    'address': address,
+                    # 'volumes': vol,
+                    'time': getCurrentTime(),
+                }
+                scan['pairs'].append(pair_object)
+
+                # Save img and plot (in the background)
+                self.renderer.submit(pair_string, vol)
+
+        print('Fetched volume statistics:', self.planner.stats())
+        print('Subgraph rate:', rate_controller.stats())
+        print('Charts:', self.renderer.stats())
 
-                if (np.argmax(vol) == len_desired - 1 and (np.max(vol) < 2.5 * float(np.max(vol[0:len_desired - 2])))):
-                    # if most recent period is max, take a closer look:
-                    print('24hr volume is most in 10 day period for pair %s. Plotting:' % pair_string)
+        # Finalize the scan object
+        scan['end_time'] = getCurrentTime();
 
-                    plt.bar(np.arange(0, len_desired), vol)
+        with TimeStage('persistence'):
+            # Get new pairs we should be notified about
+            new_pairs = self.history.new_pairs(scan)
 
-                    # Append find to data for this scan
-                    pair_object = {
-                        'name': pair_string,
-                        'address': pair['id'],
-                        # 'volumes': vol,
-                        'time': getCurrentTime(),
-                    }
-                    scan['pairs'].append(pair_object)
+            # Append current scan to the history, and refresh data.json
+            self.history.append(scan)
+            self.history.write_data_json()
 
-                    # Save img and plot
-                    fileStr = pair_string
-                    plt.title(fileStr)
-                    plt.savefig('./images/' + fileStr)
-                    plt.clf()
+            # Hand the scan to the results API
+            results = self.results.publish(scan, self.table, rows, vol_matrix, hits, staleness, schedule)
 
-                time.sleep(0.1)  # so i don't get DDOS warning (idk how fast i can poll yet)
+            # and save its volumes for later analysis
+            if self.export_dir:
+                column_starts, column_seconds = self.column_times(time_now, timestamps)
+                ExportScan(self.export_dir, results, scan_started, self.volume_source, column_starts, column_seconds)
+                PruneScans(self.export_dir)
 
-        # Finalize the scan object
-        scan['end_time'] = getCurrentTime();
+        # Tell discord about the new pairs / current scan
+        with TimeStage('discord'):
+            discord_string = formatDiscordString(scan, new_pairs)
+            if(discord_string != None):
+                self.notifier.notify(discord_string)  # sent in the background
 
-        # Get new pairs we should be notified about
-        new_pairs = compare_old_and_new(scan)
+        print('final new pairs', new_pairs)
+        discord_stats = self.notifier.stats()
+        print('Discord:', discord_stats)
+
+        metrics.discord_pending.set(discord_stats['pending'])
+        metrics.scan_pairs.set(len(rows))
+        metrics.scan_hits.set(len(scan['pairs']))
+        metrics.scans_total.inc()
+        metrics.stage_seconds.observe(time.time() - scan_started, stage='total')
+        metrics.last_stage_seconds.set(time.time() - scan_started, stage='total')
+
+        return scan
+
+    # When each column of the scan's volumes starts, and how long columns are
+    def column_times(self, time_now, timestamps):
+        if self.volume_source == 'day_data':
+            first_day = UtcMidnight(time_now) - (LOOKBACK_PERIOD - 1) * SECONDS_PER_DAY
+            return [first_day + day * SECONDS_PER_DAY for day in range(0, LOOKBACK_PERIOD)], SECONDS_PER_DAY
+        if self.volume_source == 'hour_data':
+            first_hour = self.hourly.last_hour - HOURLY_WINDOW + 1
+            return [(first_hour + hour) * SECONDS_PER_HOUR for hour in range(0, HOURLY_WINDOW + 1)], SECONDS_PER_HOUR
+        return timestamps[:-3] + timestamps[-2:-1], SECONDS_PER_DAY
+
+    # Subgraph requests made so far, for the scheduler's cost estimates
+    def count_requests(self):
+        return metrics.requests_total.total()
+
+    # Fetch volume for every pair and run detection over it.
+    # Returns (pairs scanned, (pairs, days) daily volume array, (pairs,) hits)
+    def scan_pairs(self, pairs, blocks, timestamps):
+        if self.volume_source == 'day_data':
+            return self.scan_pairs_day_data(pairs, blocks[0], timestamps[0])
+        if self.volume_source == 'hour_data':
+            return self.scan_pairs_hour_data(pairs)
+
+        # get 10-30 days worth of volume statistics for every pair we're searching.
+        # volume fetches start as soon as the first pairs are listed
+        with TimeStage('volume_fetch'):
+            self.planner.reset_stats()
+            pair_volumes = self.planner.iter_volume_statistics(pairs, blocks, key=lambda pair: pair['id'])
+
+            scanned_pairs = []
+            tv_volumes = []
+            missing_history = 0
+            for i, (pair, tv_data) in enumerate(pair_volumes):
+                if (i % 50 == 0):
+                    print('Got through %d so far' % i)
+
+                if ((tv_data == None) or (len(tv_data) != len(blocks))):
+                    print('Pair %s full historical data not available. Examine it manually.' % PairName(pair))
+                    missing_history += 1
+
+                scanned_pairs.append(pair)
+                tv_volumes.append(tv_data)
+
+        metrics.scan_missing_history.set(missing_history)
+
+        # Look at every pair's volume at once
+        with TimeStage('detection'):
+            vol_matrix, hits = DetectHits(tv_volumes)
+
+        return scanned_pairs, vol_matrix, hits
+
+    # Same, from pairDayDatas. Pairs are listed up front, since day data is
+    # fetched for many pairs per request.
+    def scan_pairs_day_data(self, pairs, midnight_block, midnight):
+        with TimeStage('volume_fetch'):
+            self.planner.reset_stats()
+            scanned_pairs = list(pairs)
+            vol_matrix = DayDataVolumes(scanned_pairs, midnight, midnight_block, LOOKBACK_PERIOD, self.planner)
+
+        missing_history = np.count_nonzero(np.isnan(vol_matrix).any(axis=1))
+        print('%d pairs without full historical data.' % missing_history)
+        metrics.scan_missing_history.set(missing_history)
+
+        with TimeStage('detection'):
+            hits = MaxVolumeHits(vol_matrix)
+
+        return scanned_pairs, vol_matrix, hits
+
+    # Same, hourly. Rows are the last HOURLY_WINDOW finished hours and then
+    # the current hour so far, which is what gets scored.
+    def scan_pairs_hour_data(self, pairs):
+        with TimeStage('volume_fetch'):
+            scanned_pairs = list(pairs)
+            rows, current = self.hourly.update(scanned_pairs, int(time.time()))
+
+        stats = self.hourly.stats
+        missing_history = np.count_nonzero(stats.count[rows] < stats.window - stats.holdout)
+        print('%d pairs without full historical data.' % missing_history)
+        metrics.scan_missing_history.set(missing_history)
+
+        with TimeStage('detection'):
+            hits = self.hourly.hits(current)[rows]
+
+        vol_matrix = np.hstack([stats.window_values(), current[:, None]])[rows]
+        return scanned_pairs, vol_matrix, hits
+
+    def close(self):
+        self.renderer.close()
+        if not self.notifier.flush():
+            print('%d discord messages not sent yet, they stay in the outbox for next time' %
+                  self.notifier.stats()['pending'])
+        self.notifier.close()
+
+
+# Scanner that hands volume fetching and detection to shard workers and
+# merges their results, see sharding.py. Everything else (blocks, pair
+# listing, charts, history, discord) still happens here, once per scan.
+class ShardedScanner(Scanner):
+
+    def __init__(self, num_shards, port=None, local_workers=True, **kwargs):
+        authkey = ShardAuthkey(local_workers)  # before starting anything, remote needs one set
+
+        kwargs['volume_source'] = 'snapshots'  # workers only fetch snapshots
+        Scanner.__init__(self, **kwargs)
+        self.num_shards = num_shards
+        self.cycle = 0
+        self.shard_requests = 0  # made by the workers, as they report back
+
+        # only listen beyond this machine, and on a known port, when the
+        # workers are elsewhere. Local workers are told whatever port we got.
+        if port == None:
+            port = 0 if local_workers else SHARD_PORT
+        context = multiprocessing.get_context('spawn')
+        self.manager = ShardManager(address=('127.0.0.1' if local_workers else '', port), authkey=authkey, ctx=context)
+        self.manager.start()
+        self.tasks = [self.manager.get_task_queue(shard) for shard in range(0, num_shards)]
+        self.shard_results = self.manager.get_result_queue()
+
+        self.workers = []
+        if local_workers:
+            address = ('127.0.0.1', self.manager.address[1])
+            for shard in range(0, num_shards):
+                worker = context.Process(target=RunWorker, args=(address, shard, authkey), name='shard-%d' % shard)
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def scan_pairs(self, pairs, blocks, timestamps=None):
+        self.cycle += 1
+
+        with TimeStage('volume_fetch'):
+            for tasks in self.tasks:
+                tasks.put({'type': 'start', 'cycle': self.cycle, 'blocks': blocks})
+
+            # hand pairs out as they're listed
+            scanned_pairs = []
+            position = {}
+            shard_sizes = [0] * self.num_shards
+            batches = [[] for shard in range(0, self.num_shards)]
+            for pair in pairs:
+                position[pair['id']] = len(scanned_pairs)
+                scanned_pairs.append(pair)
+
+                shard = ShardOf(pair['id'], self.num_shards)
+                shard_sizes[shard] += 1
+                batches[shard].append(pair)
+                if len(batches[shard]) >= SHARD_BATCH:
+                    self.tasks[shard].put({'type': 'pairs', 'cycle': self.cycle, 'pairs': batches[shard]})
+                    batches[shard] = []
+
+            for shard in range(0, self.num_shards):
+                if len(batches[shard]) > 0:
+                    self.tasks[shard].put({'type': 'pairs', 'cycle': self.cycle, 'pairs': batches[shard]})
+                self.tasks[shard].put({'type': 'end', 'cycle': self.cycle})
+
+            # pairs from shards that never report back count as missing history
+            vol_matrix = np.full((len(scanned_pairs), LOOKBACK_PERIOD), np.nan)
+            hits = np.zeros(len(scanned_pairs), dtype=bool)
+            missing_history = 0
+            detection_seconds = 0
+
+            waiting = set(range(0, self.num_shards))
+            deadline = time.time() + SHARD_TIMEOUT
+            while len(waiting) > 0:
+                try:
+                    result = self.shard_results.get(timeout=max(0.1, deadline - time.time()))
+                except queue.Empty:
+                    print('Shards %s did not report back in time.' % sorted(waiting))
+                    missing_history += sum(shard_sizes[shard] for shard in waiting)
+                    break
+
+                if result['cycle'] != self.cycle:
+                    continue  # late result from a scan we gave up on
+
+                waiting.discard(result['shard'])
+                rows = [position[pair_id] for pair_id in result['ids']]
+                if len(rows) > 0:
+                    vol_matrix[rows] = result['vol_matrix']
+                    hits[rows] = result['hits']
+                missing_history += result['missing']
+                self.shard_requests += result['stats']['requests']
+                detection_seconds = max(detection_seconds, result['detection_seconds'])
+                print('Shard %d: %d pairs in %.1fs, %d hits. %s' % (result['shard'], len(rows), result['fetch_seconds'],
+                                                                   np.count_nonzero(result['hits']), result['stats']))
+
+        metrics.scan_missing_history.set(missing_history)
+        metrics.stage_seconds.observe(detection_seconds, stage='detection')
+        metrics.last_stage_seconds.set(detection_seconds, stage='detection')
+
+        return scanned_pairs, vol_matrix, hits
+
+    def count_requests(self):
+        return Scanner.count_requests(self) + self.shard_requests
+
+    def close(self):
+        Scanner.close(self)
+        for worker in self.workers:
+            worker.terminate()
+        self.manager.shutdown()
 
-        # Write current scan to file
-        write_to_json(scan)
 
-        # Tell discord about the new pairs / current scan
-        discord_string = formatDiscordString(scan, new_pairs)
-        if(discord_string != None):
+def main():
+    if METRICS_PORT:
+        metrics.StartMetricsServer(METRICS_PORT)
 
-            len_string = len(discord_string)
+    if NUM_SHARDS > 1:
+        scanner = ShardedScanner(NUM_SHARDS, local_workers=(SHARD_WORKERS == 'local'))
+    else:
+        scanner = Scanner()
+    if RESULTS_PORT:
+        StartResultsServer(scanner.results, RESULTS_PORT)
 
-            if len_string < 2000:
-                pingDiscord({'content': discord_string})
-            else:
-                len_msg_i = [0]
-                i = 0
-                while i < len_string:  # figure out how long each message is such that each new message starts with '-'
-                    i = i + 2000
-                    if i > len_string:
-                        len_msg_i.append(len_string - 1)  # can send the whole remaining message
-                    else:
-                        while (not(discord_string[i] == '-' and discord_string[i+1] == ' ')):
-                            i = i - 1
-                        len_msg_i.append(i)
-
-                for i in range(0, len(len_msg_i) - 1):
-                    pingDiscord({'content': discord_string[len_msg_i[i]:len_msg_i[i + 1]]})
+    if ETH_WS_URL:
+        if scanner.volume_source == 'hour_data':
+            raise ValueError('streaming needs daily volumes, not hour_data')
+        RunStreaming(scanner, ETH_WS_URL, SCAN_INTERVAL)
 
-        print('final new pairs', new_pairs)
+    while(1):
+        scanner.scan_once()
+        time.sleep(HOURLY_SCAN_INTERVAL if scanner.volume_source == 'hour_data' else SCAN_INTERVAL)
 
-        time.sleep(600)
 
 def formatDiscordString(scan, new_pairs):
     strs = []
 
-    strs.append('~~~ \n Scanned {0} pairs from ({1} - {2}).'.format(HOW_MANY_TO_SEARCH, scan['end_time'][0],
+    strs.append('~~~ \n Scanned {0} pairs from ({1} - {2}).'.format(scan['num_searched'], scan['end_time'][0],
                                                                     scan['end_time'][0]))
 
     if len(new_pairs) > 0:
@@ -171,61 +528,23 @@ def formatDiscordString(scan, new_pairs):
     return None
 
 
-def compare_old_and_new(current_scan):
-    # Open database
-    with open('./data.json', 'r') as r:
-        try:
-            data = json.load(r)
-        except:
-            print('EXCEPTION LOADING DATA')
-            return []
-
-        # Get last known found token pairs
-        last_known_snapshot = data[-1]
-
-        # Get the pairs for old snap and current snap
-        old_pairs = list(map((lambda x: x['name']), last_known_snapshot['pairs']))
-        current_pairs = list(map((lambda x: x['name']), current_scan['pairs']))
-
-        # Figure out which pairs are "new" by comparing
-        new_pairs = list(set(current_pairs) - set(old_pairs))
-        return new_pairs
-
-
-def write_to_json(scan_obj):
-    with open('./data.json', 'r') as r:
-        try:
-            data = json.load(r)
-        except:
-            data = []
-
-    with open('data.json', 'w') as f:
-
-        # print('data', data, type(data), len(data))
-        # print('scan_obj', scan_obj)
-
-        if len(data) >= MAX_DATA_LENGTH:
-            data.pop(0)
-
-        data.append(scan_obj)
-        # print('output', data)
-
-        json.dump(data, f, indent=4)
-        print('Wrote to file.')
-
-    return
-
-
 # given a timestamp, generate the set of timestamps going back in time in 24hr intervals
 # for num_days days. timestamps are ordered from past to future
 # ordering is:
-#   [now - 24h*num_days , ... , now - 24h, now]
-# so length is num_days+1.
-def Return24hrTimestamps(init_timestamp, num_days):
-    timestamps = [None] * (num_days + 1)
-
-    for i in range(0, num_days + 1):
-        timestamps[num_days - i] = init_timestamp - (24 * 60 * 60) * (i)
+#   [anchor - 24h*(num_days-1), ... , anchor - 24h, now - 24h, now]
+# so length is num_days+2, where anchor is 'now' rounded down to a multiple
+# of grid seconds. Every window is exactly 24hrs: the earlier days repeat
+# between scans (and come out of the caches), the latest is up to now. The
+# window from anchor - 24h to now - 24h is a gap, shorter than grid, that
+# DetectHits leaves out.
+def Return24hrTimestamps(init_timestamp, num_days, grid=1):
+    timestamps = [None] * (num_days + 2)
+    anchor = init_timestamp - init_timestamp % grid
+
+    for i in range(1, num_days + 1):
+        timestamps[num_days - i] = anchor - (24 * 60 * 60) * (i)
+    timestamps[num_days] = init_timestamp - 24 * 60 * 60
+    timestamps[num_days + 1] = init_timestamp
 
     return timestamps
 
@@ -240,21 +559,6 @@ def CalculateVolFromTotalVol(total_vol):
     return dv_vol
 
 
-def pingDiscord(data):
-    headers = {
-        'Content-Type': 'application/json'
-    }
-
-    url = DISCORD_WEBHOOK_URL
-
-    json_data = json.dumps(data)
-
-    try:
-        requests.post(url, json=data, headers=headers)
-    except:
-        print('could not send to discord.')
-
-
 def shorten_url(longURL):
     endpoint = "http://ow.ly/api/1.1/url/shorten?apiKey={0}&longUrl={1}".format(apiKey, longURL)
     try: